@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+
+DEFAULT_FLOWS = (100, 1000, 10000)
+# share of the flows replaced between the apply and the sync phases
+DEFAULT_CHURN = 0.1
+
+PHASES = ('apply', 'sync', 'withdraw')
+
+
+def _flows(count: int,
+           offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    flows as the api returns them for a mikrotik device (the status is popped by get_flows_from_api)
+    """
+    result = []
+    for index in range(offset, offset + count):
+        result.append({
+            'id': f'{index + 1:024x}',
+            'chain': 'prerouting',
+            'action': 'drop',
+            'protocol': 'udp',
+            'src-address': f'10.{(index >> 16) & 0xff}.{(index >> 8) & 0xff}.{index & 0xff}/32',
+            'dst-address': '192.0.2.1/32',
+            'dst-port': str(1024 + index % 60000),
+        })
+    return result
+
+
+def _write_config(folder: str,
+                  credentials: Dict[str, Any],
+                  api_port: int) -> str:
+    config = dict(credentials,
+                  identifier=f'{1:024x}',
+                  url_scheme='http',
+                  url_host='127.0.0.1',
+                  url_port=api_port,
+                  spool=False,
+                  heartbeats_path=os.path.join(folder, 'heartbeats'))
+    filename = os.path.join(folder, 'mikrotik.conf')
+    with open(filename, 'w') as f:
+        json.dump(config, f)
+    return filename
+
+
+def _init(worker_cls, config: str):
+    worker = worker_cls(config=config).devices[0]
+    command_worker, resource = worker.init_command_worker_and_resource()
+    if not command_worker:
+        raise RuntimeError(f'{worker_cls.__name__} failed to connect to the router simulator')
+    return worker, command_worker, resource
+
+
+def _measure(router, api, func, *args, **kwargs) -> Dict[str, Any]:
+    before, requests = router.stats, api.requests
+    start = time.perf_counter()
+    success = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    after = router.stats
+    return dict(success=bool(success),
+                seconds=elapsed,
+                api_requests=api.requests - requests,
+                **{_: after[_] - before[_] for _ in ('sentences', 'reads', 'rows_read', 'adds', 'removes', 'traps')})
+
+
+def benchmark_flows(count: int,
+                    churn: float,
+                    router,
+                    api,
+                    config: str) -> Dict[str, Dict[str, Any]]:
+    from workers.device_controller import DeviceController
+    from workers.flows_applier import FlowsApplier
+    from workers.flows_sync import FlowsSync
+
+    router.clear()
+    results = {}
+
+    applier, command_worker, resource = _init(FlowsApplier, config)
+    results['apply'] = _measure(router, api, applier.handle_flows,
+                                flows_by_status={'apply': _flows(count)},
+                                command_worker=command_worker,
+                                resource=resource,
+                                credentials=command_worker.credentials)
+    results['apply']['rules'] = len(router.table('/ip/firewall/raw'))
+
+    # the backend replaced some of the flows - the sync applies the new ones and removes the stale ones
+    replaced = int(count * churn)
+    syncer, command_worker, resource = _init(FlowsSync, config)
+    results['sync'] = _measure(router, api, syncer.handle_flows,
+                               flows_by_status={'apply': _flows(count - replaced, offset=replaced) +
+                                                         _flows(replaced, offset=count)},
+                               command_worker=command_worker,
+                               resource=resource,
+                               credentials=command_worker.credentials)
+    results['sync']['rules'] = len(router.table('/ip/firewall/raw'))
+
+    controller = DeviceController(config=config).devices[0]
+    results['withdraw'] = _measure(router, api, controller.remove_all_flows)
+    results['withdraw']['rules'] = len(router.table('/ip/firewall/raw'))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Mikrotik Flows Benchmark (local RouterOS API simulator)')
+
+    parser.add_argument('--flows', type=int, action='append',
+                        help=f'number of flows to apply, sync and withdraw '
+                             f'(default: {", ".join(map(str, DEFAULT_FLOWS))})')
+    parser.add_argument('--churn', type=float, default=DEFAULT_CHURN,
+                        help='share of the flows replaced before the sync')
+    parser.add_argument('--latency', type=float, default=0.0, help='router latency per API sentence (seconds)')
+    parser.add_argument('--save', type=str, default=None, help='file to save the results to')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from simulators.routeros import RouterOsApiSimulator
+    from simulators.secunity_api import start_api_server
+
+    api = start_api_server()
+    router = RouterOsApiSimulator(latency=args.latency).start()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        config = _write_config(folder, router.credentials(), api.server_port)
+        print(f'{"flows":>7} {"phase":<9}{"seconds":>9}{"sentences":>11}{"reads":>8}{"rows read":>11}{"adds":>7}'
+              f'{"removes":>9}{"api calls":>11}{"rules left":>12}')
+        for count in args.flows or DEFAULT_FLOWS:
+            results[count] = benchmark_flows(count, churn=args.churn, router=router, api=api, config=config)
+            for phase in PHASES:
+                result = results[count][phase]
+                print(f'{count:>7} {phase:<9}{result["seconds"]:>9.2f}{result["sentences"]:>11}{result["reads"]:>8}'
+                      f'{result["rows_read"]:>11}{result["adds"]:>7}{result["removes"]:>9}'
+                      f'{result["api_requests"]:>11}{result["rules"]:>12}')
+    router.stop()
+    api.shutdown()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
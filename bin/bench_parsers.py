@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+
+PARSED_VENDORS = ('juniper', 'huawei', 'mikrotik')
+DEFAULT_RULES = 1000
+DEFAULT_MIN_SECONDS = 1.0
+DEFAULT_TOLERANCE = 0.25
+
+# compared with the baseline, higher is better
+METRICS = ('lines_per_second', 'mb_per_second')
+
+
+def _parsers() -> Dict[str, Callable[[Dict[str, Any]], Tuple[List[Any], int, int]]]:
+    """
+    per vendor - parses the output of a transcript the way the agent does, returns the result, the parsed lines
+    (rows) and bytes
+    """
+    from command_workers.huawei import HuaweiCommandWorker
+    from command_workers.juniper import JuniperCommandWorker
+    from command_workers.mikrotik import MikrotikCommandWorker
+
+    juniper = JuniperCommandWorker()
+
+    def _juniper(transcript: Dict[str, Any]) -> Tuple[List[Any], int, int]:
+        params, lines = transcript.get('params') or {}, transcript['output']
+        result = juniper._filter_result(lines, interface_name=params.get('interface_name'),
+                                        ip_type=params.get('stats_type', 'IPv4'), model=params.get('model'))
+        return result, len(lines), sum(len(_) + 1 for _ in lines)
+
+    def _huawei(transcript: Dict[str, Any]) -> Tuple[List[Any], int, int]:
+        # the indexes are read from the routing table, the statistics follow the first form feed
+        lines = transcript['output']
+        lines = lines[:lines.index('\f')] if '\f' in lines else lines
+        return HuaweiCommandWorker.re_indexes('\n'.join(lines)), len(lines), sum(len(_) + 1 for _ in lines)
+
+    def _mikrotik(transcript: Dict[str, Any]) -> Tuple[List[Any], int, int]:
+        rows = transcript['output']
+        flows = MikrotikCommandWorker.filter_flows_by_prefix([dict(_) for _ in rows])
+        result = [MikrotikCommandWorker.from_mikrotik_flow(_, flow_number=True) for _ in flows]
+        return result, len(rows), sum(len(str(k)) + len(str(v)) for _ in rows for k, v in _.items())
+
+    return dict(juniper=_juniper, huawei=_huawei, mikrotik=_mikrotik)
+
+
+def _digest(result: List[Any]) -> str:
+    return hashlib.sha1(json.dumps(result, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def synthetic_corpus(rules: int) -> List[Dict[str, Any]]:
+    """
+    transcripts of the router simulators, used when no recorded corpus is given
+    """
+    from simulators.outputs import flowspec_rules, huawei_lines, juniper_output, mikrotik_rows
+
+    result = []
+    for ip_type in ('IPv4', 'IPv6'):
+        flowspec = flowspec_rules(rules, ip_type=ip_type)
+        result.append(dict(vendor='juniper', command='show firewall', params=dict(stats_type=ip_type),
+                           output=juniper_output(flowspec, ip_type=ip_type).splitlines(),
+                           expected=dict(count=rules + 4)))
+        result.append(dict(vendor='huawei', command='display bgp flow routing-table', params=dict(stats_type=ip_type),
+                           output=huawei_lines(flowspec), expected=dict(count=rules)))
+    result.append(dict(vendor='mikrotik', command='/ip/firewall/raw/print', params={},
+                       output=mikrotik_rows(flowspec_rules(rules)), expected=dict(count=rules)))
+    return result
+
+
+def benchmark_vendor(vendor: str,
+                     transcripts: List[Dict[str, Any]],
+                     parser: Callable[[Dict[str, Any]], Tuple[List[Any], int, int]],
+                     min_seconds: float) -> Dict[str, Any]:
+    failures = []
+    lines = size = 0
+    for transcript in transcripts:
+        result, transcript_lines, transcript_size = parser(transcript)
+        lines, size = lines + transcript_lines, size + transcript_size
+        expected = transcript.get('expected') or {}
+        name = transcript.get('filename') or f'{vendor} {transcript["command"]}'
+        if expected.get('count') is not None and len(result) != expected['count']:
+            failures.append(f'{name}: {len(result)} parsed items, expected {expected["count"]}')
+        elif expected.get('sha1') and _digest(result) != expected['sha1']:
+            failures.append(f'{name}: the parsed result changed')
+        transcript['result'] = result
+
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        for transcript in transcripts:
+            parser(transcript)
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+    return dict(vendor=vendor,
+                transcripts=len(transcripts),
+                lines=lines,
+                kib=size / 1024,
+                iterations=iterations,
+                lines_per_second=lines * iterations / elapsed,
+                mb_per_second=size * iterations / elapsed / 2 ** 20,
+                failures=failures)
+
+
+def check_regressions(results: List[Dict[str, Any]],
+                      baseline: Dict[str, Dict[str, Any]],
+                      tolerance: float) -> List[str]:
+    failures = []
+    for result in results:
+        expected = baseline.get(result['vendor'])
+        if not expected:
+            continue
+        for metric in METRICS:
+            if expected.get(metric) and result[metric] < expected[metric] * (1 - tolerance):
+                failures.append(f'{result["vendor"]} {metric} {result[metric]:.1f} < '
+                                f'{expected[metric]:.1f} -{tolerance:.0%}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Parsers Benchmark (replays recorded router outputs)')
+
+    parser.add_argument('--corpus', type=str, default=None,
+                        help='folder of transcripts recorded with "record_folder" (default: simulated outputs)')
+    parser.add_argument('--vendor', type=str, action='append', choices=PARSED_VENDORS,
+                        help='vendor to benchmark (default: all)')
+    parser.add_argument('--rules', type=int, default=DEFAULT_RULES, help='rules of the simulated outputs')
+    parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS,
+                        help='minimal time to replay the transcripts of a vendor')
+    parser.add_argument('--update-expected', action='store_true',
+                        help='store the current parsed results in the corpus as the expected ones')
+    parser.add_argument('--baseline', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed regression compared with the baseline (fraction)')
+    parser.add_argument('--save-baseline', type=str, default=None, help='file to save the results to')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from common.recorder import load_corpus
+
+    vendors = args.vendor or PARSED_VENDORS
+    transcripts = load_corpus(args.corpus, vendors=vendors) if args.corpus else synthetic_corpus(args.rules)
+    parsers = _parsers()
+
+    results: List[Dict[str, Any]] = []
+    print(f'{"vendor":<10}{"transcripts":>12}{"lines":>9}{"KiB":>10}{"iterations":>12}{"lines/sec":>13}'
+          f'{"MB/sec":>9}')
+    for vendor in vendors:
+        vendor_transcripts = [_ for _ in transcripts if _['vendor'] == vendor]
+        if not vendor_transcripts:
+            continue
+        result = benchmark_vendor(vendor, vendor_transcripts, parsers[vendor], min_seconds=args.min_seconds)
+        results.append(result)
+        print(f'{vendor:<10}{result["transcripts"]:>12}{result["lines"]:>9}{result["kib"]:>10.1f}'
+              f'{result["iterations"]:>12}{result["lines_per_second"]:>13.0f}{result["mb_per_second"]:>9.1f}')
+
+    if args.update_expected and args.corpus:
+        for transcript in transcripts:
+            if 'result' not in transcript:
+                continue
+            result = transcript.pop('result')
+            transcript['expected'] = dict(count=len(result), sha1=_digest(result))
+            filename = transcript.pop('filename')
+            with open(filename, 'w') as f:
+                json.dump(transcript, f, indent=1)
+        print(f'updated the expected results of {len(transcripts)} transcripts')
+
+    failures: List[str] = [_ for result in results for _ in result['failures']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_regressions(results, json.load(f), tolerance=args.tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({_['vendor']: {k: v for k, v in _.items() if k != 'failures'} for _ in results}, f, indent=2)
+
+    if failures and not args.update_expected:
+        print('\n'.join(['FAILED:'] + [f'  {_}' for _ in failures]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import gzip
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+
+DEFAULT_RULES = (100, 1000, 10000)
+DEFAULT_VENDORS = ('cisco', 'huawei')
+DEFAULT_REPEAT = 5
+
+
+def _best(func: Callable[[], Any],
+          repeat: int) -> Tuple[float, Any]:
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def codecs(payload: Dict[str, Any]) -> Dict[str, Tuple[Callable[[], bytes], Callable[[bytes], Any]]]:
+    """
+    name -> (agent side encode, backend side decode). "-plain" formats encode the lines as they are, the others
+    send the compact (templates + integer counters) stats encoding
+    """
+    from common.serializers import PAYLOAD_FORMAT, encode_json, encode_binary, decode_binary, \
+        is_payload_format_available
+
+    result = {
+        'json': (lambda: encode_json(payload), json.loads),
+        'json+gzip': (lambda: encode_json(payload, compress=True), lambda body: json.loads(gzip.decompress(body))),
+    }
+    for payload_format in (PAYLOAD_FORMAT.MSGPACK, PAYLOAD_FORMAT.CBOR):
+        if not is_payload_format_available(payload_format):
+            print(f'skipping "{payload_format}" - not installed')
+            continue
+        result[f'{payload_format}-plain'] = (
+            lambda payload_format=payload_format: encode_binary(payload, payload_format=payload_format,
+                                                                compact=False),
+            lambda body, payload_format=payload_format: decode_binary(body, payload_format=payload_format),
+        )
+        result[payload_format] = (
+            lambda payload_format=payload_format: encode_binary(payload, payload_format=payload_format),
+            lambda body, payload_format=payload_format: decode_binary(body, payload_format=payload_format),
+        )
+        result[f'{payload_format}+gzip'] = (
+            lambda payload_format=payload_format: gzip.compress(encode_binary(payload, payload_format=payload_format)),
+            lambda body, payload_format=payload_format: decode_binary(gzip.decompress(body),
+                                                                      payload_format=payload_format),
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Stats Payload Formats Benchmark')
+
+    parser.add_argument('--vendor', type=str, action='append', help='vendor output to use (default: cisco, huawei)')
+    parser.add_argument('--rules', type=int, action='append', help='number of flowspec rules (default: 100, 1k, 10k)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed repetitions, best is reported')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from simulators.outputs import vendor_lines
+    from workers.stats_fetcher import StatsFetcher
+
+    print(f'{"vendor":<8}{"rules":>8}  {"format":<15}{"encode ms":>11}{"decode ms":>11}{"size KiB":>11}{"ratio":>8}')
+    for vendor in args.vendor or DEFAULT_VENDORS:
+        for rules in args.rules or DEFAULT_RULES:
+            lines: List[str] = vendor_lines(vendor, rules)
+            payload = StatsFetcher.wrap_result(success=True, payload=lines, cur_time=True)
+            baseline = None
+            for name, (encode, decode) in codecs(payload).items():
+                encode_seconds, body = _best(encode, repeat=max(args.repeat, 1))
+                decode_seconds, decoded = _best(lambda: decode(body), repeat=max(args.repeat, 1))
+                if decoded['data'] != lines:
+                    raise RuntimeError(f'{name} did not round trip the {vendor} output')
+                if baseline is None:
+                    baseline = len(body)
+                print(f'{vendor:<8}{rules:>8}  {name:<15}{encode_seconds * 1000:>11.2f}{decode_seconds * 1000:>11.2f}'
+                      f'{len(body) / 1024:>11.1f}{len(body) / baseline:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+
+DEFAULT_RULES = (100, 1000, 10000)
+DEFAULT_VENDORS = ('cisco', 'huawei')
+DEFAULT_REPEAT = 5
+
+
+def _measure(func: Callable[[], Any],
+             repeat: int) -> Tuple[float, int, int]:
+    """
+    returns best wall time (seconds), peak traced memory (bytes) and output size (bytes)
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = len(result) if isinstance(result, (bytes, str)) else sum(len(_) for _ in result)
+    return best, peak, size
+
+
+def serializers(payload: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    from common.serializers import encode_json, iter_json
+    from common.utils import remove_unserializable_types
+
+    def legacy():
+        # what send_request did before: deep copy through remove_unserializable_types, then requests' json=
+        return json.dumps(remove_unserializable_types(payload)).encode('utf-8')
+
+    return {
+        'legacy': legacy,
+        'encode_json': lambda: encode_json(payload),
+        'iter_json': lambda: list(iter_json(payload)),
+        'encode_json+gzip': lambda: encode_json(payload, compress=True),
+        'iter_json+gzip': lambda: list(iter_json(payload, compress=True)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Stats Payload Serialization Benchmark')
+
+    parser.add_argument('--vendor', type=str, action='append', help='vendor output to use (default: cisco, huawei)')
+    parser.add_argument('--rules', type=int, action='append', help='number of flowspec rules (default: 100, 1k, 10k)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed repetitions, best is reported')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from simulators.outputs import vendor_lines
+    from workers.stats_fetcher import StatsFetcher
+
+    print(f'{"vendor":<8}{"rules":>8}  {"serializer":<18}{"time ms":>10}{"peak MiB":>10}{"size KiB":>11}{"speedup":>9}')
+    for vendor in args.vendor or DEFAULT_VENDORS:
+        for rules in args.rules or DEFAULT_RULES:
+            lines: List[str] = vendor_lines(vendor, rules)
+            payload = StatsFetcher.wrap_result(success=True, payload=lines, cur_time=True)
+            baseline = None
+            for name, func in serializers(payload).items():
+                seconds, peak, size = _measure(func, repeat=max(args.repeat, 1))
+                if baseline is None:
+                    baseline = seconds
+                print(f'{vendor:<8}{rules:>8}  {name:<18}{seconds * 1000:>10.2f}{peak / 2 ** 20:>10.2f}'
+                      f'{size / 1024:>11.1f}{baseline / seconds:>8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import re
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+PROGRAMS = ('stats_fetcher', 'flows_applier', 'flows_sync', 'device_controller')
+
+# heavy vendor/transport modules that must only be imported on first use
+LAZY_MODULES = ('paramiko', 'requests', 'apscheduler', 'dateutil', 'jstyleson', 'routeros_api', 'pymongo',
+                'asyncio', 'asyncssh', 'aiohttp')
+
+DEFAULT_BUDGET_MS = 150
+DEFAULT_REPEAT = 5
+
+_importtime_regex = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def _root_path() -> str:
+    return str(Path(__file__).parent.parent.absolute())
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    Import module in a fresh interpreter with "-X importtime", returns its cumulative import time (ms) and
+    the self/cumulative time (us) of every imported module
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             cwd=_root_path(), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'failed to import "{module}":\n{process.stderr}')
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = _importtime_regex.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us))
+    if module not in modules:
+        raise RuntimeError(f'no import time was reported for "{module}"')
+    return modules[module][1] / 1000, modules
+
+
+def benchmark_program(program: str,
+                      repeat: int) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    module = f'workers.{program}'
+    results = [measure_import(module) for _ in range(repeat)]
+    median = statistics.median(_[0] for _ in results)
+    return median, results[-1][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Workers Startup Benchmark')
+
+    parser.add_argument('--program', type=str, action='append', choices=PROGRAMS,
+                        help='program to measure (default: all)')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='maximal median import time of a worker module (ms)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='number of fresh interpreters per program')
+    parser.add_argument('--top', type=int, default=10, help='number of heaviest imports to list')
+    args = parser.parse_args()
+
+    failures: List[str] = []
+    for program in args.program or PROGRAMS:
+        median_ms, modules = benchmark_program(program, repeat=max(args.repeat, 1))
+        status = 'OK' if median_ms <= args.budget_ms else 'OVER BUDGET'
+        print(f'{program}: {median_ms:.1f} ms (budget {args.budget_ms:.0f} ms) - {status}')
+        heaviest = sorted(modules.items(), key=lambda _: _[1][0], reverse=True)[:args.top]
+        for name, (self_us, cumulative_us) in heaviest:
+            print(f'    {self_us / 1000:8.2f} ms self  {cumulative_us / 1000:8.2f} ms cumulative  {name}')
+        eager = [_ for _ in LAZY_MODULES if _ in modules]
+        if eager:
+            print(f'    eagerly imported: {", ".join(eager)}')
+            failures.append(f'{program} imports {", ".join(eager)} at startup')
+        if median_ms > args.budget_ms:
+            failures.append(f'{program} startup {median_ms:.1f} ms exceeds {args.budget_ms:.0f} ms')
+
+    if failures:
+        print('\n'.join(['FAILED:'] + [f'  {_}' for _ in failures]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+
+DEFAULT_VENDORS = ('cisco', 'arista', 'juniper', 'huawei')
+DEFAULT_RULES = 100
+DEFAULT_ITERATIONS = 3
+DEFAULT_TOLERANCE = 0.25
+
+# compared with the baseline, lower is better
+METRICS = ('wall_ms', 'cpu_ms', 'rss_mib')
+
+
+def _rss_mib() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        # peak RSS, KiB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write_config(folder: str,
+                  credentials: Dict[str, Any],
+                  api_port: int) -> str:
+    config = dict(credentials,
+                  # a device (and a circuit breaker) per vendor
+                  identifier=f'{DEFAULT_VENDORS.index(credentials["vendor"]) + 1:024x}',
+                  url_scheme='http',
+                  url_host='127.0.0.1',
+                  url_port=api_port,
+                  spool=False,
+                  heartbeats_path=os.path.join(folder, 'heartbeats'))
+    filename = os.path.join(folder, f'{credentials["vendor"]}.conf')
+    with open(filename, 'w') as f:
+        json.dump(config, f)
+    return filename
+
+
+def benchmark_vendor(vendor: str,
+                     rules: int,
+                     latency: float,
+                     iterations: int,
+                     api_port: int,
+                     folder: str) -> Dict[str, Any]:
+    from simulators.ssh_router import read_counters, start_in_process
+    from workers.stats_fetcher import StatsFetcher
+
+    process, credentials, counters = start_in_process(vendor, rules=rules, latency=latency)
+    try:
+        worker = StatsFetcher(config=_write_config(folder, credentials, api_port))
+        device = worker.devices[0]
+        # connection setup, imports and caches are not measured
+        device.work(**device.args)
+        before = read_counters(counters)
+        walls: List[float] = []
+        cpus: List[float] = []
+        for _ in range(iterations):
+            wall, cpu = time.perf_counter(), time.process_time()
+            device.work(**device.args)
+            walls.append(time.perf_counter() - wall)
+            cpus.append(time.process_time() - cpu)
+        after = read_counters(counters)
+    finally:
+        process.terminate()
+        process.join(timeout=10)
+    return dict(vendor=vendor,
+                rules=rules,
+                wall_ms=statistics.median(walls) * 1000,
+                cpu_ms=statistics.median(cpus) * 1000,
+                rss_mib=_rss_mib(),
+                round_trips=(after['commands'] - before['commands']) / iterations,
+                connections=(after['connections'] - before['connections']) / iterations,
+                kib=(after['bytes_sent'] - before['bytes_sent']) / iterations / 1024)
+
+
+def check_regressions(results: List[Dict[str, Any]],
+                      baseline: Dict[str, Dict[str, Any]],
+                      tolerance: float) -> List[str]:
+    failures = []
+    for result in results:
+        expected = baseline.get(f'{result["vendor"]}-{result["rules"]}')
+        if not expected:
+            continue
+        for metric in METRICS:
+            if expected.get(metric) and result[metric] > expected[metric] * (1 + tolerance):
+                failures.append(f'{result["vendor"]} ({result["rules"]} rules) {metric} {result[metric]:.1f} > '
+                                f'{expected[metric]:.1f} +{tolerance:.0%}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Stats Fetcher Benchmark (local SSH router simulator)')
+
+    parser.add_argument('--vendor', type=str, action='append', choices=DEFAULT_VENDORS,
+                        help='router vendor to simulate (default: all)')
+    parser.add_argument('--rules', type=int, default=DEFAULT_RULES, help='number of flowspec rules per address family')
+    parser.add_argument('--output-bytes', type=int, default=None,
+                        help='stats output size per address family (overrides --rules)')
+    parser.add_argument('--latency', type=float, default=0.0, help='router latency per command (seconds)')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='measured iterations per vendor')
+    parser.add_argument('--max-wall-ms', type=float, default=None, help='maximal median iteration wall time')
+    parser.add_argument('--max-cpu-ms', type=float, default=None, help='maximal median iteration CPU time')
+    parser.add_argument('--max-rss-mib', type=float, default=None, help='maximal RSS after the iterations')
+    parser.add_argument('--baseline', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed regression compared with the baseline (fraction)')
+    parser.add_argument('--save-baseline', type=str, default=None, help='file to save the results to')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from simulators.secunity_api import start_api_server
+    from simulators.ssh_router import rules_for_bytes
+
+    results = []
+    api = start_api_server()
+    with tempfile.TemporaryDirectory() as folder:
+        print(f'{"vendor":<9}{"rules":>7}{"wall ms":>10}{"cpu ms":>9}{"rss MiB":>9}{"round trips":>13}'
+              f'{"connects":>10}{"KiB":>9}')
+        for vendor in args.vendor or DEFAULT_VENDORS:
+            rules = rules_for_bytes(vendor, args.output_bytes) if args.output_bytes else args.rules
+            result = benchmark_vendor(vendor, rules=rules, latency=args.latency,
+                                      iterations=max(args.iterations, 1), api_port=api.server_port, folder=folder)
+            results.append(result)
+            print(f'{vendor:<9}{rules:>7}{result["wall_ms"]:>10.1f}{result["cpu_ms"]:>9.1f}{result["rss_mib"]:>9.1f}'
+                  f'{result["round_trips"]:>13.0f}{result["connections"]:>10.0f}{result["kib"]:>9.1f}')
+    api.shutdown()
+
+    failures: List[str] = []
+    for result in results:
+        for metric, limit in (('wall_ms', args.max_wall_ms), ('cpu_ms', args.max_cpu_ms),
+                              ('rss_mib', args.max_rss_mib)):
+            if limit is not None and result[metric] > limit:
+                failures.append(f'{result["vendor"]} {metric} {result[metric]:.1f} exceeds {limit:.1f}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_regressions(results, json.load(f), tolerance=args.tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({f'{_["vendor"]}-{_["rules"]}': _ for _ in results}, f, indent=2)
+
+    if failures:
+        print('\n'.join(['FAILED:'] + [f'  {_}' for _ in failures]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
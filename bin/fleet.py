@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import sys
+from pathlib import Path
+
+
+def main():
+    path = Path(__file__)
+    parent_path = str(path.parent.absolute())
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+    if parent_path in sys.path:
+        sys.path.remove(parent_path)
+
+    from workers.fleet import main as fleet_main
+
+    fleet_main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Heartbeats Dump')
+
+    parser.add_argument('--path', type=str, default=None, help='heartbeats store file path')
+    parser.add_argument('--json', action='store_true', help='dump as JSON lines')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from common.heartbeats import HEARTBEATS_DEFAULTS, HEARTBEATS_DEFAULTS_KEYS, HeartbeatStore, \
+        parse_heartbeat_key
+
+    paths = [args.path] if args.path else [HEARTBEATS_DEFAULTS[HEARTBEATS_DEFAULTS_KEYS.PATH],
+                                           HEARTBEATS_DEFAULTS[HEARTBEATS_DEFAULTS_KEYS.FALLBACK_PATH]]
+    store_path = next((_ for _ in paths if Path(_).is_file()), None)
+    if not store_path:
+        print(f'heartbeats store was not found: "{paths}"', file=sys.stderr)
+        sys.exit(1)
+
+    store = HeartbeatStore(path=store_path, create=False)
+    try:
+        rows = []
+        for key, heartbeat in sorted(store.items()):
+            worker, identifier, target, outcome = parse_heartbeat_key(key)
+            rows.append({
+                'worker': worker,
+                'identifier': identifier,
+                'target': target,
+                'outcome': outcome,
+                'count': heartbeat.count,
+                'age': round(heartbeat.age(), 3),
+                'last': heartbeat.wall_datetime().isoformat(),
+            })
+    finally:
+        store.close()
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+        return
+
+    columns = ('worker', 'identifier', 'target', 'outcome', 'count', 'age', 'last')
+    widths = {
+        column: max([len(column)] + [len(str(row[column])) for row in rows])
+        for column in columns
+    }
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print('  '.join(str(row[column]).ljust(widths[column]) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
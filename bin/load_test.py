@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+PROGRAMS = ('stats_fetcher', 'flows_applier', 'flows_sync', 'device_controller')
+
+DEFAULT_DURATION = 3600
+DEFAULT_REPORT_INTERVAL = 60
+
+
+def _write_config(folder: str,
+                  name: str,
+                  devices: List[Dict[str, Any]],
+                  api_port: int,
+                  interval: Optional[int]) -> str:
+    config = dict(devices=devices,
+                  vendor=devices[0]['vendor'],
+                  url_scheme='http',
+                  url_host='127.0.0.1',
+                  url_port=api_port,
+                  spool_path=os.path.join(folder, 'spool'),
+                  heartbeats_path=os.path.join(folder, 'heartbeats'))
+    if interval:
+        config['interval'] = interval
+    filename = os.path.join(folder, f'{name}.conf')
+    with open(filename, 'w') as f:
+        json.dump(config, f)
+    return filename
+
+
+def _start_agent(folder: str,
+                 configs: Dict[str, str]) -> Dict[str, subprocess.Popen]:
+    start = str(Path(__file__).parent / 'start.py')
+    processes = {}
+    for program in PROGRAMS:
+        with open(os.path.join(folder, f'{program}.out'), 'w') as output:
+            processes[program] = subprocess.Popen([sys.executable, start, '--program', program,
+                                                   '--config', configs[program]],
+                                                  stdout=output, stderr=subprocess.STDOUT)
+    return processes
+
+
+def _stop_agent(processes: Dict[str, subprocess.Popen]):
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    for process in processes.values():
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _usage(processes: Dict[str, subprocess.Popen]) -> Dict[str, Dict[str, float]]:
+    from simulators.usage import process_usage
+
+    return {program: process_usage(process.pid) for program, process in processes.items()
+            if process.poll() is None}
+
+
+def _ms(value: Optional[float]) -> str:
+    return f'{value:.0f}' if value is not None else '-'
+
+
+def _report_line(minute: float,
+                 summary: Dict[str, Any],
+                 usage: Dict[str, Dict[str, float]],
+                 cpu_percent: float,
+                 rules: int,
+                 per_minute: float) -> str:
+    endpoints = summary['endpoints']
+
+    def _endpoint(name: str) -> str:
+        value = endpoints.get(name)
+        if not value:
+            return f'{"-":>6}{"-":>5}{"-":>7}{"-":>7}'
+        return f'{value["requests"] / per_minute:>6.0f}{value["errors"]:>5}{_ms(value["p50_ms"]):>7}' \
+               f'{_ms(value["p99_ms"]):>7}'
+
+    ttm = summary['time_to_mitigate']
+    ttm_str = f'{ttm["flows"]:>6}{ttm["p50"]:>7.1f}{ttm["p99"]:>7.1f}' if ttm['flows'] else f'{0:>6}{"-":>7}{"-":>7}'
+    rss = sum(_['rss_mib'] for _ in usage.values() if _)
+    fds = sum(_['fds'] for _ in usage.values() if _)
+    threads = sum(_['threads'] for _ in usage.values() if _)
+    return f'{minute:>6.1f}{_endpoint("stats")}{_endpoint("get_flows")}{_endpoint("set_flow")}{ttm_str}' \
+           f'{rules:>7}{rss:>8.1f}{cpu_percent:>6.1f}{threads:>5}{fds:>5}'
+
+
+def _report_header() -> str:
+    endpoint = f'{"/min":>6}{"err":>5}{"p50":>7}{"p99":>7}'
+    return f'{"":>6}{"stats":^25}{"get flows":^25}{"set flow":^25}{"time to mitigate s":^20}{"":>7}' \
+           f'{"agent":^24}\n' \
+           f'{"min":>6}{endpoint}{endpoint}{endpoint}{"flows":>6}{"p50":>7}{"p99":>7}{"rules":>7}' \
+           f'{"MiB":>8}{"cpu%":>6}{"thr":>5}{"fds":>5}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Agent Load Test (mock API and router simulators)')
+
+    parser.add_argument('--duration', type=int, default=DEFAULT_DURATION, help='seconds to run')
+    parser.add_argument('--report-interval', type=int, default=DEFAULT_REPORT_INTERVAL,
+                        help='seconds between report lines')
+    parser.add_argument('--vendor', type=str, default='cisco', help='vendor of the stats devices (SSH simulator)')
+    parser.add_argument('--stats-devices', type=int, default=1, help='devices polled by the stats fetcher')
+    parser.add_argument('--mikrotik-devices', type=int, default=1, help='devices handled by the flows workers')
+    parser.add_argument('--rules', type=int, default=100, help='flowspec rules of the SSH simulator')
+    parser.add_argument('--router-latency', type=float, default=0.0, help='router latency per command (seconds)')
+    parser.add_argument('--flows', type=int, default=100, help='active flows per mikrotik device')
+    parser.add_argument('--churn', type=float, default=10.0, help='flows replaced per device per minute')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='mock API latency per request (seconds)')
+    parser.add_argument('--api-error-rate', type=float, default=0.0, help='share of the API requests that fail')
+    parser.add_argument('--scenario', type=str, default=None,
+                        help='json list of timed API changes: [{"at": <seconds>, "latency": ..., "error_rate": ..., '
+                             '"flows": ..., "churn": ...}]')
+    parser.add_argument('--interval', type=int, default=None, help='seconds between iterations of every worker '
+                                                                   '(default: the worker\'s own interval)')
+    parser.add_argument('--workdir', type=str, default=None, help='folder of the configs, heartbeats and worker '
+                                                                  'output (default: a temporary folder)')
+    parser.add_argument('--save', type=str, default=None, help='file to save the results to')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from simulators.routeros import RouterOsApiSimulator
+    from simulators.secunity_api import start_api_server
+    from simulators.ssh_router import read_counters, start_in_process
+
+    api = start_api_server(latency=args.api_latency, error_rate=args.api_error_rate, flows=args.flows,
+                           churn=args.churn)
+    ssh_process, ssh_credentials, ssh_counters = start_in_process(args.vendor, rules=args.rules,
+                                                                  latency=args.router_latency)
+    routers = [RouterOsApiSimulator(latency=args.router_latency).start() for _ in range(args.mikrotik_devices)]
+
+    temporary = None if args.workdir else tempfile.TemporaryDirectory()
+    folder = args.workdir or temporary.name
+    os.makedirs(folder, exist_ok=True)
+    stats_devices = [dict(ssh_credentials, identifier=f'{i + 1:024x}') for i in range(args.stats_devices)]
+    mikrotik_devices = [dict(router.credentials(), identifier=f'{0xf00000 + i + 1:024x}')
+                        for i, router in enumerate(routers)]
+    stats_config = _write_config(folder, 'stats', stats_devices, api.server_port, args.interval)
+    flows_config = _write_config(folder, 'flows', mikrotik_devices, api.server_port, args.interval)
+    configs = {_: stats_config if _ == 'stats_fetcher' else flows_config for _ in PROGRAMS}
+
+    if args.scenario:
+        with open(args.scenario) as f:
+            api.run_scenario(json.load(f))
+
+    processes = _start_agent(folder, configs)
+    print(f'agent started ({", ".join(f"{k}: {v.pid}" for k, v in processes.items())}), output in "{folder}"')
+    print(_report_header())
+    results, failures = [], []
+    started = since = api.uptime
+    cpu = {program: 0.0 for program in PROGRAMS}
+    try:
+        while api.uptime - started < args.duration:
+            time.sleep(max(min(args.report_interval, args.duration - (api.uptime - started)), 0))
+            until = api.uptime
+            summary = api.summary(since=since, until=until)
+            usage = _usage(processes)
+            cpu_seconds = {k: v['cpu_seconds'] for k, v in usage.items() if v}
+            cpu_percent = sum(cpu_seconds[_] - cpu[_] for _ in cpu_seconds) / max(until - since, 1e-6) * 100
+            cpu.update(cpu_seconds)
+            rules = sum(len(_.table('/ip/firewall/raw')) for _ in routers)
+            print(_report_line((until - started) / 60, summary, usage, cpu_percent, rules,
+                               per_minute=max(until - since, 1e-6) / 60), flush=True)
+            results.append(dict(seconds=until - started, usage=usage, cpu_percent=cpu_percent, rules=rules,
+                                **summary))
+            since = until
+            stopped = [program for program, process in processes.items() if process.poll() is not None]
+            if stopped:
+                failures.append(f'workers stopped: {", ".join(stopped)}')
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _stop_agent(processes)
+        ssh_process.terminate()
+        ssh_process.join(timeout=10)
+        for router in routers:
+            router.stop()
+
+    total = api.summary(since=started)
+    ttm = total['time_to_mitigate']
+    print(f'total: {sum(_["requests"] for _ in total["endpoints"].values())} api requests, '
+          f'{sum(_["errors"] for _ in total["endpoints"].values())} errors, '
+          f'{read_counters(ssh_counters)["commands"]} router commands, '
+          f'{sum(_.stats["sentences"] for _ in routers)} routeros sentences, '
+          f'time to mitigate of {ttm["flows"]} flows: '
+          f'p50 {ttm["p50"] or 0:.1f}s, p99 {ttm["p99"] or 0:.1f}s')
+    for key, value in total['reported_timings'].items():
+        if value['flows']:
+            print(f'reported by the agent, {key} of {value["flows"]} flows: '
+                  f'p50 {value["p50"]:.1f}s, p99 {value["p99"]:.1f}s')
+    api.shutdown()
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(minutes=results, total=total, failures=failures), f, indent=2)
+    if temporary:
+        temporary.cleanup()
+    if failures:
+        print('\n'.join(['FAILED:'] + [f'  {_}' for _ in failures]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
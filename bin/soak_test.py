@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import gc
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+DEFAULT_HOURS = 24
+DEFAULT_INTERVAL = 60
+DEFAULT_SAMPLE_HOURS = 1
+DEFAULT_WARMUP_HOURS = 2
+DEFAULT_TOP = 10
+DEFAULT_FRAMES = 5
+
+# allowed growth after the warmup
+DEFAULT_MAX_GROWTH = {
+    'rss_mib': 20.0,
+    'fds': 4,
+    'threads': 2,
+    'traced_mib': 10.0,
+}
+
+
+def _write_config(folder: str,
+                  name: str,
+                  devices: List[Dict[str, Any]],
+                  api_port: int) -> str:
+    config = dict(devices=devices,
+                  vendor=devices[0]['vendor'],
+                  url_scheme='http',
+                  url_host='127.0.0.1',
+                  url_port=api_port,
+                  spool_path=os.path.join(folder, 'spool'),
+                  heartbeats_path=os.path.join(folder, 'heartbeats'))
+    filename = os.path.join(folder, f'{name}.conf')
+    with open(filename, 'w') as f:
+        json.dump(config, f)
+    return filename
+
+
+def _workers(stats_config: str,
+             flows_config: str) -> List[Any]:
+    from workers.device_controller import DeviceController
+    from workers.flows_applier import FlowsApplier
+    from workers.flows_sync import FlowsSync
+    from workers.stats_fetcher import StatsFetcher
+
+    workers = [StatsFetcher(config=stats_config)] + \
+              [_(config=flows_config) for _ in (FlowsApplier, FlowsSync, DeviceController)]
+    return [device for worker in workers for device in worker.devices]
+
+
+def _sample(hour: float,
+            iterations: int) -> Dict[str, Any]:
+    from simulators.usage import process_usage
+
+    # only the retained memory is of interest
+    gc.collect()
+    usage = process_usage()
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ]) if tracemalloc.is_tracing() else None
+    return dict(hour=hour,
+                iterations=iterations,
+                rss_mib=usage['rss_mib'],
+                fds=usage['fds'],
+                threads=usage['threads'],
+                traced_mib=tracemalloc.get_traced_memory()[0] / 2 ** 20 if snapshot else 0.0,
+                snapshot=snapshot)
+
+
+def _growth(sample: Dict[str, Any],
+            baseline: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    return {_: sample[_] - baseline[_] if baseline else 0 for _ in DEFAULT_MAX_GROWTH}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Secunity\'s Agent Soak Test (the workers\' iterations of many hours '
+                                                 'against local simulators, without the waits)')
+
+    parser.add_argument('--hours', type=float, default=DEFAULT_HOURS, help='simulated hours to run')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL,
+                        help='simulated seconds between the iterations of every worker')
+    parser.add_argument('--sample-hours', type=float, default=DEFAULT_SAMPLE_HOURS,
+                        help='simulated hours between samples')
+    parser.add_argument('--warmup-hours', type=float, default=DEFAULT_WARMUP_HOURS,
+                        help='simulated hours before the baseline sample (caches, pools and imports fill up)')
+    parser.add_argument('--vendor', type=str, default='cisco', help='vendor of the stats devices (SSH simulator)')
+    parser.add_argument('--stats-devices', type=int, default=1, help='devices polled by the stats fetcher')
+    parser.add_argument('--mikrotik-devices', type=int, default=1, help='devices handled by the flows workers')
+    parser.add_argument('--rules', type=int, default=100, help='flowspec rules of the SSH simulator')
+    parser.add_argument('--router-error-rate', type=float, default=0.0,
+                        help='share of the SSH commands answered by closing the channel')
+    parser.add_argument('--flows', type=int, default=100, help='active flows per mikrotik device')
+    parser.add_argument('--churn', type=float, default=60.0, help='flows replaced per device per (real) minute')
+    parser.add_argument('--api-error-rate', type=float, default=0.0, help='share of the API requests that fail')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='retained allocations to report')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES,
+                        help='traceback frames of the traced allocations')
+    for metric, value in DEFAULT_MAX_GROWTH.items():
+        parser.add_argument(f'--max-{metric.replace("_", "-")}-growth', type=type(value), default=value,
+                            help=f'maximal {metric} growth after the warmup (default: {value})')
+    parser.add_argument('--workdir', type=str, default=None, help='folder of the configs, heartbeats and spool '
+                                                                  '(default: a temporary folder)')
+    parser.add_argument('--save', type=str, default=None, help='file to save the samples to')
+    args = parser.parse_args()
+
+    path = Path(__file__)
+    expected_path = str(path.parent.parent.absolute())
+    if expected_path not in sys.path:
+        sys.path.insert(0, expected_path)
+
+    from simulators import routeros, secunity_api, ssh_router
+
+    # the simulators run in other processes, only the agent is measured
+    api_process, api_port = secunity_api.start_in_process(latency=0, error_rate=args.api_error_rate,
+                                                          flows=args.flows, churn=args.churn)
+    ssh_process, ssh_credentials, _ = ssh_router.start_in_process(args.vendor, rules=args.rules,
+                                                                  error_rate=args.router_error_rate)
+    routers_process, routers_credentials = routeros.start_in_process(count=args.mikrotik_devices)
+
+    temporary = None if args.workdir else tempfile.TemporaryDirectory()
+    folder = args.workdir or temporary.name
+    os.makedirs(folder, exist_ok=True)
+    stats_devices = [dict(ssh_credentials, identifier=f'{i + 1:024x}') for i in range(args.stats_devices)]
+    mikrotik_devices = [dict(_, identifier=f'{0xf00000 + i + 1:024x}') for i, _ in enumerate(routers_credentials)]
+
+    # the agent's log would be mixed with the samples
+    log_file = os.path.join(folder, 'agent.log')
+    logging.getLogger('common.logs').addHandler(logging.FileHandler(log_file))
+    print(f'agent log: "{log_file}"')
+
+    failures: List[str] = []
+    samples: List[Dict[str, Any]] = []
+    try:
+        devices = _workers(stats_config=_write_config(folder, 'stats', stats_devices, api_port),
+                           flows_config=_write_config(folder, 'flows', mikrotik_devices, api_port))
+        iterations = int(args.hours * 3600 / args.interval)
+        sample_every = max(int(args.sample_hours * 3600 / args.interval), 1)
+        baseline = None
+        print(f'{"hour":>6}{"iterations":>12}{"seconds":>9}{"MiB":>8}{"fds":>6}{"threads":>9}{"traced MiB":>12}'
+              f'{"growth: MiB":>13}{"fds":>6}{"threads":>9}{"traced MiB":>12}')
+        start = time.perf_counter()
+        for iteration in range(1, iterations + 1):
+            for device in devices:
+                device.run_work(**device.args)
+            if iteration % sample_every and iteration != iterations:
+                continue
+            sample = _sample(hour=iteration * args.interval / 3600, iterations=iteration)
+            if baseline is None and sample['hour'] >= args.warmup_hours:
+                # tracing slows the iterations down, it starts with the baseline - what is traced later is retained
+                baseline = sample
+                tracemalloc.start(args.frames)
+            growth = _growth(sample, baseline)
+            print(f'{sample["hour"]:>6.1f}{iteration:>12}{time.perf_counter() - start:>9.0f}'
+                  f'{sample["rss_mib"]:>8.1f}{sample["fds"]:>6}{sample["threads"]:>9}{sample["traced_mib"]:>12.2f}'
+                  f'{growth["rss_mib"]:>13.1f}{growth["fds"]:>6}{growth["threads"]:>9}{growth["traced_mib"]:>12.2f}',
+                  flush=True)
+            samples.append(dict({k: v for k, v in sample.items() if k != 'snapshot'}, growth=growth))
+            last = sample
+    except KeyboardInterrupt:
+        pass
+    finally:
+        from workers.bases import BaseWorker
+
+        BaseWorker.close_connections()
+        for process in (api_process, ssh_process, routers_process):
+            process.terminate()
+            process.join(timeout=10)
+
+    if not samples:
+        print('no samples were taken')
+        sys.exit(1)
+    if baseline is None or baseline is last:
+        failures.append(f'the run ended before the warmup ({args.warmup_hours} hours)')
+    else:
+        stats = last['snapshot'].statistics('traceback')
+        print(f'top {args.top} allocations retained after the warmup:')
+        for stat in stats[:args.top]:
+            # the innermost frame of the agent's code
+            frame = next((_ for _ in reversed(stat.traceback) if expected_path in _.filename), stat.traceback[0])
+            print(f'  {stat.size / 1024:>10.1f} KiB {stat.count:>7} blocks  '
+                  f'{frame.filename.replace(expected_path + os.sep, "")}:{frame.lineno}')
+        growth = _growth(last, baseline)
+        for metric in DEFAULT_MAX_GROWTH:
+            limit = getattr(args, f'max_{metric}_growth')
+            if growth[metric] > limit:
+                failures.append(f'{metric} grew by {growth[metric]:.1f} after the warmup (limit {limit})')
+    tracemalloc.stop()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(samples=samples, failures=failures), f, indent=2)
+    if temporary:
+        temporary.cleanup()
+    if failures:
+        print('\n'.join(['FAILED:'] + [f'  {_}' for _ in failures]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
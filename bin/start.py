@@ -19,6 +19,7 @@ def main():
     parser = argparse.ArgumentParser(description='Secunity\'s Process Start')
 
     parser.add_argument('--program', type=str, help='program to start')
+    parser.add_argument('--config', type=str, default=None, help='config file (default: the system config)')
     args = parser.parse_args()
 
     program = args.program
@@ -44,7 +45,7 @@ def main():
     if not worker_cls:
         raise ValueError(f'could not resolve starting point, program: "{program}"')
 
-    worker = worker_cls()
+    worker = worker_cls(config=args.config)
     worker.start()
 
 
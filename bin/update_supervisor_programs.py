@@ -7,8 +7,10 @@ from common.utils import update_supervisor_program_autostart
 
 
 def main():
-    vendor, config = parse_config_vendor()
-    if vendor == VENDOR.MIKROTIK:
+    config, vendor = parse_config_vendor()
+    devices = config.get('devices') if isinstance(config.get('devices'), list) else []
+    vendors = {vendor} | {str(_.get('vendor')).lower() for _ in devices if isinstance(_, dict)}
+    if VENDOR.MIKROTIK in vendors:
         autostart_programs = [PROGRAM.FLOWS_SYNC, PROGRAM.FLOWS_APPLIER, PROGRAM.STATS_FETCHER]
     else:
         autostart_programs = [PROGRAM.STATS_FETCHER]
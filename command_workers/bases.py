@@ -1,16 +1,34 @@
+import contextlib
 import copy
 import time
 from abc import ABC, abstractmethod
-from typing import Optional, Union, Dict, Protocol, List, Callable, TypeVar
-import paramiko
+from typing import Optional, Union, Dict, Protocol, List, Callable, TypeVar, Any, TYPE_CHECKING
 
 from common.enums import VENDOR
 from common.logs import Log
+from common.metrics import counter, histogram
+from common.recorder import record_transcript
 from common.sshutils import SSH_DEFAULTS
+from common.tracing import span
+
+if TYPE_CHECKING:
+    import asyncssh
+    import paramiko
 
 TCredentials = TypeVar('TCredentials', bound=Optional[Dict[str, Union[str, int, float, bool]]])
 
 
+_ROUTER_CALL_SECONDS = histogram('secunity_router_call_seconds',
+                                 'Latency of router calls - connect (incl. authentication), command and API operations',
+                                 labelnames=('vendor', 'operation'))
+_ROUTER_CALL_ERRORS = counter('secunity_router_call_errors_total',
+                              'Router calls that raised an error',
+                              labelnames=('vendor', 'operation'))
+_ROUTER_BYTES_READ = counter('secunity_router_bytes_read_total',
+                             'Bytes of output read from the router',
+                             labelnames=('vendor', 'device'))
+
+
 class ICommandWorker(Protocol):
 
     def parse_credentials(self,
@@ -74,6 +92,29 @@ class CommandWorker(ABC, ICommandWorker):
         else:
             Log.error_raise(f'invalid value type: "{type(value)}"')
 
+    @contextlib.contextmanager
+    def observe_call(self, operation: str):
+        start = time.perf_counter()
+        try:
+            with span(f'router.{operation}', vendor=self.vendor):
+                yield
+        except BaseException:
+            _ROUTER_CALL_ERRORS.inc(vendor=self.vendor, operation=operation)
+            raise
+        finally:
+            _ROUTER_CALL_SECONDS.observe(time.perf_counter() - start, vendor=self.vendor, operation=operation)
+
+    def observe_bytes_read(self,
+                           size: int,
+                           credentials: Optional[Dict[str, object]] = None):
+        _ROUTER_BYTES_READ.inc(size, vendor=self.vendor, device=(credentials or self.credentials or {}).get('host'))
+
+    @staticmethod
+    def lines_size(lines: Any) -> int:
+        if isinstance(lines, str):
+            return len(lines)
+        return sum(len(_) + 1 for _ in lines if isinstance(_, str)) if isinstance(lines, list) else 0
+
 
 TCommandWorker = TypeVar('TCommandWorker', bound=Union[ICommandWorker, CommandWorker])
 
@@ -136,7 +177,9 @@ class SshCommandWorker(CommandWorker, ABC):
 
         return result
 
-    def generate_connection(self, params: dict, **kwargs) -> paramiko.SSHClient:
+    def generate_connection(self, params: dict, **kwargs) -> 'paramiko.SSHClient':
+        import paramiko
+
         look_for_keys = [_.pop('look_for_keys', None) for _ in (kwargs, params)]
         offset = next((i + 1 for i, _ in enumerate(look_for_keys) if _ in (True, False)), None)
         params['look_for_keys'] = look_for_keys[offset - 1] if isinstance(offset, int) else False
@@ -154,9 +197,12 @@ class SshCommandWorker(CommandWorker, ABC):
                     **kwargs) -> List[str]:
         if not command and not exec_command:
             Log.error_raise('either "command" or "exec_command" must be specified')
+        import paramiko
+
         connection = None
         try:
-            connection = self.generate_connection(credentials, **kwargs)
+            with self.observe_call('connect'):
+                connection = self.generate_connection(credentials, **kwargs)
             if not exec_command:
                 if not command.endswith('\n'):
                     command = f'{command}\n'
@@ -170,7 +216,12 @@ class SshCommandWorker(CommandWorker, ABC):
 
                 exec_command = _exec_command
 
-            return exec_command(connection, command, **kwargs)
+            with self.observe_call('command'):
+                result = exec_command(connection, command, **kwargs)
+            self.observe_bytes_read(self.lines_size(result), credentials)
+            record_transcript(self.vendor, command or getattr(exec_command, '__name__', 'exec_command'), result,
+                              credentials=credentials, params=kwargs)
+            return result
         except paramiko.ssh_exception.AuthenticationException as cto_ex:
             time_to_sleep: int = 60 * 10
             Log.error(f'Authentication Error - Sleep for {str(time_to_sleep)} seconds')
@@ -180,6 +231,60 @@ class SshCommandWorker(CommandWorker, ABC):
             if isinstance(connection, paramiko.SSHClient):
                 connection.close()
 
+    def ssh_to_asyncssh_params(self, params: dict) -> Dict[str, object]:
+        params = self.ssh_to_paramiko_params(params)
+        result = {
+            'host': params['hostname'],
+            'port': params['port'],
+            'username': params['username'],
+            # same as paramiko's AutoAddPolicy
+            'known_hosts': None,
+            'agent_path': None,
+        }
+        if params.get('password'):
+            result['password'] = params['password']
+            result['client_keys'] = None
+        else:
+            result['client_keys'] = [params['key_filename']]
+        if params.get('timeout'):
+            result['connect_timeout'] = params['timeout']
+        return result
+
+    async def generate_connection_async(self, params: dict, **kwargs) -> 'asyncssh.SSHClientConnection':
+        from common.aio import AIO_PACKAGE, get_import
+
+        asyncssh = get_import(AIO_PACKAGE.ASYNCSSH)
+        return await asyncssh.connect(**self.ssh_to_asyncssh_params(params))
+
+    def _use_asyncssh(self, exec_command: Optional[Callable] = None) -> bool:
+        from common.aio import AIO_PACKAGE, has_package
+
+        # custom exec_command callbacks and execute_cli overrides work with paramiko objects
+        return not exec_command and type(self).execute_cli is SshCommandWorker.execute_cli and \
+            has_package(AIO_PACKAGE.ASYNCSSH)
+
+    async def execute_cli_async(self,
+                                credentials: Dict[str, object],
+                                command: str = None,
+                                exec_command: Optional[Callable] = None,
+                                **kwargs) -> List[str]:
+        if not command and not exec_command:
+            Log.error_raise('either "command" or "exec_command" must be specified')
+        from common.aio import run_blocking
+
+        if not self._use_asyncssh(exec_command):
+            return await run_blocking(self.execute_cli, credentials=credentials, command=command,
+                                      exec_command=exec_command, **kwargs)
+        with self.observe_call('connect'):
+            connection = await self.generate_connection_async(credentials, **kwargs)
+        async with connection:
+            with self.observe_call('command'):
+                result = await connection.run(command.rstrip('\n'), check=False)
+        self.observe_bytes_read(len(result.stdout or ''), credentials)
+        lines = [_.rstrip('\r\n') for _ in (result.stdout or '').splitlines()]
+        record_transcript(self.vendor, command, lines, credentials=credentials, params=kwargs)
+        return lines
+
     def _prepare_stats_command(self, interface_name=None, ip_type='IPv4', model=None):
         if ip_type == 'IPv6':
             self._get_stats_from_router_command = self._get_stats_from_router_command.replace(
@@ -189,6 +294,29 @@ class SshCommandWorker(CommandWorker, ABC):
     def _filter_result(self, result, interface_name=None, ip_type='IPv4', model=None):
         return result
 
+    def _parse_result(self, result, credentials, **kwargs):
+        filter_kwargs = dict(interface_name=kwargs.get('interface_name'),
+                             ip_type=kwargs.get('stats_type', 'IPv4'),
+                             model=kwargs.get('model'))
+        if type(self)._filter_result is SshCommandWorker._filter_result:
+            # nothing to parse
+            return self._filter_result(result, **filter_kwargs)
+        from common.parse_pool import parse_output
+
+        with span('parse', lines=len(result) if isinstance(result, list) else None):
+            return parse_output(self, result, device=credentials.get('host'), **filter_kwargs)
+
+    async def _parse_result_async(self, result, credentials, **kwargs):
+        filter_kwargs = dict(interface_name=kwargs.get('interface_name'),
+                             ip_type=kwargs.get('stats_type', 'IPv4'),
+                             model=kwargs.get('model'))
+        if type(self)._filter_result is SshCommandWorker._filter_result:
+            return self._filter_result(result, **filter_kwargs)
+        from common.parse_pool import parse_output_async
+
+        with span('parse', lines=len(result) if isinstance(result, list) else None):
+            return await parse_output_async(self, result, device=credentials.get('host'), **filter_kwargs)
+
     def get_flows_from_router(self,
                               credentials: Optional[Dict[str, object]] = None,
                               **kwargs) -> List[str]:
@@ -198,6 +326,19 @@ class SshCommandWorker(CommandWorker, ABC):
             Log.debug(f'SSH command: "{self._get_stats_from_router_command}"')
             result = self.execute_cli(command=self._get_stats_from_router_command,
                                       credentials=credentials, **kwargs)
-            return self._filter_result(result, kwargs.get('interface_name'), kwargs.get('stats_type', 'IPv4'), kwargs.get('model'))
+            return self._parse_result(result, credentials, **kwargs)
+
+        raise NotImplementedError()
+
+    async def get_flows_from_router_async(self,
+                                          credentials: Optional[Dict[str, object]] = None,
+                                          **kwargs) -> List[str]:
+        if not credentials:
+            credentials = copy.deepcopy(self.credentials)
+        if self._prepare_stats_command(kwargs.get('vrf'), kwargs.get('stats_type', 'IPv4'), kwargs.get('model')):
+            Log.debug(f'SSH command: "{self._get_stats_from_router_command}"')
+            result = await self.execute_cli_async(command=self._get_stats_from_router_command,
+                                                  credentials=credentials, **kwargs)
+            return await self._parse_result_async(result, credentials, **kwargs)
 
         raise NotImplementedError()
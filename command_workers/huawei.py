@@ -3,13 +3,15 @@ import re
 from command_workers.bases import SshCommandWorker
 from common.enums import VENDOR
 from common.logs import Log
-from common.sshutils import read_and_wait
+from common.recorder import record_transcript
+from common.sshutils import read_and_wait, read_and_wait_async
 
 
 class HuaweiCommandWorker(SshCommandWorker):
     _get_stats_from_router_command = "display bgp"
 
     SHELL_PROMPT = re.compile(r"<.*?>")
+    RE_INDEX = re.compile(r"ReIndex\s*:\s*(\d+)")
 
     VPN_DISPLAY_ROUTING_TABLE = (
         "display bgp flow vpnv4 vpn-instance {vpn_instance} routing-table | no-more"
@@ -31,7 +33,14 @@ class HuaweiCommandWorker(SshCommandWorker):
     def vendor(self) -> VENDOR:
         return VENDOR.HUAWEI
 
-    def execute_cli(self, credentials, command=None, exec_command=None, **kwargs):
+    @classmethod
+    def re_indexes(cls, output):
+        """
+        the indexes of the rules in the output of the routing table command
+        """
+        return cls.RE_INDEX.findall(output)
+
+    def _display_commands(self, **kwargs):
         stats_type = kwargs.get("stats_type")
         if stats_type == "IPv6":
             vpn_display_routing_table = self.VPN_DISPLAY_ROUTING_TABLE_IPV6
@@ -44,51 +53,107 @@ class HuaweiCommandWorker(SshCommandWorker):
             display_routing_table = self.DISPLAY_ROUTING_TABLE
             display_statistics = self.DISPLAY_STATISTICS
 
+        vpn_instance = kwargs.get("vrf")
+
+        if vpn_instance:
+            Log.info(f"Getting BGP statistics for VPN instance: {vpn_instance}")
+            display_routing_table = vpn_display_routing_table.format(
+                vpn_instance=vpn_instance
+            )
+            display_statistics = vpn_display_statistics.format(
+                vpn_instance=vpn_instance, re_index="{re_index}"
+            )
+        else:
+            Log.info("Getting BGP statistics for global routing table")
+            display_routing_table = display_routing_table.format(
+                vpn_instance=vpn_instance
+            )
+            display_statistics = display_statistics.format(
+                re_index="{re_index}"
+            )
+        return vpn_instance, display_routing_table, display_statistics
+
+    def execute_cli(self, credentials, command=None, exec_command=None, **kwargs):
+        ssh_client = None
         try:
-            vpn_instance = kwargs.get("vrf")
-
-            if vpn_instance:
-                Log.info(f"Getting BGP statistics for VPN instance: {vpn_instance}")
-                display_routing_table = vpn_display_routing_table.format(
-                    vpn_instance=vpn_instance
-                )
-                display_statistics = vpn_display_statistics.format(
-                    vpn_instance=vpn_instance, re_index="{re_index}"
-                )
-            else:
-                Log.info("Getting BGP statistics for global routing table")
-                display_routing_table = display_routing_table.format(
-                    vpn_instance=vpn_instance
-                )
-                display_statistics = display_statistics.format(
-                    re_index="{re_index}"
-                )
-
-            ssh_client = self.generate_connection(credentials, **kwargs)
-
-            shell = ssh_client.invoke_shell()
-
-            output_array = []
-
-            output = read_and_wait(shell, self.SHELL_PROMPT)
-
-            command = f"{display_routing_table}\n"
-            Log.debug(f"Executing command: {command.strip()}")
-            shell.sendall(command)
-            output = read_and_wait(shell, self.SHELL_PROMPT)
-
-            output_array += output.splitlines()
-
-            for re_index in re.findall(r"ReIndex\s*:\s*(\d+)", output):
-                Log.debug(f"Get statistics for: {re_index}")
-                command = f"{display_statistics.format(vpn_instance=vpn_instance, re_index=re_index)}\n"
+            vpn_instance, display_routing_table, display_statistics = self._display_commands(**kwargs)
+
+            with self.observe_call("connect"):
+                ssh_client = self.generate_connection(credentials, **kwargs)
+
+            with self.observe_call("command"):
+                shell = ssh_client.invoke_shell()
+
+                output_array = []
+
+                output = read_and_wait(shell, self.SHELL_PROMPT)
+
+                command = f"{display_routing_table}\n"
+                Log.debug(f"Executing command: {command.strip()}")
                 shell.sendall(command)
                 output = read_and_wait(shell, self.SHELL_PROMPT)
 
-                output_array += ["\f"]
                 output_array += output.splitlines()
 
-            ssh_client.close()
+                for re_index in self.re_indexes(output):
+                    Log.debug(f"Get statistics for: {re_index}")
+                    command = f"{display_statistics.format(vpn_instance=vpn_instance, re_index=re_index)}\n"
+                    shell.sendall(command)
+                    output = read_and_wait(shell, self.SHELL_PROMPT)
+
+                    output_array += ["\f"]
+                    output_array += output.splitlines()
+
+            self.observe_bytes_read(self.lines_size(output_array), credentials)
+            record_transcript(self.vendor, display_routing_table, output_array, credentials=credentials, params=kwargs)
+
+            return output_array
+        except Exception as e:
+            Log.error(f"Error executing CLI command: {str(e)}")
+            return []
+        finally:
+            # the connection and its transport thread would stay open after a failed command
+            if ssh_client is not None:
+                ssh_client.close()
+
+    async def execute_cli_async(self, credentials, command=None, exec_command=None, **kwargs):
+        from common.aio import AIO_PACKAGE, has_package, run_blocking
+
+        if not has_package(AIO_PACKAGE.ASYNCSSH):
+            return await run_blocking(self.execute_cli, credentials, command=command,
+                                      exec_command=exec_command, **kwargs)
+        try:
+            vpn_instance, display_routing_table, display_statistics = self._display_commands(**kwargs)
+
+            with self.observe_call("connect"):
+                ssh_client = await self.generate_connection_async(credentials, **kwargs)
+            async with ssh_client:
+                with self.observe_call("command"):
+                    shell = await ssh_client.create_process(term_type="vt100")
+
+                    output_array = []
+
+                    output = await read_and_wait_async(shell, self.SHELL_PROMPT)
+
+                    command = f"{display_routing_table}\n"
+                    Log.debug(f"Executing command: {command.strip()}")
+                    shell.stdin.write(command)
+                    output = await read_and_wait_async(shell, self.SHELL_PROMPT)
+
+                    output_array += output.splitlines()
+
+                    for re_index in self.re_indexes(output):
+                        Log.debug(f"Get statistics for: {re_index}")
+                        command = f"{display_statistics.format(vpn_instance=vpn_instance, re_index=re_index)}\n"
+                        shell.stdin.write(command)
+                        output = await read_and_wait_async(shell, self.SHELL_PROMPT)
+
+                        output_array += ["\f"]
+                        output_array += output.splitlines()
+
+                    shell.close()
+            self.observe_bytes_read(self.lines_size(output_array), credentials)
+            record_transcript(self.vendor, display_routing_table, output_array, credentials=credentials, params=kwargs)
 
             return output_array
         except Exception as e:
@@ -1,4 +1,7 @@
 import re
+import socket
+import sys
+import threading
 import time
 from typing import Optional, Dict, List, Any, Union, Callable, Tuple
 from bson.objectid import ObjectId
@@ -6,8 +9,9 @@ from common.api_secunity import send_request, REQUEST_TYPE, FORMAT_KEYS
 from common.enums import VENDOR
 from command_workers.bases import CommandWorker
 from common.files_handler import FileLock
-from common.flows import get_flows_by_status
+from common.flows import get_flows_by_status, pop_flow_timestamp
 from common.logs import Log, LException
+from common.recorder import record_transcript
 from common.utils import parse_ip, get_ipv4, get_int, to_ObjectId
 
 
@@ -17,10 +21,15 @@ class MikrotikCommandWorker(CommandWorker):
 
     __LOCK_FILE__ = '/tmp/secunity-mikrotik-cw.lock'
 
+    # a connection pool per device (host, api port, user) - reused across iterations, replaced after a failure
+    __POOLS__: Dict[Tuple[str, Optional[int], str], Any] = {}
+    __POOLS_LOCK__ = threading.Lock()
+
     class KEYS:
         FLOW_PREFIX = 'flow_prefix'
         USER = 'user'
         PASSWORD = 'password'
+        API_PORT = 'api_port'
 
         RESOURCE_PATH = 'resource_path'
         FLOW_KEYS = 'flow_keys'
@@ -69,7 +78,8 @@ class MikrotikCommandWorker(CommandWorker):
         if credentials:
             credentials = {k: v for k, v in credentials.items() if k in ('host',
                                                                          self.KEYS.USER,
-                                                                         self.KEYS.PASSWORD)}
+                                                                         self.KEYS.PASSWORD,
+                                                                         self.KEYS.API_PORT)}
         super().__init__(credentials, **kwargs)
 
     def parse_credentials(self,
@@ -87,8 +97,94 @@ class MikrotikCommandWorker(CommandWorker):
         credentials['user'] = user.strip() if user and isinstance(user, str) else self.__DEFAULTS__[self.KEYS.USER]
         credentials['password'] = password.strip() if password and isinstance(password, str) else \
                                   self.__DEFAULTS__[self.KEYS.PASSWORD]
+        # routeros_api's default (8728) when not configured
+        credentials['api_port'] = get_int(credentials.get('api_port')) or None
         return credentials
 
+    def lock_file(self,
+                  credentials: Optional[Dict[str, Any]] = None) -> str:
+        """
+        the router access lock is per device, so devices polled by the same process do not wait for each other
+        """
+        host = (credentials or self.credentials or {}).get('host')
+        return f'{self.__LOCK_FILE__[:-len(".lock")]}-{host}.lock' if host else self.__LOCK_FILE__
+
+    @classmethod
+    def get_connection(cls,
+                       credentials: Dict[str, Any]):  # RouterOsApiPool
+        key = (credentials['host'], credentials.get('api_port'), credentials['user'])
+        with cls.__POOLS_LOCK__:
+            connection = cls.__POOLS__.get(key)
+            if connection is not None:
+                return connection
+        pool = cls.get_import('RouterOsApiPool')
+        port = {'port': credentials['api_port']} if credentials.get('api_port') else {}
+        connection = pool(host=credentials['host'],
+                          username=credentials['user'],
+                          password=credentials['password'],
+                          plaintext_login=True,
+                          **port)
+        with cls.__POOLS_LOCK__:
+            current = cls.__POOLS__.setdefault(key, connection)
+        return current
+
+    @staticmethod
+    def is_trap(ex: BaseException) -> bool:
+        """
+        the router rejected the command ("!trap" reply) - the connection itself is still usable
+        """
+        module = sys.modules.get('routeros_api.exceptions')
+        cls = getattr(module, 'RouterOsApiCommunicationError', None) if module is not None else None
+        return cls is not None and isinstance(ex, cls)
+
+    @classmethod
+    def reset_connection(cls,
+                         credentials: Optional[Dict[str, Any]],
+                         ex: Optional[BaseException] = None):
+        """
+        drops the pool of the device after a failure of ex, unless the router only rejected the command - the
+        resources of the running iteration use the same socket
+        """
+        if not credentials or not credentials.get('host'):
+            return
+        if ex is not None and cls.is_trap(ex):
+            return
+        with cls.__POOLS_LOCK__:
+            connection = cls.__POOLS__.pop((credentials['host'], credentials.get('api_port'), credentials.get('user')),
+                                           None)
+        if connection is not None:
+            try:
+                connection.disconnect()
+            except Exception as ex:
+                Log.debug(f'failed to disconnect from router "{credentials["host"]}": "{str(ex)}"')
+
+    @classmethod
+    def close_connections(cls):
+        """
+        disconnects the pools of all the devices - when the worker stops
+        """
+        with cls.__POOLS_LOCK__:
+            connections = list(cls.__POOLS__.items())
+            cls.__POOLS__.clear()
+        for (host, _, _), connection in connections:
+            try:
+                connection.disconnect()
+            except Exception as ex:
+                Log.debug(f'failed to disconnect from router "{host}": "{str(ex)}"')
+
+    @staticmethod
+    def set_nodelay(connection):
+        """
+        routeros_api sends a sentence word by word - with Nagle's algorithm every command waits for the delayed ack
+        of the router
+        """
+        sock = getattr(getattr(connection, 'socket', None), 'socket', None)
+        if isinstance(sock, socket.socket):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError as ex:
+                Log.debug(f'failed to disable nagle\'s algorithm: "{str(ex)}"')
+
     def get_resource(self,
                      credentials: Dict[str, object],
                      resource_path: Optional[str] = None,
@@ -100,24 +196,25 @@ class MikrotikCommandWorker(CommandWorker):
         if missing_key:
             Log.error_raise(f'missing credentials parameters "{missing_key}"')
         try:
-            pool = self.get_import('RouterOsApiPool')
+            self.get_import('RouterOsApiPool')
         except Exception as ex:
             Log.exception_raise(f'cannot import mikrotik package (routeros_api.RouterOsApiPool)', ex=ex)
         try:
-            connection = pool(host=credentials['host'],
-                              username=credentials['user'],
-                              password=credentials['password'],
-                              plaintext_login=True)
+            connection = self.get_connection(credentials)
         except Exception as ex:
             Log.exception_raise(f'failed to initialize connection to router: "{str(ex)}"', ex=ex)
         try:
-            api = connection.get_api()
+            with self.observe_call('connect'):
+                api = connection.get_api()
+            self.set_nodelay(connection)
         except Exception as ex:
+            self.reset_connection(credentials)
             Log.error_raise(f'failed to initialize router API connector: "{str(ex)}"')
 
         try:
             resource = api.get_resource(resource_path)
         except Exception as ex:
+            self.reset_connection(credentials)
             Log.exception_raise(f'failed to get "{resource_path}" resource', ex=ex)
 
         return resource
@@ -127,10 +224,14 @@ class MikrotikCommandWorker(CommandWorker):
     def set_flow_status_api(self,
                             identifier: str,
                             flow_id: Union[ObjectId, str],
-                            status: Optional[str]) -> Optional[Dict]:
+                            status: Optional[str],
+                            config: Optional[Dict[str, Any]] = None,
+                            payload: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
         try:
             result = send_request(request_type=REQUEST_TYPE.SET_FLOW,
                                   identifier=identifier,
+                                  payload=payload,
+                                  config=config,
                                   **{FORMAT_KEYS.FLOW_ID: flow_id,
                                      FORMAT_KEYS.STATUS: status})
         except Exception as ex:
@@ -411,8 +512,8 @@ class MikrotikCommandWorker(CommandWorker):
             Log.error_raise('flow without id')
         if not resource:
             credentials: Dict[str, object] = self.parse_credentials(credentials)
-            resource = self.initialize_connection_and_api_connector(credentials=credentials,
-                                                                    resource_path='/ip/firewall/filter')
+            # the flows are applied to resource_path
+            resource = self.initialize_connection_and_api_connector(credentials=credentials)
         existing_flow = self.get_flow_by_id_from_router(flow_id=flow_id,
                                                         credentials=credentials,
                                                         resource=resource,
@@ -430,20 +531,28 @@ class MikrotikCommandWorker(CommandWorker):
                 _id = flow_number
                 if not _id.startswith('*'):
                     _id = f'*{_id}'
-                _result = resource.remove(id=_id)
-                while not _result.done:
-                    time.sleep(0.05)
+                with self.observe_call('remove'):
+                    _result = resource.remove(id=_id)
+                    while not _result.done:
+                        time.sleep(0.05)
                 return _result
             except Exception as ex:
+                if self.is_trap(ex) and 'no such item' in str(ex):
+                    # removed meanwhile by another worker
+                    Log.debug(f'flow with id "{_id}" was already removed from router')
+                    return True
+                self.reset_connection(credentials or self.credentials, ex=ex)
                 logged = f'logged - ' if isinstance(ex, LException) else ''
                 Log.exception(f'failed to remove flow with id "{_id}" from router - {logged}error: "{str(ex)}"')
                 return None
 
         if lock:
-            with FileLock(self.__LOCK_FILE__):
+            with FileLock(self.lock_file(credentials)):
                 result = _send_request()
         else:
             result = _send_request()
+        if result is None:
+            return False
 
         Log.debug(f'flow with id "{flow_id}" was removed successfully')
         return True
@@ -473,19 +582,23 @@ class MikrotikCommandWorker(CommandWorker):
             flow_id = f'{self.comment_prefix()}{flow_id}'
         flow['comment'] = flow_id
         flow.pop('id', None)
+        # every key is sent to the router as a rule attribute
+        pop_flow_timestamp(flow)
 
         def _send_request():
             try:
-                _result = resource.add(**flow)
-                while not _result.done:
-                    time.sleep(0.05)
+                with self.observe_call('add'):
+                    _result = resource.add(**flow)
+                    while not _result.done:
+                        time.sleep(0.05)
                 return _result
             except Exception as ex:
+                self.reset_connection(credentials or self.credentials, ex=ex)
                 Log.exception_raise(f'failed to add a flow ("{flow_id}") to router - ex: "{str(ex)}"')
                 return None
 
         if lock:
-            with FileLock(self.__LOCK_FILE__):
+            with FileLock(self.lock_file(credentials)):
                 result = _send_request()
         else:
             result = _send_request()
@@ -515,16 +628,24 @@ class MikrotikCommandWorker(CommandWorker):
 
         def _send_request():
             try:
-                _result = resource.get()
-                while not _result.done:
-                    time.sleep(0.05)
-                return list(_result)
+                with self.observe_call('get'):
+                    _result = resource.get()
+                    while not _result.done:
+                        time.sleep(0.05)
+                _result = list(_result)
+                self.observe_bytes_read(sum(len(str(k)) + len(str(v)) for _ in _result for k, v in _.items()),
+                                        credentials)
+                record_transcript(self.vendor, f'{getattr(resource, "path", "")}print', _result,
+                                  credentials=credentials or self.credentials, comment_prefix=self.comment_prefix())
+                return _result
             except Exception as ex:
+                self.reset_connection(credentials or self.credentials, ex=ex)
                 Log.exception_raise(f'failed to read list of flows (rules) from router: "{str(ex)}"')
                 return []
 
         if lock:
-            with FileLock(self.__LOCK_FILE__):
+            # reads may run concurrently, only apply/remove need exclusive access to the router
+            with FileLock(self.lock_file(credentials), shared=True):
                 flows = _send_request()
         else:
             flows = _send_request()
@@ -0,0 +1,98 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Any, Union
+
+
+class RUNTIME:
+    THREADS = 'threads'
+    ASYNCIO = 'asyncio'
+
+    DEFAULT = THREADS
+
+    ALL = (THREADS, ASYNCIO)
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> str:
+        if not value:
+            return cls.DEFAULT
+        value = str(value).strip().lower()
+        if value not in cls.ALL:
+            raise ValueError(f'invalid runtime: "{value}"')
+        return value
+
+
+class AIO_DEFAULTS_KEYS:
+    EXECUTOR_WORKERS = 'executor_workers'
+
+
+AIO_DEFAULTS = {
+    # blocking calls without an asyncio implementation (mongodb, router APIs without an async client...)
+    AIO_DEFAULTS_KEYS.EXECUTOR_WORKERS: 16,
+}
+
+
+class AIO_PACKAGE:
+    ASYNCSSH = 'asyncssh'
+    AIOHTTP = 'aiohttp'
+
+    ALL = (ASYNCSSH, AIOHTTP)
+
+
+__IMPORTS__ = {
+    AIO_PACKAGE.ASYNCSSH: None,
+    AIO_PACKAGE.AIOHTTP: None,
+}
+
+
+def get_import(package: Union[AIO_PACKAGE, str]):
+    value = __IMPORTS__.get(package)
+    if value:
+        return value
+    if package == AIO_PACKAGE.ASYNCSSH:
+        import asyncssh
+        __IMPORTS__[package] = asyncssh
+    elif package == AIO_PACKAGE.AIOHTTP:
+        import aiohttp
+        __IMPORTS__[package] = aiohttp
+    else:
+        raise ValueError(f'invalid package: "{str(package)}"')
+    return __IMPORTS__[package]
+
+
+def has_package(package: Union[AIO_PACKAGE, str]) -> bool:
+    """
+    asyncssh and aiohttp are optional - without them the blocking clients run in the executor
+    """
+    try:
+        get_import(package)
+        return True
+    except ImportError:
+        return False
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def init_executor(max_workers: Optional[int] = None) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers or AIO_DEFAULTS[AIO_DEFAULTS_KEYS.EXECUTOR_WORKERS],
+                thread_name_prefix='aio-blocking')
+        return _executor
+
+
+async def run_blocking(func: Callable,
+                       *args, **kwargs) -> Any:
+    """
+    runs a blocking function in the bounded executor without blocking the event loop
+    """
+    loop = asyncio.get_running_loop()
+    # the context (the running trace span) is visible to the function
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(init_executor(), functools.partial(context.run, func, *args, **kwargs))
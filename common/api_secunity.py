@@ -1,10 +1,24 @@
-from typing import Optional, Tuple, Union, Dict, Any, List, Callable
-
-import requests
+import time
+import weakref
+from typing import Optional, Tuple, Union, Dict, Any, List, Callable, TYPE_CHECKING
 
 from common.configs import get_url_params
-from common.utils import parse_identifier, remove_unserializable_types
+from common.utils import parse_identifier, parse_bool
 from common.logs import Log
+from common.metrics import counter, histogram
+from common.serializers import encode_request_body, PAYLOAD_FORMAT, is_payload_format_available
+from common.tracing import span
+
+if TYPE_CHECKING:
+    import requests
+
+
+_API_REQUEST_SECONDS = histogram('secunity_api_request_seconds',
+                                 'Latency of Secunity API requests (incl. a payload format fallback resend)',
+                                 labelnames=('request_type',))
+_API_RESPONSES = counter('secunity_api_responses_total',
+                         'Secunity API responses by status code ("error" - no response was received)',
+                         labelnames=('request_type', 'status'))
 
 
 class URL_SETTING_KEY:
@@ -28,6 +42,39 @@ URL_SETTING_DEFAULTS = {
 }
 
 
+class API_SETTING_KEY:
+    COMPRESS = 'api_compress'
+    PAYLOAD_FORMAT = 'api_payload_format'
+    PAYLOAD_COMPACT = 'api_payload_compact'
+    CONNECT_TIMEOUT = 'api_connect_timeout'
+    READ_TIMEOUT = 'api_read_timeout'
+
+
+API_SETTING_DEFAULTS = {
+    API_SETTING_KEY.COMPRESS: False,
+    API_SETTING_KEY.PAYLOAD_FORMAT: PAYLOAD_FORMAT.JSON,
+    API_SETTING_KEY.PAYLOAD_COMPACT: True,
+    # seconds - an unreachable API must not hang the iteration
+    API_SETTING_KEY.CONNECT_TIMEOUT: 10,
+    API_SETTING_KEY.READ_TIMEOUT: 60,
+}
+
+
+class ApiConnectionError(ConnectionError):
+    """
+    the API could not be reached (connection refused or reset, connect/read timeout)
+    """
+
+
+def get_api_setting(key: str,
+                    config: Optional[Dict[str, Any]] = None,
+                    **kwargs) -> Any:
+    value = kwargs.get(key)
+    if value is None and config:
+        value = config.get(key)
+    return value if value is not None else API_SETTING_DEFAULTS.get(key)
+
+
 class REQUEST_TYPE:
     SEND_STATS = 'send_stats'
     GET_FLOWS = 'get_flows'
@@ -119,11 +166,94 @@ def get_url(request_type: Union[REQUEST_TYPE, str],
     return url
 
 
+# binary formats the API rejected (415/406) - the agent keeps sending json for the rest of the process lifetime
+_rejected_payload_formats = set()
+
+_NEGOTIATION_STATUS_CODES = (406, 415)
+
+
+def get_payload_format(request_type: Union['REQUEST_TYPE', str],
+                       config: Optional[Dict[str, Any]] = None,
+                       **kwargs) -> str:
+    """
+    binary payload formats are only used for stats uploads, anything else is sent as json
+    """
+    if request_type != REQUEST_TYPE.SEND_STATS:
+        return PAYLOAD_FORMAT.JSON
+    try:
+        payload_format = PAYLOAD_FORMAT.parse(get_api_setting(API_SETTING_KEY.PAYLOAD_FORMAT, config=config, **kwargs))
+    except Exception as ex:
+        Log.warning(f'{str(ex)}, falling back to "{PAYLOAD_FORMAT.JSON}"')
+        return PAYLOAD_FORMAT.JSON
+    if payload_format in _rejected_payload_formats:
+        return PAYLOAD_FORMAT.JSON
+    if not is_payload_format_available(payload_format):
+        Log.warning(f'payload format "{payload_format}" is not installed, falling back to "{PAYLOAD_FORMAT.JSON}"')
+        _rejected_payload_formats.add(payload_format)
+        return PAYLOAD_FORMAT.JSON
+    return payload_format
+
+
+def _encode_payload(request_type: Union[REQUEST_TYPE, str],
+                    payload: Optional[Dict[str, Any]],
+                    config: Optional[Dict[str, Any]] = None,
+                    payload_format: Optional[str] = None,
+                    **kwargs) -> Tuple[Dict[str, Any], str]:  # request params (data, headers), payload format
+    if not payload:
+        return {}, PAYLOAD_FORMAT.JSON
+    compress = parse_bool(get_api_setting(API_SETTING_KEY.COMPRESS, config=config, **kwargs), parse_str=True)
+    if not payload_format:
+        payload_format = get_payload_format(request_type, config=config, **kwargs)
+    compact = parse_bool(get_api_setting(API_SETTING_KEY.PAYLOAD_COMPACT, config=config, **kwargs), parse_str=True)
+    try:
+        with span('api.serialize', payload_format=payload_format, compress=compress):
+            data, headers = encode_request_body(payload, compress=compress, payload_format=payload_format,
+                                                compact=compact)
+    except Exception as ex:
+        Log.exception_raise(f'failed to serialize payload - ex: "{str(ex)}"')
+    return dict(data=data, headers=headers), payload_format
+
+
+def get_api_timeouts(config: Optional[Dict[str, Any]] = None,
+                     **kwargs) -> Tuple[float, float]:  # connect, read
+    return tuple(float(get_api_setting(_, config=config, **kwargs))
+                 for _ in (API_SETTING_KEY.CONNECT_TIMEOUT, API_SETTING_KEY.READ_TIMEOUT))
+
+
+def _is_connection_error(ex: Exception) -> bool:
+    import asyncio
+    import sys
+
+    if isinstance(ex, (ConnectionError, asyncio.TimeoutError)):
+        return True
+    for module_name, cls_names in (('requests.exceptions', ('ConnectionError', 'Timeout')),
+                                   ('aiohttp', ('ClientConnectionError', 'ServerTimeoutError'))):
+        module = sys.modules.get(module_name)
+        if module is not None and isinstance(ex, tuple(getattr(module, _) for _ in cls_names)):
+            return True
+    return False
+
+
+def _is_payload_format_rejected(payload_format: str,
+                                status_code: int) -> bool:
+    if payload_format == PAYLOAD_FORMAT.JSON or status_code not in _NEGOTIATION_STATUS_CODES:
+        return False
+    Log.warning(f'API does not accept "{payload_format}" payloads ({status_code}), '
+                f'resending as "{PAYLOAD_FORMAT.JSON}"')
+    _rejected_payload_formats.add(payload_format)
+    return True
+
+
 def send_request(request_type: Union[REQUEST_TYPE, str],
                  identifier: str,
                  payload: Optional[Dict[str, Any]] = None,
                  config: Optional[Dict[str, Any]] = None,
+                 raise_connection_error: Optional[bool] = False,
                  **kwargs) -> Optional[Union[str, Dict[str, Any], List[Dict[str, Any]]]]:
+    """
+    returns None when the request failed - raises ApiConnectionError instead when the API could not be reached and
+    raise_connection_error is set
+    """
     identifier = parse_identifier(identifier=identifier, **kwargs)
     if not identifier:
         Log.error(f'invalid identifier: "{identifier}"')
@@ -135,24 +265,36 @@ def send_request(request_type: Union[REQUEST_TYPE, str],
                           config=config, **kwargs)
     request_str = f'for identifier "{identifier}" to "{url}" using "{method}"'
     Log.debug(f'sending message {request_str}')
+    import requests
 
-    func_params = dict(url=url)
-    if payload:
-        try:
-            payload = remove_unserializable_types(payload)
-        except Exception as ex:
-            Log.exception_raise(f'failed to serialize payload - ex: "{str(ex)}"')
-        func_params['json'] = payload
+    func_params = dict(url=url, timeout=get_api_timeouts(config=config, **kwargs))
+    body_params, payload_format = _encode_payload(request_type, payload, config=config, **kwargs)
+    func_params.update(body_params)
     try:
         func: Callable = getattr(requests, method.lower())
     except Exception as ex:
         Log.exception_raise(f'failed to generate API request, invalid http method: "{method}"')
+    start = time.perf_counter()
     try:
-        response: requests.Response = func(**func_params)
+        with span('api.request', request_type=request_type) as request_span:
+            response: 'requests.Response' = func(**func_params)
+            _API_RESPONSES.inc(request_type=request_type, status=response.status_code)
+            if _is_payload_format_rejected(payload_format, response.status_code):
+                func_params.update(_encode_payload(request_type, payload, config=config,
+                                                   payload_format=PAYLOAD_FORMAT.JSON, **kwargs)[0])
+                response = func(**func_params)
+                _API_RESPONSES.inc(request_type=request_type, status=response.status_code)
+            if request_span:
+                request_span.attrs['status'] = response.status_code
         success = 200 <= response.status_code <= 210
     except Exception as ex:
+        _API_RESPONSES.inc(request_type=request_type, status='error')
         Log.error(f'failed to send message {request_str}. ex: "{str(ex)}"')
+        if raise_connection_error and _is_connection_error(ex):
+            raise ApiConnectionError(str(ex)) from ex
         return None
+    finally:
+        _API_REQUEST_SECONDS.observe(time.perf_counter() - start, request_type=request_type)
     if not success:
         Log.error("API function was not successfully performed")
         return None
@@ -163,3 +305,94 @@ def send_request(request_type: Union[REQUEST_TYPE, str],
         Log.exception(f'failed to read data from the API. error: "{str(ex)}"')
         return None
     return result
+
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+def _get_session():  # aiohttp.ClientSession
+    import asyncio
+    from common.aio import AIO_PACKAGE, get_import
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        aiohttp = get_import(AIO_PACKAGE.AIOHTTP)
+        session = _sessions[loop] = aiohttp.ClientSession()
+    return session
+
+
+async def close_sessions():
+    import asyncio
+
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def send_request_async(request_type: Union[REQUEST_TYPE, str],
+                             identifier: str,
+                             payload: Optional[Dict[str, Any]] = None,
+                             config: Optional[Dict[str, Any]] = None,
+                             raise_connection_error: Optional[bool] = False,
+                             **kwargs) -> Optional[Union[str, Dict[str, Any], List[Dict[str, Any]]]]:
+    """
+    send_request counterpart for the asyncio runtime, uses aiohttp when installed
+    """
+    from common.aio import AIO_PACKAGE, get_import, has_package, run_blocking
+
+    if not has_package(AIO_PACKAGE.AIOHTTP):
+        return await run_blocking(send_request, request_type=request_type, identifier=identifier,
+                                  payload=payload, config=config, raise_connection_error=raise_connection_error,
+                                  **kwargs)
+    identifier = parse_identifier(identifier=identifier, **kwargs)
+    if not identifier:
+        Log.error(f'invalid identifier: "{identifier}"')
+        return None
+
+    url, method = get_url(request_type=request_type,
+                          identifier=identifier,
+                          method=True,
+                          config=config, **kwargs)
+    request_str = f'for identifier "{identifier}" to "{url}" using "{method}"'
+    Log.debug(f'sending message {request_str}')
+
+    func_params, payload_format = _encode_payload(request_type, payload, config=config, **kwargs)
+    connect_timeout, read_timeout = get_api_timeouts(config=config, **kwargs)
+    timeout = get_import(AIO_PACKAGE.AIOHTTP).ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    session = _get_session()
+    start = time.perf_counter()
+    try:
+        with span('api.request', request_type=request_type) as request_span:
+            response = await session.request(method, url, timeout=timeout, **func_params)
+            _API_RESPONSES.inc(request_type=request_type, status=response.status)
+            if _is_payload_format_rejected(payload_format, response.status):
+                response.release()
+                func_params = _encode_payload(request_type, payload, config=config,
+                                              payload_format=PAYLOAD_FORMAT.JSON, **kwargs)[0]
+                response = await session.request(method, url, timeout=timeout, **func_params)
+                _API_RESPONSES.inc(request_type=request_type, status=response.status)
+            if request_span:
+                request_span.attrs['status'] = response.status
+        success = 200 <= response.status <= 210
+    except Exception as ex:
+        _API_RESPONSES.inc(request_type=request_type, status='error')
+        Log.error(f'failed to send message {request_str}. ex: "{str(ex)}"')
+        if raise_connection_error and _is_connection_error(ex):
+            raise ApiConnectionError(str(ex)) from ex
+        return None
+    finally:
+        _API_REQUEST_SECONDS.observe(time.perf_counter() - start, request_type=request_type)
+    try:
+        if not success:
+            Log.error("API function was not successfully performed")
+            return None
+        try:
+            result = await response.json(content_type=None) \
+                if 'application/json' in response.headers.get('Content-Type', '') else await response.text()
+        except Exception as ex:
+            Log.exception(f'failed to read data from the API. error: "{str(ex)}"')
+            return None
+        return result
+    finally:
+        response.release()
@@ -0,0 +1,88 @@
+import threading
+import time
+from typing import Optional
+
+from common.logs import Log
+from common.metrics import gauge
+
+
+class CIRCUIT_STATE:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    ALL = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CIRCUIT_BREAKER_DEFAULTS_KEYS:
+    FAILURE_THRESHOLD = 'failure_threshold'
+    RESET_TIMEOUT = 'reset_timeout'
+
+
+CIRCUIT_BREAKER_DEFAULTS = {
+    CIRCUIT_BREAKER_DEFAULTS_KEYS.FAILURE_THRESHOLD: 3,
+    CIRCUIT_BREAKER_DEFAULTS_KEYS.RESET_TIMEOUT: 300,  # seconds
+}
+
+
+_BREAKER_OPEN = gauge('secunity_circuit_breaker_open',
+                      'Whether the circuit breaker is open (1) or not (0)',
+                      labelnames=('breaker',))
+
+
+class CircuitBreaker:
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None):
+        """
+        Opens after failure_threshold consecutive failures - calls are not allowed for reset_timeout seconds,
+        then a single trial call is allowed (half open) which closes it on success or re-opens it on failure
+        """
+        self._name = name
+        self._failure_threshold = failure_threshold or \
+            CIRCUIT_BREAKER_DEFAULTS[CIRCUIT_BREAKER_DEFAULTS_KEYS.FAILURE_THRESHOLD]
+        self._reset_timeout = reset_timeout or CIRCUIT_BREAKER_DEFAULTS[CIRCUIT_BREAKER_DEFAULTS_KEYS.RESET_TIMEOUT]
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_STATE.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        _BREAKER_OPEN.set(0, breaker=self._name)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CIRCUIT_STATE.CLOSED:
+                return True
+            if self._state == CIRCUIT_STATE.OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+                self._state = CIRCUIT_STATE.HALF_OPEN
+                Log.info(f'circuit breaker "{self._name}" is half open - allowing a trial call')
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CIRCUIT_STATE.CLOSED:
+                Log.info(f'circuit breaker "{self._name}" is closed')
+                _BREAKER_OPEN.set(0, breaker=self._name)
+            self._state = CIRCUIT_STATE.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == CIRCUIT_STATE.HALF_OPEN or \
+                    (self._state == CIRCUIT_STATE.CLOSED and self._failures >= self._failure_threshold):
+                Log.warning(f'circuit breaker "{self._name}" is open for {self._reset_timeout} seconds - '
+                            f'{self._failures} consecutive failures')
+                self._state = CIRCUIT_STATE.OPEN
+                self._opened_at = time.monotonic()
+                _BREAKER_OPEN.set(1, breaker=self._name)
@@ -0,0 +1,259 @@
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterable, Optional, TYPE_CHECKING
+
+from common.logs import Log
+
+if TYPE_CHECKING:
+    import pymongo
+
+
+class CLOUD_DB_DEFAULTS_KEYS:
+    PORT = 'port'
+    AUTH_SOURCE = 'authSource'
+    DB_NAME = 'db_name'
+    CREDENTIALS_TTL = 'credentials_ttl'
+    CIPHER_KEY_ID = 'cipher_key_id'
+
+
+CLOUD_DB_DEFAULTS = {
+    CLOUD_DB_DEFAULTS_KEYS.PORT: 27017,
+    CLOUD_DB_DEFAULTS_KEYS.AUTH_SOURCE: 'admin',
+    CLOUD_DB_DEFAULTS_KEYS.DB_NAME: 'secunity',
+    CLOUD_DB_DEFAULTS_KEYS.CREDENTIALS_TTL: 300,  # seconds
+    CLOUD_DB_DEFAULTS_KEYS.CIPHER_KEY_ID: 'cipher-symetric_default',
+}
+
+
+class TTLCache:
+
+    def __init__(self, ttl: Optional[float] = None):
+        self._ttl = ttl or CLOUD_DB_DEFAULTS[CLOUD_DB_DEFAULTS_KEYS.CREDENTIALS_TTL]
+        self._items: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._items[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._items[key] = (time.monotonic() + (ttl or self._ttl), value)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """
+        removes key, or all the keys when key is None
+        """
+        with self._lock:
+            if key is None:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_clients: Dict[str, 'pymongo.MongoClient'] = {}
+_clients_lock = threading.Lock()
+_cipher_keys = TTLCache()
+_credentials = TTLCache()
+
+
+def _mongo_uri(mongodb_params: Dict[str, Any]) -> str:
+    usr = mongodb_params.get('username') or mongodb_params.get('user')
+    passwd = mongodb_params.get('password')
+    host = mongodb_params.get('host')
+    port = mongodb_params.get('port', CLOUD_DB_DEFAULTS[CLOUD_DB_DEFAULTS_KEYS.PORT])
+    auth = mongodb_params.get('authSource') or CLOUD_DB_DEFAULTS[CLOUD_DB_DEFAULTS_KEYS.AUTH_SOURCE]
+    return f"mongodb://{usr}:{passwd}@{host}:{port}/{auth}"
+
+
+def get_mongo_client(mongodb_params: Dict[str, Any],
+                     client: Optional[Any] = None) -> 'pymongo.MongoClient':
+    """
+    A process-wide client per uri - MongoClient is thread safe and pools its connections.
+    client registers an already created client for the uri (e.g. a mongomock client)
+    """
+    uri = _mongo_uri(mongodb_params)
+    with _clients_lock:
+        if client is not None:
+            _clients[uri] = client
+        elif uri not in _clients:
+            from pymongo import MongoClient
+
+            Log.debug(f'connecting to db - "{uri.split("@", 1)[-1]}"')
+            _clients[uri] = MongoClient(uri)
+        return _clients[uri]
+
+
+def get_mongo_db(mongodb_params: Dict[str, Any]):
+    db_name = mongodb_params.get('db_name') or CLOUD_DB_DEFAULTS[CLOUD_DB_DEFAULTS_KEYS.DB_NAME]
+    return get_mongo_client(mongodb_params)[db_name]
+
+
+def close_mongo_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as ex:
+            Log.warning(f'failed to close a db client - error: "{str(ex)}"')
+
+
+def get_cipher_key(db) -> str:
+    key = _cipher_keys.get(db.name)
+    if key is None:
+        key = db.SecunitySettings.find_one(CLOUD_DB_DEFAULTS[CLOUD_DB_DEFAULTS_KEYS.CIPHER_KEY_ID])['value']
+        _cipher_keys.set(db.name, key)
+    return key
+
+
+def decrypt_symetric(db, word, key=None):
+    from Crypto.Cipher import AES
+    import base64
+    if isinstance(word, str):
+        word = word.encode('utf-8')
+    if key is None:
+        key = get_cipher_key(db)
+
+    word = base64.b64decode(word)
+    iv = word[0:AES.block_size]
+    cipher = AES.new(base64.b64decode(key), AES.MODE_CFB, iv)
+    return cipher.decrypt(word[16:]).decode('utf-8')
+
+
+def decrypt(db, word, key=None):
+    try:
+        return decrypt_symetric(db, word=word, key=key)
+    except Exception as ex:
+        return word
+
+
+def get_cached_credentials(agent_id: str) -> Optional[Dict[str, Any]]:
+    credentials = _credentials.get(agent_id)
+    # callers pop vrf/model from the result
+    return dict(credentials) if credentials else None
+
+
+def cache_credentials(agent_id: str,
+                      credentials: Dict[str, Any],
+                      ttl: Optional[float] = None):
+    _credentials.set(agent_id, dict(credentials), ttl=ttl)
+
+
+def invalidate_credentials(agent_id: Optional[str] = None):
+    """
+    called when the router rejects the credentials - they (or the cipher key) may have been rotated
+    """
+    _credentials.invalidate(agent_id)
+    _cipher_keys.invalidate()
+
+
+_DEVICE_CREDENTIALS_PROJECTION = {
+    'client.flowspec.stats_settings.agent_id': 1,
+    'client.flowspec.ssh_settings': 1,
+    'vendor': 1,
+    'model': 1,
+    'default_stats_interface_name': 1,
+}
+
+
+def _parse_device_credentials(db,
+                              device: Dict[str, Any],
+                              key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    ssh_settings = device.get('client', {}).get('flowspec', {}).get('ssh_settings', {})
+    ssh_usr = ssh_settings.get('username')
+    password = ssh_settings.get('password')
+    ssh_pass = decrypt(db, password, key=key)
+    ssh_host = ssh_settings.get('ip')
+    ssh_port = ssh_settings.get('port', 22)
+
+    vrf = device.get('default_stats_interface_name')
+    vendor = device.get('vendor')
+    model = device.get('model')
+
+    Log.debug(f'Credentials from DB - "{ssh_usr}@{ssh_host}:{ssh_port}", vrf: "{vrf}", vendor: "{vendor}", model: "{model}"')
+
+    return dict(host=ssh_host, port=ssh_port, username=ssh_usr, password=ssh_pass, vrf=vrf, model=model, vendor=vendor) \
+        if ssh_usr and ssh_pass and ssh_host else None
+
+
+def load_device_credentials(db,
+                            agent_id: str) -> Optional[Dict[str, Any]]:
+    from bson import ObjectId
+
+    device = db.AccountNetworkDevices.find_one({
+        "client.flowspec.stats_settings.use_agent": True,
+        'client.flowspec.stats_settings.agent_id': ObjectId(agent_id)
+    }, _DEVICE_CREDENTIALS_PROJECTION)
+    if not device:
+        Log.error(f'failed to get account network device from db')
+        return None
+    return _parse_device_credentials(db, device)
+
+
+def load_devices_credentials(db,
+                             agent_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    credentials of many devices in a single query, decrypted with a single cipher key lookup
+    """
+    from bson import ObjectId
+
+    object_ids = [ObjectId(_) for _ in set(agent_ids)]
+    if not object_ids:
+        return {}
+    devices = list(db.AccountNetworkDevices.find({
+        "client.flowspec.stats_settings.use_agent": True,
+        'client.flowspec.stats_settings.agent_id': {'$in': object_ids}
+    }, _DEVICE_CREDENTIALS_PROJECTION))
+    key = None
+    if devices:
+        try:
+            key = get_cipher_key(db)
+        except Exception as ex:
+            Log.error(f'failed to get the cipher key - error: "{str(ex)}"')
+    result = {}
+    for device in devices:
+        agent_id = device.get('client', {}).get('flowspec', {}).get('stats_settings', {}).get('agent_id')
+        credentials = _parse_device_credentials(db, device, key=key) if agent_id else None
+        if credentials:
+            result[str(agent_id)] = credentials
+    return result
+
+
+def get_device_credentials(mongodb_params: Dict[str, Any],
+                           agent_id: str,
+                           ttl: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    the cached credentials of the device, loaded from the db once they expire
+    """
+    credentials = get_cached_credentials(agent_id)
+    if credentials:
+        return credentials
+    credentials = load_device_credentials(get_mongo_db(mongodb_params), agent_id)
+    if not credentials:
+        return None
+    cache_credentials(agent_id, credentials, ttl=ttl)
+    return credentials
+
+
+def preload_credentials(db,
+                        agent_ids: Iterable[str],
+                        ttl: Optional[float] = None) -> int:
+    """
+    loads and caches the credentials of the devices, returns the number of devices with valid credentials
+    """
+    credentials = load_devices_credentials(db, agent_ids)
+    for agent_id, value in credentials.items():
+        cache_credentials(agent_id, value, ttl=ttl)
+    return len(credentials)
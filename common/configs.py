@@ -4,12 +4,6 @@ import re
 from typing import Optional, Union, Dict, Any
 
 from common.logs import Log
-
-try:
-    import jstyleson as json
-except:
-    import json
-
 from common.consts import BOOL_VALUES
 from common.enums import VENDOR
 from common.utils import parse_ip
@@ -106,6 +100,10 @@ def parse_config_file(config: str,  # full file path
         if not os.path.isfile(filename):
             from common.consts import DEFAULTS, DEFAULT_KEYS
             config = DEFAULTS[DEFAULT_KEYS.CONFIG]
+    try:
+        import jstyleson as json
+    except:
+        import json
     try:
         with open(config, 'r') as f:
             cnf = json.load(f)
@@ -134,6 +132,7 @@ def parse_bool(*args, **kwargs):
 _config_types_mutation = {
     str: lambda x: x.strip(' \r\n\t') if isinstance(x, str) else str(x),
     int: lambda x: x if isinstance(x, int) else int(x.strip(' \r\n\t') if isinstance(x, str) else x),
+    float: lambda x: x if isinstance(x, float) else float(x.strip(' \r\n\t') if isinstance(x, str) else x),
     'bool_str': lambda x: parse_bool(x, parse_str=True),
     bool: parse_bool,
     'vendor': VENDOR.parse,
@@ -166,22 +165,70 @@ class CONFIG_KEY:
     DUMP = 'dump'
     TO_STDERR = 'to_stderr'
     TO_STDOUT = 'to_stdout'
+    LOG_ASYNC = 'log_async'
+    LOG_QUEUE_SIZE = 'log_queue_size'
+    LOG_MAX_BYTES = 'log_max_bytes'
+    LOG_BACKUP_COUNT = 'log_backup_count'
+    HEARTBEATS_PATH = 'heartbeats_path'
+    HEARTBEATS_FLUSH_MS = 'heartbeats_flush_ms'
+    SPOOL = 'spool'
+    SPOOL_PATH = 'spool_path'
+    SPOOL_MAX_BYTES = 'spool_max_bytes'
+    SPOOL_MAX_AGE = 'spool_max_age'
+    SPOOL_SEGMENT_BYTES = 'spool_segment_bytes'
+    SPOOL_REPLAY_BATCH = 'spool_replay_batch'
+    STATS_CHUNK_BYTES = 'stats_chunk_bytes'
+    STATS_CHUNK_RETRIES = 'stats_chunk_retries'
 
     IDENTIFIER = 'identifier'
     HOST = 'host'
     PORT = 'port'
+    API_PORT = 'api_port'
     VENDOR = 'vendor'
     USERNAME = 'username'
     PASSWORD = 'password'
     COMMAND_PREFIX = 'command_prefix'
 
+    DEVICES = 'devices'
+    INTERVAL = 'interval'
+    MAX_CONCURRENT_DEVICES = 'max_concurrent_devices'
+    BREAKER_FAILURE_THRESHOLD = 'breaker_failure_threshold'
+    BREAKER_RESET_TIMEOUT = 'breaker_reset_timeout'
+    RUNTIME = 'runtime'
+    AIO_EXECUTOR_WORKERS = 'aio_executor_workers'
+    CREDENTIALS_TTL = 'credentials_ttl'
+    PARSE_PROCESSES = 'parse_processes'
+    PARSE_MIN_BYTES = 'parse_min_bytes'
+    METRICS_HOST = 'metrics_host'
+    METRICS_PORT = 'metrics_port'
+    TRACING = 'tracing'
+    TRACING_FOLDER = 'tracing_folder'
+    TRACING_MAX_BYTES = 'tracing_max_bytes'
+    TRACING_BACKUP_COUNT = 'tracing_backup_count'
+    TRACING_BUFFER_SIZE = 'tracing_buffer_size'
+    PROFILES_FOLDER = 'profiles_folder'
+    PROFILE_ITERATIONS = 'profile_iterations'
+    PROFILE_MODE = 'profile_mode'
+    PROFILE_TRIGGER_FILE = 'profile_trigger_file'
+    PROFILE_MAX_OVERHEAD = 'profile_max_overhead'
+    PROFILE_TOP_ALLOCATIONS = 'profile_top_allocations'
+    RECORD_FOLDER = 'record_folder'
+    RECORD_MAX_TRANSCRIPTS = 'record_max_transcripts'
+    FLOWS_ITERATION_BUDGET = 'flows_iteration_budget'
+
     URL_SCHEME = 'url_scheme'
     URL_HOST = 'url_host'
     URL_PORT = 'url_port'
     URL_PATH = 'url_path'
     URL_METHOD = 'url_method'
 
-    SSH_CONFIG_KEYS = (HOST, PORT, USERNAME, PASSWORD)
+    API_COMPRESS = 'api_compress'
+    API_PAYLOAD_FORMAT = 'api_payload_format'
+    API_PAYLOAD_COMPACT = 'api_payload_compact'
+    API_CONNECT_TIMEOUT = 'api_connect_timeout'
+    API_READ_TIMEOUT = 'api_read_timeout'
+
+    SSH_CONFIG_KEYS = (HOST, PORT, API_PORT, USERNAME, PASSWORD)
 
 
 CONFIG_KEYS = {
@@ -192,21 +239,69 @@ CONFIG_KEYS = {
     CONFIG_KEY.DUMP: str,
     CONFIG_KEY.TO_STDERR: 'bool_str',
     CONFIG_KEY.TO_STDOUT: 'bool_str',
+    CONFIG_KEY.LOG_ASYNC: 'bool_str',
+    CONFIG_KEY.LOG_QUEUE_SIZE: int,
+    CONFIG_KEY.LOG_MAX_BYTES: int,
+    CONFIG_KEY.LOG_BACKUP_COUNT: int,
+    CONFIG_KEY.HEARTBEATS_PATH: str,
+    CONFIG_KEY.HEARTBEATS_FLUSH_MS: int,
+    CONFIG_KEY.SPOOL: 'bool_str',
+    CONFIG_KEY.SPOOL_PATH: str,
+    CONFIG_KEY.SPOOL_MAX_BYTES: int,
+    CONFIG_KEY.SPOOL_MAX_AGE: int,
+    CONFIG_KEY.SPOOL_SEGMENT_BYTES: int,
+    CONFIG_KEY.SPOOL_REPLAY_BATCH: int,
+    CONFIG_KEY.STATS_CHUNK_BYTES: int,
+    CONFIG_KEY.STATS_CHUNK_RETRIES: int,
 
     CONFIG_KEY.IDENTIFIER: str,
 
     CONFIG_KEY.HOST: 'ip',
     CONFIG_KEY.PORT: int,
+    CONFIG_KEY.API_PORT: int,
     CONFIG_KEY.VENDOR: str,
     CONFIG_KEY.USERNAME: str,
     CONFIG_KEY.PASSWORD: str,
     CONFIG_KEY.COMMAND_PREFIX: str,
 
+    CONFIG_KEY.DEVICES: list,
+    CONFIG_KEY.INTERVAL: int,
+    CONFIG_KEY.MAX_CONCURRENT_DEVICES: int,
+    CONFIG_KEY.BREAKER_FAILURE_THRESHOLD: int,
+    CONFIG_KEY.BREAKER_RESET_TIMEOUT: int,
+    CONFIG_KEY.RUNTIME: str,
+    CONFIG_KEY.AIO_EXECUTOR_WORKERS: int,
+    CONFIG_KEY.CREDENTIALS_TTL: int,
+    CONFIG_KEY.PARSE_PROCESSES: int,
+    CONFIG_KEY.PARSE_MIN_BYTES: int,
+    CONFIG_KEY.METRICS_HOST: str,
+    CONFIG_KEY.METRICS_PORT: int,
+    CONFIG_KEY.TRACING: 'bool_str',
+    CONFIG_KEY.TRACING_FOLDER: str,
+    CONFIG_KEY.TRACING_MAX_BYTES: int,
+    CONFIG_KEY.TRACING_BACKUP_COUNT: int,
+    CONFIG_KEY.TRACING_BUFFER_SIZE: int,
+    CONFIG_KEY.PROFILES_FOLDER: str,
+    CONFIG_KEY.PROFILE_ITERATIONS: int,
+    CONFIG_KEY.PROFILE_MODE: str,
+    CONFIG_KEY.PROFILE_TRIGGER_FILE: str,
+    CONFIG_KEY.PROFILE_MAX_OVERHEAD: float,
+    CONFIG_KEY.PROFILE_TOP_ALLOCATIONS: int,
+    CONFIG_KEY.RECORD_FOLDER: str,
+    CONFIG_KEY.RECORD_MAX_TRANSCRIPTS: int,
+    CONFIG_KEY.FLOWS_ITERATION_BUDGET: float,
+
     CONFIG_KEY.URL_SCHEME: str,
     CONFIG_KEY.URL_HOST: str,
     CONFIG_KEY.URL_PORT: int,
     CONFIG_KEY.URL_PATH: str,
     CONFIG_KEY.URL_METHOD: str,
+
+    CONFIG_KEY.API_COMPRESS: 'bool_str',
+    CONFIG_KEY.API_PAYLOAD_FORMAT: str,
+    CONFIG_KEY.API_PAYLOAD_COMPACT: 'bool_str',
+    CONFIG_KEY.API_CONNECT_TIMEOUT: float,
+    CONFIG_KEY.API_READ_TIMEOUT: float,
 }
 
 
@@ -1,8 +1,5 @@
-try:
-    import paramiko
-    SSH_PORT = paramiko.config.SSH_PORT
-except:
-    SSH_PORT = 22
+# same as paramiko.config.SSH_PORT, without importing paramiko
+SSH_PORT = 22
 
 BOOL_VALUES = (True, False)
 
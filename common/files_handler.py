@@ -1,8 +1,10 @@
+import fcntl
 import os.path
 import time
 from typing import Optional, Union, Iterable, Tuple, List
 
 from common.logs import Log
+from common.metrics import counter, histogram
 
 
 class FILE:
@@ -67,7 +69,7 @@ def read_file(file: Union[FILE, str],
         lock_file = _LOCK_FILES.get(file)
         if not lock_file:
             Log.error_raise(f'invalid lock: "{lock}"')
-        with FileLock(filename=lock_file, mode='w'):
+        with FileLock(filename=lock_file, shared=True):
             return _read()
     else:
         return _read()
@@ -85,7 +87,7 @@ def write_line(file: Union[FILE, str],
         lock_file = _LOCK_FILES.get(file)
         if not lock_file:
             Log.error_raise(f'invalid lock: "{lock}"')
-        with FileLock(filename=lock_file, mode='w', retries=5, sleep=0.1):
+        with FileLock(filename=lock_file, retries=5, sleep=0.1):
             with open(file_path, mode=mode) as f:
                 for line in lines:
                     _write_line(handle=f, line=line, newline=True)
@@ -95,21 +97,44 @@ def write_line(file: Union[FILE, str],
                 _write_line(handle=f, line=line, newline=True)
 
 
+_LOCK_WAIT_SECONDS = histogram('secunity_file_lock_wait_seconds',
+                               'Time spent waiting to acquire a file lock',
+                               labelnames=('lock', 'mode'))
+_LOCK_HOLD_SECONDS = histogram('secunity_file_lock_hold_seconds',
+                               'Time a file lock was held',
+                               labelnames=('lock', 'mode'))
+_LOCK_TIMEOUTS = counter('secunity_file_lock_timeouts_total',
+                         'File lock acquisitions that timed out',
+                         labelnames=('lock', 'mode'))
+
+
+class LOCK_MODE:
+    SHARED = 'shared'
+    EXCLUSIVE = 'exclusive'
+
+    ALL = (SHARED, EXCLUSIVE)
+
+
 class FileLock:
 
     __DEFAULTS__ = {
         'retries': 3,
         'sleep': 0.1,
-        'mode': 'w'
+        'mode': 'a',
+        'timeout': 30,
+        'poll_interval': 0.005,
     }
 
     def __init__(self,
                  filename: str,
                  retries: Optional[int] = None,
                  sleep: Optional[Union[int, float]] = None,
-                 mode: Optional[Union[str, MODE]] = None):
+                 mode: Optional[Union[str, MODE]] = None,
+                 shared: Optional[bool] = False,
+                 timeout: Optional[Union[int, float]] = None):
         """
-        Perform file lock. Performs several attempts to lock the file
+        Perform an advisory inter-process file lock (flock), shared or exclusive.
+        Performs several attempts to open the lock file, then waits for the lock up to timeout seconds
         """
         self._filename = filename
         if not retries:
@@ -121,19 +146,58 @@ class FileLock:
         if not mode:
             mode = self.__DEFAULTS__['mode']
         self._mode = mode
+        if timeout is None:
+            timeout = self.__DEFAULTS__['timeout']
+        self._timeout = timeout
+        self._lock_mode = LOCK_MODE.SHARED if shared else LOCK_MODE.EXCLUSIVE
+        self._name = os.path.splitext(os.path.basename(filename))[0]
         self._handle = None
+        self._acquired_at = None
 
-    def __enter__(self):
+    def _open(self):
         for attempt in range(self._retries):
             try:
-                self._handle = open(self._filename, self._mode)
-                return self._handle
+                return open(self._filename, self._mode)
             except Exception as ex:
-                if attempt < self._retries:
+                if attempt < self._retries - 1:
                     time.sleep(self._sleep)
                 else:
                     raise ex
 
+    def _acquire(self):
+        operation = fcntl.LOCK_SH if self._lock_mode == LOCK_MODE.SHARED else fcntl.LOCK_EX
+        start = time.monotonic()
+        deadline = start + self._timeout
+        poll_interval = self.__DEFAULTS__['poll_interval']
+        while True:
+            try:
+                fcntl.flock(self._handle.fileno(), operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                now = time.monotonic()
+                if now >= deadline:
+                    _LOCK_TIMEOUTS.inc(lock=self._name, mode=self._lock_mode)
+                    Log.error_raise(f'timed out after {self._timeout} seconds waiting for '
+                                    f'{self._lock_mode} lock "{self._filename}"')
+                time.sleep(min(poll_interval, deadline - now))
+                poll_interval = min(poll_interval * 2, self._sleep)
+        self._acquired_at = time.monotonic()
+        _LOCK_WAIT_SECONDS.observe(self._acquired_at - start, lock=self._name, mode=self._lock_mode)
+
+    def __enter__(self):
+        self._handle = self._open()
+        try:
+            self._acquire()
+        except BaseException:
+            self._handle.close()
+            raise
+        return self._handle
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self._handle and not self._handle.closed:
+            if self._acquired_at is not None:
+                _LOCK_HOLD_SECONDS.observe(time.monotonic() - self._acquired_at,
+                                           lock=self._name, mode=self._lock_mode)
+                self._acquired_at = None
+            # closing the file releases the lock
             self._handle.close()
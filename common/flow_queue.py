@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from common.logs import Log
+from common.metrics import counter, gauge
+
+
+class FLOW_QUEUE_DEFAULTS_KEYS:
+    BUDGET = 'flows_iteration_budget'
+    INTERVAL_SHARE = 'interval_share'
+
+
+FLOW_QUEUE_DEFAULTS = {
+    # seconds of router operations per iteration, the rest is left to the next iteration. None - a share of the
+    # interval of the worker
+    FLOW_QUEUE_DEFAULTS_KEYS.BUDGET: None,
+    # the rest of the interval is left for the poll of the flows and the status reports
+    FLOW_QUEUE_DEFAULTS_KEYS.INTERVAL_SHARE: 0.8,
+}
+
+
+class FLOW_OPERATION:
+    APPLY = 'apply'
+    REMOVE = 'remove'
+
+    ALL = (APPLY, REMOVE)
+
+    # statuses of the backend
+    BY_STATUS = {
+        'apply': APPLY,
+        'applied': APPLY,
+        'remove': REMOVE,
+        'removed': REMOVE,
+    }
+
+
+# applies stop traffic, removes only free router resources
+_OPERATION_RANK = {FLOW_OPERATION.APPLY: 0, FLOW_OPERATION.REMOVE: 1}
+
+# rules that drop the traffic first, then the rate limited ones (the lowest rate first), then the rest
+_DROP_ACTIONS = ('drop', 'reject', 'tarpit', 'discard')
+_RATE_KEYS = ('limit', 'dst-limit', 'rate')
+_RE_RATE = re.compile(r'^\s*(\d+(?:\.\d+)?)')
+
+_PENDING = gauge('secunity_flow_operations_pending',
+                 'Flow operations left to the next iteration',
+                 labelnames=('worker', 'device', 'operation'))
+_DEFERRED = counter('secunity_flow_operations_deferred_total',
+                    'Flow operations deferred to the next iteration by the time budget',
+                    labelnames=('worker', 'device', 'operation'))
+
+
+def _rate(flow: Dict[str, Any]) -> Optional[float]:
+    for key in _RATE_KEYS:
+        value = flow.get(key)
+        match = _RE_RATE.match(str(value)) if value is not None else None
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def flow_priority(operation: str,
+                  flow: Dict[str, Any]) -> Tuple[Union[int, float], ...]:
+    """
+    sort key of a flow operation, lower first
+    """
+    action = str(flow.get('action') or '').lower()
+    rate = _rate(flow)
+    if action in _DROP_ACTIONS:
+        impact = (0, 0.0)
+    elif rate is not None:
+        impact = (1, rate)
+    else:
+        impact = (2, 0.0)
+    return (_OPERATION_RANK.get(operation, len(_OPERATION_RANK)),) + impact
+
+
+class FlowQueue:
+
+    def __init__(self,
+                 worker: str,
+                 device: Optional[str] = None,
+                 budget: Optional[float] = None,
+                 interval: Optional[float] = None,
+                 **kwargs):
+        """
+        The pending flow operations of a device, ordered by priority (applies before removes, then by the action and
+        rate of the flow, then by the time they were first queued). Every iteration runs operations until its time
+        budget is spent - the rest stay queued for the next iteration, refreshed by its poll of the flows.
+        Without a budget, most of the interval of the worker is used (no limit without an interval either)
+        """
+        self._worker = worker
+        # every device of the worker has its own queue
+        self._device = device or '-'
+        if budget is None:
+            budget = FLOW_QUEUE_DEFAULTS[FLOW_QUEUE_DEFAULTS_KEYS.BUDGET]
+        if budget is None:
+            budget = interval * FLOW_QUEUE_DEFAULTS[FLOW_QUEUE_DEFAULTS_KEYS.INTERVAL_SHARE] \
+                if interval and interval > 0 else float('inf')
+        self._budget = budget
+        # key -> (operation, flow, sequence)
+        self._operations: Dict[str, Tuple[str, Dict[str, Any], int]] = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._operations)
+
+    def update(self, flows_by_status: Dict[str, List[Dict[str, Any]]]) -> int:
+        """
+        replaces the pending operations with the polled ones - operations that were not polled again (withdrawn or
+        done by another worker) are dropped, the others keep their place. returns the number of new operations
+        """
+        operations, new = {}, 0
+        with self._lock:
+            for status, flows in flows_by_status.items():
+                operation = FLOW_OPERATION.BY_STATUS.get(status)
+                if not operation:
+                    Log.error(f'invalid flow status: "{status}"')
+                    continue
+                for flow in flows or ():
+                    self._sequence += 1
+                    key = f'{operation}/{flow.get("id") or f"-{self._sequence}"}'
+                    queued = self._operations.get(key)
+                    if queued is None:
+                        new += 1
+                    operations[key] = (operation, flow, queued[2] if queued else self._sequence)
+            self._operations = operations
+        if not operations:
+            for operation in FLOW_OPERATION.ALL:
+                _PENDING.set(0, worker=self._worker, device=self._device, operation=operation)
+        return new
+
+    def pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            operations = sorted(self._operations.items(),
+                                key=lambda _: flow_priority(_[1][0], _[1][1]) + (_[1][2],))
+        return [(operation, flow) for _, (operation, flow, _sequence) in operations]
+
+    def run(self, budget: Optional[float] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        yields the operations by priority (copies of the flows, the router calls change them) until the budget is
+        spent - at least one operation runs in every iteration. an operation stays queued until done() is called
+        """
+        budget = self._budget if budget is None else budget
+        operations = self.pending()
+        deadline = time.monotonic() + budget
+        count = 0
+        for operation, flow in operations:
+            if count and time.monotonic() >= deadline:
+                break
+            count += 1
+            yield operation, dict(flow)
+        deferred = operations[count:]
+        for operation in FLOW_OPERATION.ALL:
+            left = sum(1 for _ in deferred if _[0] == operation)
+            _PENDING.set(left, worker=self._worker, device=self._device, operation=operation)
+            if left:
+                _DEFERRED.inc(left, worker=self._worker, device=self._device, operation=operation)
+        if deferred:
+            Log.info(f'time budget of {budget}s spent after {count} flow operations - '
+                     f'{len(deferred)} were left to the next iteration')
+
+    def done(self,
+             operation: str,
+             flow_id: Union[str, Any]):
+        with self._lock:
+            self._operations.pop(f'{operation}/{flow_id}', None)
@@ -1,4 +1,7 @@
-from typing import List, Dict, Any, Optional, Callable
+import datetime
+import threading
+import time
+from typing import List, Dict, Any, Optional, Callable, Union
 
 __STATUS_KEY__ = 'status'
 __ID_KEY__ = 'id'
@@ -6,6 +9,7 @@ __COMMENT_KEY__ = 'comment'
 
 from common.consts import BOOL_VALUES
 from common.logs import Log
+from common.metrics import histogram
 
 
 def default_callback__get_flow_status(flow: Dict[str, Any],
@@ -38,3 +42,156 @@ def get_flows_by_status(flows: List[Dict[str, Any]],
         else:
             flows_by_status[status] = [flow]
     return flows_by_status
+
+
+# keys of the backend's creation time of a flow (epoch seconds or milliseconds, or an ISO 8601 string)
+FLOW_TIMESTAMP_KEYS = ('created_at', 'created', 'timestamp')
+
+
+class FLOW_TIMING:
+    CREATED = 'created'
+    SEEN = 'seen'
+    APPLIED = 'applied'
+    REPORTED = 'reported'
+
+    ALL = (CREATED, SEEN, APPLIED, REPORTED)
+
+
+_FLOW_APPLY_SECONDS = histogram('secunity_flow_apply_seconds',
+                                'Time from the creation of a flow in the backend (created) or its first poll by the '
+                                'agent (seen) until it was polled, acknowledged by the router (applied) or its status '
+                                'was reported',
+                                labelnames=('worker', 'since', 'until'),
+                                buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+
+
+def parse_flow_timestamp(value: Union[int, float, str, None]) -> Optional[float]:
+    """
+    epoch seconds of a backend timestamp, None when it cannot be parsed
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, dict):
+        # extended json
+        value = value.get('$date')
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                value = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+            except ValueError:
+                return None
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            return value.timestamp()
+    if not isinstance(value, (int, float)) or value <= 0:
+        return None
+    # milliseconds
+    return value / 1000 if value > 1e11 else float(value)
+
+
+def pop_flow_timestamp(flow: Dict[str, Any]) -> Optional[float]:
+    """
+    removes the timestamp keys of a flow (they are not rule attributes), returns the first valid one
+    """
+    result = None
+    for key in FLOW_TIMESTAMP_KEYS:
+        if key in flow:
+            value = parse_flow_timestamp(flow.pop(key))
+            if result is None:
+                result = value
+    return result
+
+
+class FlowTimings:
+
+    def __init__(self, worker: str):
+        """
+        Times every flow to apply from its backend timestamp (when present) and from the first poll that returned
+        it, until the router acknowledged it and its status was reported. A flow keeps its first poll time until
+        it is applied or stops being returned
+        """
+        self._worker = worker
+        self._flows: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def track(self,
+              flows_by_status: Dict[str, List[Dict[str, Any]]],
+              seen: Optional[float] = None) -> int:
+        """
+        called with every poll of the flows, returns the number of newly seen flows to apply
+        """
+        seen = seen or time.time()
+        current, new = set(), 0
+        with self._lock:
+            for status, flows in flows_by_status.items():
+                for flow in flows or ():
+                    created = pop_flow_timestamp(flow)
+                    flow_id = flow.get(__ID_KEY__)
+                    if status != 'apply' or not flow_id:
+                        continue
+                    flow_id = str(flow_id)
+                    current.add(flow_id)
+                    if flow_id not in self._flows:
+                        new += 1
+                        self._flows[flow_id] = {FLOW_TIMING.SEEN: seen}
+                        if created:
+                            self._flows[flow_id][FLOW_TIMING.CREATED] = created
+                            self._observe(FLOW_TIMING.CREATED, FLOW_TIMING.SEEN, seen - created)
+            # withdrawn, or applied by another worker
+            for flow_id in [_ for _ in self._flows if _ not in current]:
+                del self._flows[flow_id]
+        return new
+
+    def _observe(self,
+                 since: str,
+                 until: str,
+                 seconds: float):
+        # the clocks of the backend and of the agent may differ
+        if seconds >= 0:
+            _FLOW_APPLY_SECONDS.observe(seconds, worker=self._worker, since=since, until=until)
+
+    def _mark(self,
+              flow_id: Union[str, Any],
+              timing: str) -> Optional[Dict[str, float]]:
+        now = time.time()
+        with self._lock:
+            timings = self._flows.get(str(flow_id))
+            if timings is None or timing in timings:
+                return None
+            timings[timing] = now
+            timings = dict(timings)
+        for since in (FLOW_TIMING.CREATED, FLOW_TIMING.SEEN):
+            if since in timings:
+                self._observe(since, timing, now - timings[since])
+        return timings
+
+    def applied(self, flow_id: Union[str, Any]) -> Optional[Dict[str, float]]:
+        """
+        the router acknowledged the flow, returns its timings (None when it was not tracked)
+        """
+        return self._mark(flow_id, FLOW_TIMING.APPLIED)
+
+    def reported(self, flow_id: Union[str, Any]) -> Optional[Dict[str, float]]:
+        """
+        the status of the flow was reported, it is not tracked anymore
+        """
+        timings = self._mark(flow_id, FLOW_TIMING.REPORTED)
+        with self._lock:
+            self._flows.pop(str(flow_id), None)
+        return timings
+
+    @staticmethod
+    def to_payload(timings: Optional[Dict[str, float]]) -> Optional[Dict[str, Any]]:
+        """
+        the timings part of a status update - the timestamps (epoch seconds) and the seconds between them
+        """
+        if not timings:
+            return None
+        result = {f'{k}_at': round(v, 3) for k, v in timings.items()}
+        for since in (FLOW_TIMING.CREATED, FLOW_TIMING.SEEN):
+            if since in timings and FLOW_TIMING.APPLIED in timings:
+                result[f'{since}_to_{FLOW_TIMING.APPLIED}_seconds'] = \
+                    round(timings[FLOW_TIMING.APPLIED] - timings[since], 3)
+        return dict(timings=result)
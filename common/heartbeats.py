@@ -0,0 +1,479 @@
+import atexit
+import datetime
+import fcntl
+import mmap
+import os
+import signal
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, Iterable, Iterator, NamedTuple, Tuple
+
+from common.consts import PROGRAM
+from common.logs import Log
+from common.metrics import REGISTRY, gauge
+
+
+class HEARTBEAT_TARGET:
+    API = 'api'
+    ROUTER = 'router'
+
+    ALL = (API, ROUTER)
+
+
+class HEARTBEAT_OUTCOME:
+    SUCCESS = 'success'
+    FAILED = 'failed'
+
+    ALL = (SUCCESS, FAILED)
+
+
+class HEARTBEATS_DEFAULTS_KEYS:
+    PATH = 'path'
+    FALLBACK_PATH = 'fallback_path'
+    SLOTS = 'slots'
+    FLUSH_MS = 'flush_ms'
+
+
+HEARTBEATS_DEFAULTS = {
+    HEARTBEATS_DEFAULTS_KEYS.PATH: '/dev/shm/secunity-heartbeats',
+    HEARTBEATS_DEFAULTS_KEYS.FALLBACK_PATH: '/tmp/secunity-heartbeats',
+    HEARTBEATS_DEFAULTS_KEYS.SLOTS: 512,
+    HEARTBEATS_DEFAULTS_KEYS.FLUSH_MS: 500,
+}
+
+
+# fixed file layout:
+#   header - magic, version, slots count, boot id - padded to 64 bytes
+#   slots  - seq, monotonic_ns, wall_ns, count, key - 128 bytes each
+# every slot is guarded by a sequence counter (seqlock): the writer makes it odd while updating the values and
+# even when done, readers retry until they see the same even value before and after reading.
+_MAGIC = b'SECHBT01'
+_VERSION = 1
+_HEADER = struct.Struct('<8sII16s')
+_HEADER_SIZE = 64
+_SLOT = struct.Struct('<QQQQ96s')
+_SEQ = struct.Struct('<Q')
+_VALUES = struct.Struct('<QQQ')
+_KEY_OFFSET = _SEQ.size + _VALUES.size
+_KEY_SIZE = 96
+_BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+_READ_RETRIES = 100
+
+
+def _boot_id() -> bytes:
+    # monotonic timestamps are only comparable within the same boot
+    try:
+        with open(_BOOT_ID_PATH, 'r') as f:
+            return bytes.fromhex(f.read().strip().replace('-', ''))[:16]
+    except Exception:
+        return b''
+
+
+class Heartbeat(NamedTuple):
+    count: int
+    monotonic_ns: int
+    wall_ns: int
+
+    def age(self,
+            now_monotonic_ns: Optional[int] = None) -> float:
+        if now_monotonic_ns is None:
+            now_monotonic_ns = time.monotonic_ns()
+        return max(now_monotonic_ns - self.monotonic_ns, 0) / 10 ** 9
+
+    def utc_datetime(self) -> datetime.datetime:
+        # based on the monotonic clock so wall clock adjustments do not affect freshness checks
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=self.age())
+
+    def wall_datetime(self) -> datetime.datetime:
+        return datetime.datetime.utcfromtimestamp(self.wall_ns / 10 ** 9)
+
+
+def heartbeat_key(worker: str,
+                  identifier: Optional[str],
+                  target: str,
+                  outcome: str) -> str:
+    return '/'.join((worker, str(identifier) if identifier else '-', target, outcome))
+
+
+def parse_heartbeat_key(key: str) -> Tuple[str, str, str, str]:
+    worker, identifier, target, outcome = key.split('/', 3)
+    return worker, identifier, target, outcome
+
+
+class HeartbeatStore:
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 slots: Optional[int] = None,
+                 create: Optional[bool] = True):
+        """
+        Memory mapped store of heartbeats (monotonic timestamp, wall timestamp and counter) per
+        (worker, identifier, target, outcome). Each key is written by a single process.
+        """
+        if not path:
+            path = HEARTBEATS_DEFAULTS[HEARTBEATS_DEFAULTS_KEYS.PATH]
+            if not os.path.isdir(os.path.dirname(path)):
+                path = HEARTBEATS_DEFAULTS[HEARTBEATS_DEFAULTS_KEYS.FALLBACK_PATH]
+        if not slots:
+            slots = HEARTBEATS_DEFAULTS[HEARTBEATS_DEFAULTS_KEYS.SLOTS]
+        self._path = path
+        self._slots = slots
+        self._size = _HEADER_SIZE + slots * _SLOT.size
+        self._indexes = {}
+        self._write_lock = threading.Lock()
+
+        flags = os.O_RDWR | os.O_CREAT if create else os.O_RDONLY
+        self._fd = os.open(path, flags, 0o666)
+        try:
+            if create:
+                self._initialize_file()
+            else:
+                self._slots = self._read_header()[2]
+                self._size = _HEADER_SIZE + self._slots * _SLOT.size
+            access = mmap.ACCESS_WRITE if create else mmap.ACCESS_READ
+            self._mmap = mmap.mmap(self._fd, self._size, access=access)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _read_header(self) -> Tuple[bytes, int, int, bytes]:
+        data = os.pread(self._fd, _HEADER.size, 0)
+        if len(data) < _HEADER.size:
+            return b'', 0, 0, b''
+        return _HEADER.unpack(data)
+
+    def _initialize_file(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            boot_id = _boot_id()
+            magic, version, slots, file_boot_id = self._read_header()
+            if magic == _MAGIC and version == _VERSION and slots == self._slots and \
+                    file_boot_id.rstrip(b'\0') == boot_id:
+                return
+            # new file, a different layout or timestamps of a previous boot - start over.
+            # the file is never shrunk, other processes may still have it mapped
+            if os.fstat(self._fd).st_size < self._size:
+                os.ftruncate(self._fd, self._size)
+            os.pwrite(self._fd, bytes(self._size - _HEADER_SIZE), _HEADER_SIZE)
+            header = _HEADER.pack(_MAGIC, _VERSION, self._slots, boot_id)
+            os.pwrite(self._fd, header.ljust(_HEADER_SIZE, b'\0'), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _slot_offset(self, index: int) -> int:
+        return _HEADER_SIZE + index * _SLOT.size
+
+    def _slot_key(self, index: int) -> bytes:
+        offset = self._slot_offset(index) + _KEY_OFFSET
+        return self._mmap[offset:offset + _KEY_SIZE].rstrip(b'\0')
+
+    def _find(self,
+              key: str,
+              claim: Optional[bool] = False) -> Optional[int]:
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+        encoded = key.encode('utf-8')
+        if len(encoded) > _KEY_SIZE:
+            Log.error_raise(f'heartbeat key is too long: "{key}"')
+        start = zlib.crc32(encoded) % self._slots
+        for i in range(self._slots):
+            index = (start + i) % self._slots
+            slot_key = self._slot_key(index)
+            if slot_key == encoded:
+                self._indexes[key] = index
+                return index
+            if not slot_key:
+                if not claim:
+                    return None
+                index = self._claim(encoded, index)
+                if index is not None:
+                    self._indexes[key] = index
+                return index
+        if claim:
+            Log.error_raise(f'heartbeat store "{self._path}" is full')
+        return None
+
+    def _claim(self,
+               encoded: bytes,
+               index: int) -> Optional[int]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # another process may have claimed slots in the meantime
+            for i in range(self._slots):
+                cur = (index + i) % self._slots
+                slot_key = self._slot_key(cur)
+                if slot_key == encoded:
+                    return cur
+                if not slot_key:
+                    offset = self._slot_offset(cur) + _KEY_OFFSET
+                    self._mmap[offset:offset + _KEY_SIZE] = encoded.ljust(_KEY_SIZE, b'\0')
+                    return cur
+            return None
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read_slot(self, index: int) -> Optional[Heartbeat]:
+        offset = self._slot_offset(index)
+        for _ in range(_READ_RETRIES):
+            seq = _SEQ.unpack_from(self._mmap, offset)[0]
+            if seq & 1:
+                continue
+            monotonic_ns, wall_ns, count = _VALUES.unpack_from(self._mmap, offset + _SEQ.size)
+            if _SEQ.unpack_from(self._mmap, offset)[0] == seq:
+                return Heartbeat(count=count, monotonic_ns=monotonic_ns, wall_ns=wall_ns) if count else None
+        return None
+
+    def beat(self,
+             worker: str,
+             identifier: Optional[str],
+             target: str,
+             outcome: str,
+             count: Optional[int] = 1,
+             monotonic_ns: Optional[int] = None,
+             wall_ns: Optional[int] = None):
+        if monotonic_ns is None:
+            monotonic_ns = time.monotonic_ns()
+        if wall_ns is None:
+            wall_ns = time.time_ns()
+        key = heartbeat_key(worker=worker, identifier=identifier, target=target, outcome=outcome)
+        with self._write_lock:
+            index = self._find(key, claim=True)
+            offset = self._slot_offset(index)
+            seq = _SEQ.unpack_from(self._mmap, offset)[0]
+            total = _VALUES.unpack_from(self._mmap, offset + _SEQ.size)[2] + count
+            _SEQ.pack_into(self._mmap, offset, seq + 1)
+            _VALUES.pack_into(self._mmap, offset + _SEQ.size, monotonic_ns, wall_ns, total)
+            _SEQ.pack_into(self._mmap, offset, seq + 2)
+
+    def get(self,
+            worker: str,
+            identifier: Optional[str],
+            target: str,
+            outcome: str) -> Optional[Heartbeat]:
+        index = self._find(heartbeat_key(worker=worker, identifier=identifier, target=target, outcome=outcome))
+        return self._read_slot(index) if index is not None else None
+
+    def last(self,
+             identifier: Optional[str],
+             target: str,
+             outcome: str,
+             workers: Optional[Iterable[str]] = None) -> Optional[Heartbeat]:
+        if workers is None:
+            workers = PROGRAM.ALL
+        heartbeats = [self.get(worker=worker, identifier=identifier, target=target, outcome=outcome)
+                      for worker in workers]
+        return max((_ for _ in heartbeats if _), key=lambda _: _.monotonic_ns, default=None)
+
+    def items(self) -> Iterator[Tuple[str, Heartbeat]]:
+        for index in range(self._slots):
+            key = self._slot_key(index)
+            if not key:
+                continue
+            heartbeat = self._read_slot(index)
+            if heartbeat:
+                yield key.decode('utf-8', errors='replace'), heartbeat
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            os.close(self._fd)
+
+
+class BufferedHeartbeatStore:
+
+    def __init__(self,
+                 store: HeartbeatStore,
+                 flush_ms: Optional[int] = None):
+        """
+        Write-behind wrapper of a HeartbeatStore. Heartbeats are coalesced in memory per key and written to the
+        store at most every flush_ms milliseconds, and on process exit.
+        """
+        if flush_ms is None:
+            flush_ms = HEARTBEATS_DEFAULTS[HEARTBEATS_DEFAULTS_KEYS.FLUSH_MS]
+        self._store = store
+        self._flush_ns = max(int(flush_ms), 0) * 10 ** 6
+        self._pending = {}
+        self._lock = threading.Lock()
+        # held for a whole flush - the taken heartbeats are written in order, and get() never misses them
+        self._flush_lock = threading.Lock()
+        self._last_flush_ns = 0
+        self._flush_event = threading.Event()
+        self._flusher = None
+
+    @property
+    def path(self) -> str:
+        return self._store.path
+
+    @property
+    def flush_interval(self) -> datetime.timedelta:
+        return datetime.timedelta(microseconds=self._flush_ns / 1000)
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, name='heartbeats-flusher', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        interval = self._flush_ns / 10 ** 9
+        while True:
+            self._flush_event.wait()
+            time.sleep(interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception as ex:
+                Log.exception(f'failed to flush heartbeats - error: "{str(ex)}"')
+
+    def beat(self,
+             worker: str,
+             identifier: Optional[str],
+             target: str,
+             outcome: str,
+             count: Optional[int] = 1,
+             **kwargs):
+        monotonic_ns, wall_ns = time.monotonic_ns(), time.time_ns()
+        if not self._flush_ns:
+            return self._store.beat(worker=worker, identifier=identifier, target=target, outcome=outcome,
+                                    count=count, monotonic_ns=monotonic_ns, wall_ns=wall_ns)
+        key = (worker, identifier, target, outcome)
+        with self._lock:
+            pending = self._pending.get(key)
+            self._pending[key] = Heartbeat(count=count + (pending.count if pending else 0),
+                                           monotonic_ns=monotonic_ns,
+                                           wall_ns=wall_ns)
+            flush_now = monotonic_ns - self._last_flush_ns >= self._flush_ns
+        if flush_now:
+            # idle for longer than the flush interval - no reason to delay the first heartbeat
+            self.flush()
+        else:
+            self._start_flusher()
+            self._flush_event.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush_ns = time.monotonic_ns()
+            for (worker, identifier, target, outcome), heartbeat in pending.items():
+                self._store.beat(worker=worker, identifier=identifier, target=target, outcome=outcome,
+                                 count=heartbeat.count, monotonic_ns=heartbeat.monotonic_ns, wall_ns=heartbeat.wall_ns)
+
+    def get(self,
+            worker: str,
+            identifier: Optional[str],
+            target: str,
+            outcome: str) -> Optional[Heartbeat]:
+        with self._flush_lock:
+            heartbeat = self._store.get(worker=worker, identifier=identifier, target=target, outcome=outcome)
+            with self._lock:
+                pending = self._pending.get((worker, identifier, target, outcome))
+        if not pending:
+            return heartbeat
+        return Heartbeat(count=pending.count + (heartbeat.count if heartbeat else 0),
+                         monotonic_ns=pending.monotonic_ns,
+                         wall_ns=pending.wall_ns)
+
+    def last(self,
+             identifier: Optional[str],
+             target: str,
+             outcome: str,
+             workers: Optional[Iterable[str]] = None) -> Optional[Heartbeat]:
+        if workers is None:
+            workers = PROGRAM.ALL
+        heartbeats = [self.get(worker=worker, identifier=identifier, target=target, outcome=outcome)
+                      for worker in workers]
+        return max((_ for _ in heartbeats if _), key=lambda _: _.monotonic_ns, default=None)
+
+    def items(self) -> Iterator[Tuple[str, Heartbeat]]:
+        self.flush()
+        return self._store.items()
+
+    def close(self):
+        self.flush()
+        self._store.close()
+
+
+_store: Optional[BufferedHeartbeatStore] = None
+_store_lock = threading.Lock()
+
+
+def _flush_on_exit():
+    if _store is not None:
+        try:
+            _store.flush()
+        except Exception:
+            pass
+
+
+_previous_sigterm_handler = None
+
+
+def _exit_on_sigterm(signum, frame):
+    """
+    flushing from the handler could deadlock on the lock of an interrupted beat() - the exit runs the atexit hooks
+    (the heartbeats flush and the drain of the log queue) once the stack is unwound
+    """
+    if callable(_previous_sigterm_handler):
+        _previous_sigterm_handler(signum, frame)
+    raise SystemExit(128 + signum)
+
+
+def _register_exit_flush():
+    global _previous_sigterm_handler
+    atexit.register(_flush_on_exit)
+    try:
+        # the default SIGTERM handling (supervisor stop) skips atexit
+        previous = signal.getsignal(signal.SIGTERM)
+        if previous not in (signal.SIG_IGN, _exit_on_sigterm):
+            _previous_sigterm_handler = previous
+            signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    except ValueError:
+        # not the main thread
+        pass
+
+
+def init_heartbeat_store(path: Optional[str] = None,
+                         flush_ms: Optional[int] = None,
+                         **kwargs) -> BufferedHeartbeatStore:
+    global _store
+    with _store_lock:
+        if _store is None or (path and _store.path != path):
+            if _store is None:
+                _register_exit_flush()
+            else:
+                _store.close()
+            _store = BufferedHeartbeatStore(store=HeartbeatStore(path=path, **kwargs), flush_ms=flush_ms)
+    return _store
+
+
+def get_heartbeat_store() -> BufferedHeartbeatStore:
+    if _store is None:
+        return init_heartbeat_store()
+    return _store
+
+
+_HEARTBEAT_AGE = gauge('secunity_heartbeat_age_seconds',
+                       'Seconds since the last heartbeat',
+                       labelnames=('worker', 'identifier', 'target', 'outcome'))
+
+
+def _collect_heartbeat_ages():
+    if _store is None:
+        return
+    now = time.monotonic_ns()
+    for key, heartbeat in _store.items():
+        worker, identifier, target, outcome = parse_heartbeat_key(key)
+        _HEARTBEAT_AGE.set(round(heartbeat.age(now), 3),
+                           worker=worker, identifier=identifier, target=target, outcome=outcome)
+
+
+REGISTRY.add_collector(_collect_heartbeat_ages)
@@ -1,9 +1,13 @@
+import atexit
 import os.path
+import queue
 import sys
 import logging
+import logging.handlers
 import traceback
-from typing import Optional, Union, Type, TypeVar
+from typing import Optional, Union, Type, TypeVar, Callable
 
+from common.metrics import counter
 from common.utils import is_bool, parse_bool
 
 
@@ -13,6 +17,10 @@ class LOG_DEFAULTS_KEYS:
     MODULE = 'module'
     VERBOSE = 'verbose'
     FORMATTER = 'formatter'
+    ASYNC = 'async'
+    QUEUE_SIZE = 'queue_size'
+    MAX_BYTES = 'max_bytes'
+    BACKUP_COUNT = 'backup_count'
 
 
 LOG_DEFAULTS = {
@@ -21,6 +29,10 @@ LOG_DEFAULTS = {
     LOG_DEFAULTS_KEYS.MODULE: 'secunity',
     LOG_DEFAULTS_KEYS.VERBOSE: False,
     LOG_DEFAULTS_KEYS.FORMATTER: '%(asctime)s - %(levelname)s - %(funcName)s - %(lineno)s - %(message)s',
+    LOG_DEFAULTS_KEYS.ASYNC: True,
+    LOG_DEFAULTS_KEYS.QUEUE_SIZE: 10000,
+    LOG_DEFAULTS_KEYS.MAX_BYTES: 20 * 1024 * 1024,
+    LOG_DEFAULTS_KEYS.BACKUP_COUNT: 5,
 }
 
 
@@ -47,6 +59,43 @@ class LException(Exception):
 
 TException = TypeVar('TException', bound=Union[LException, ValueError, Exception])
 
+TMessage = Union[str, Callable[[], str]]
+
+
+class LazyMessage:
+
+    __slots__ = ('_func', '_msg')
+
+    def __init__(self, func: Callable[[], str]):
+        """
+        Log message built only when a handler formats the record
+        """
+        self._func = func
+        self._msg = None
+
+    def __str__(self) -> str:
+        if self._msg is None:
+            self._msg = str(self._func())
+        return self._msg
+
+
+def _lazy(msg: TMessage):
+    return LazyMessage(msg) if callable(msg) else msg
+
+
+_LOG_DROPPED = counter('secunity_log_records_dropped_total',
+                       'Log records dropped because the log queue was full')
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # never block the calling thread on log I/O
+            _LOG_DROPPED.inc()
+
 
 class LogMeta(type):
 
@@ -59,11 +108,25 @@ class LogMeta(type):
 class Log(metaclass=LogMeta):
 
     _logger = None
+    _listener: Optional[logging.handlers.QueueListener] = None
 
     @classmethod
     def initialize(cls, **kwargs) -> logging.Logger:
         return cls.logger(**kwargs)
 
+    @classmethod
+    def is_enabled_for(cls,
+                       level: Union[LOG_LEVEL, str, int]) -> bool:
+        if isinstance(level, str):
+            level = logging.ERROR if level.upper() == LOG_LEVEL.EXCEPTION else logging.getLevelName(level.upper())
+        return cls.logger().isEnabledFor(level)
+
+    @classmethod
+    def stop(cls):
+        listener, cls._listener = cls._listener, None
+        if listener:
+            listener.stop()
+
     @classmethod
     def logger(cls,
                enabled: Optional[bool] = None,
@@ -72,6 +135,10 @@ class Log(metaclass=LogMeta):
                verbose: Optional[bool] = None,
                to_stdout: Optional[bool] = True,
                to_stderr: Optional[bool] = False,
+               log_async: Optional[bool] = None,
+               log_queue_size: Optional[int] = None,
+               log_max_bytes: Optional[int] = None,
+               log_backup_count: Optional[int] = None,
                **kwargs) -> logging.Logger:
         if cls._logger:
             return cls._logger
@@ -99,13 +166,40 @@ class Log(metaclass=LogMeta):
         if to_stderr:
             handlers.append(logging.StreamHandler(sys.stderr))
         logfile = os.path.join(folder, f'{module}.log')
-        handlers.append(logging.FileHandler(logfile))
+        if log_max_bytes is None:
+            log_max_bytes = LOG_DEFAULTS[LOG_DEFAULTS_KEYS.MAX_BYTES]
+        if log_backup_count is None:
+            log_backup_count = LOG_DEFAULTS[LOG_DEFAULTS_KEYS.BACKUP_COUNT]
+        if log_max_bytes:
+            # a file per program - only its own process rotates it
+            handlers.append(logging.handlers.RotatingFileHandler(logfile,
+                                                                 maxBytes=log_max_bytes,
+                                                                 backupCount=log_backup_count))
+        else:
+            # rotated by logrotate, the file is reopened when it is moved
+            handlers.append(logging.handlers.WatchedFileHandler(logfile))
 
         for handler in handlers:
             handler.setLevel(log_level)
             formatter = logging.Formatter(LOG_DEFAULTS[LOG_DEFAULTS_KEYS.FORMATTER])
             handler.setFormatter(formatter)
-            logger.addHandler(handler)
+
+        if log_async not in (True, False):
+            log_async = LOG_DEFAULTS[LOG_DEFAULTS_KEYS.ASYNC]
+        if log_async:
+            # records are formatted by the calling thread, stdout and file I/O is done by the listener thread
+            if not log_queue_size:
+                log_queue_size = LOG_DEFAULTS[LOG_DEFAULTS_KEYS.QUEUE_SIZE]
+            log_queue = queue.Queue(maxsize=log_queue_size)
+            queue_handler = NonBlockingQueueHandler(log_queue)
+            queue_handler.setLevel(log_level)
+            logger.addHandler(queue_handler)
+            cls._listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            cls._listener.start()
+            atexit.register(cls.stop)
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
         cls._logger = logger
         return logger
 
@@ -129,10 +223,12 @@ class Log(metaclass=LogMeta):
 
     @classmethod
     def critical(cls,
-                 msg: str,
+                 msg: TMessage,
                  _raise: Optional[Union[bool, str]] = False,
                  *args, **kwargs):
-        cls.logger().critical(msg, *args, **kwargs)
+        logger = cls.logger()
+        if logger.isEnabledFor(logging.CRITICAL):
+            logger.critical(_lazy(msg), *args, **kwargs)
         cls._raise(_raise)
 
     @classmethod
@@ -151,10 +247,12 @@ class Log(metaclass=LogMeta):
 
     @classmethod
     def error(cls,
-              msg: str,
+              msg: TMessage,
               _raise: Optional[Union[bool, str]] = False,
               *args, **kwargs):
-        cls.logger().error(msg, *args, **kwargs)
+        logger = cls.logger()
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error(_lazy(msg), *args, **kwargs)
         cls._raise(_raise)
 
     @classmethod
@@ -173,20 +271,20 @@ class Log(metaclass=LogMeta):
 
     @classmethod
     def exception(cls,
-                  msg: str,
+                  msg: TMessage,
                   _raise: Optional[Union[bool, str, Exception]] = False,
                   ex: Optional[Exception] = None,
                   *args, **kwargs):
         if not ex:
             ex = _raise if isinstance(_raise, Exception) else kwargs.get('exception')
-        if ex:
-            # try:
-            #     exc, tb = sys.exc_info()[1:]
-            #     trace_str = f'{str(exc)}\n{traceback.format_tb(tb)}'
-            # except Exception as AAA:
-            #     trace_str = traceback.format_exec()
-            msg = f'{traceback.format_exc()}\n{msg}'
-        cls.logger().exception(msg, *args, **kwargs)
+        logger = cls.logger()
+        if logger.isEnabledFor(logging.ERROR):
+            msg = _lazy(msg)
+            if ex:
+                # the traceback of the current exception, the message itself is still built by the handler
+                trace, message = traceback.format_exc(), msg
+                msg = LazyMessage(lambda: f'{trace}\n{message}')
+            logger.exception(msg, *args, **kwargs)
         cls._raise(_raise)
 
     @classmethod
@@ -205,10 +303,12 @@ class Log(metaclass=LogMeta):
 
     @classmethod
     def info(cls,
-             msg: str,
+             msg: TMessage,
              _raise: Optional[Union[bool, str]] = False,
              *args, **kwargs):
-        cls.logger().info(msg, *args, **kwargs)
+        logger = cls.logger()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(_lazy(msg), *args, **kwargs)
         cls._raise(_raise)
 
     @classmethod
@@ -227,10 +327,12 @@ class Log(metaclass=LogMeta):
 
     @classmethod
     def warning(cls,
-                msg: str,
+                msg: TMessage,
                 _raise: Optional[Union[bool, str]] = False,
                 *args, **kwargs):
-        cls.logger().warning(msg, *args, **kwargs)
+        logger = cls.logger()
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(_lazy(msg), *args, **kwargs)
         cls._raise(_raise)
 
     @classmethod
@@ -249,10 +351,12 @@ class Log(metaclass=LogMeta):
 
     @classmethod
     def debug(cls,
-              msg: str,
+              msg: TMessage,
               _raise: Optional[Union[bool, str]] = False,
               *args, **kwargs):
-        cls.logger().debug(msg, *args, **kwargs)
+        logger = cls.logger()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(_lazy(msg), *args, **kwargs)
         cls._raise(_raise)
 
     @classmethod
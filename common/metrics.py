@@ -0,0 +1,289 @@
+import bisect
+import threading
+from typing import Optional, Union, Dict, Tuple, List, Iterable, Any, Callable
+
+
+class METRIC_TYPE:
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+    HISTOGRAM = 'histogram'
+
+    ALL = (COUNTER, GAUGE, HISTOGRAM)
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+
+    _type: str = None
+
+    def __init__(self,
+                 name: str,
+                 documentation: Optional[str] = None,
+                 labelnames: Optional[Iterable[str]] = None):
+        self._name = name
+        self._documentation = documentation or name
+        self._labelnames = tuple(labelnames) if labelnames else tuple()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def type(self) -> str:
+        return self._type
+
+    @property
+    def documentation(self) -> str:
+        return self._documentation
+
+    @property
+    def labelnames(self) -> Tuple[str, ...]:
+        return self._labelnames
+
+    def _labels(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(_, '')) for _ in self._labelnames)
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(Metric):
+
+    _type = METRIC_TYPE.COUNTER
+
+    def inc(self,
+            amount: Union[int, float] = 1,
+            **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> Union[int, float]:
+        return self._values.get(self._labels(labels), 0)
+
+
+class Gauge(Metric):
+
+    _type = METRIC_TYPE.GAUGE
+
+    def set(self,
+            value: Union[int, float],
+            **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self,
+            amount: Union[int, float] = 1,
+            **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self,
+            amount: Union[int, float] = 1,
+            **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> Union[int, float]:
+        return self._values.get(self._labels(labels), 0)
+
+
+class HistogramValue:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        result, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class Histogram(Metric):
+
+    _type = METRIC_TYPE.HISTOGRAM
+
+    def __init__(self,
+                 name: str,
+                 documentation: Optional[str] = None,
+                 labelnames: Optional[Iterable[str]] = None,
+                 buckets: Optional[Iterable[float]] = None):
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self._buckets = tuple(sorted(buckets)) if buckets else DEFAULT_BUCKETS
+
+    def observe(self,
+                value: Union[int, float],
+                **labels):
+        key = self._labels(labels)
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = HistogramValue(self._buckets)
+            histogram.observe(value)
+
+    def value(self, **labels) -> Optional[HistogramValue]:
+        return self._values.get(self._labels(labels))
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self,
+                       cls,
+                       name: str,
+                       **kwargs) -> Metric:
+        metric = self._metrics.get(name)
+        if metric is not None:
+            return metric
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name=name, **kwargs)
+        return metric
+
+    def counter(self,
+                name: str,
+                documentation: Optional[str] = None,
+                labelnames: Optional[Iterable[str]] = None) -> Counter:
+        return self._get_or_create(Counter, name, documentation=documentation, labelnames=labelnames)
+
+    def gauge(self,
+              name: str,
+              documentation: Optional[str] = None,
+              labelnames: Optional[Iterable[str]] = None) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation=documentation, labelnames=labelnames)
+
+    def histogram(self,
+                  name: str,
+                  documentation: Optional[str] = None,
+                  labelnames: Optional[Iterable[str]] = None,
+                  buckets: Optional[Iterable[float]] = None) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation=documentation, labelnames=labelnames,
+                                   buckets=buckets)
+
+    def metrics(self) -> List[Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def add_collector(self,
+                      collector: Callable[[], None]):
+        """
+        collector is called before the metrics are exposed - for values that are read on demand (e.g. ages)
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                # a broken collector must not break the exposition of the other metrics
+                pass
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str,
+            documentation: Optional[str] = None,
+            labelnames: Optional[Iterable[str]] = None) -> Counter:
+    return REGISTRY.counter(name=name, documentation=documentation, labelnames=labelnames)
+
+
+def gauge(name: str,
+          documentation: Optional[str] = None,
+          labelnames: Optional[Iterable[str]] = None) -> Gauge:
+    return REGISTRY.gauge(name=name, documentation=documentation, labelnames=labelnames)
+
+
+def histogram(name: str,
+              documentation: Optional[str] = None,
+              labelnames: Optional[Iterable[str]] = None,
+              buckets: Optional[Iterable[float]] = None) -> Histogram:
+    return REGISTRY.histogram(name=name, documentation=documentation, labelnames=labelnames, buckets=buckets)
+
+
+CONTENT_TYPE_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str,
+            quotes: Optional[bool] = True) -> str:
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_value(value: Union[int, float]) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Tuple[str, ...],
+                   values: Tuple[str, ...],
+                   extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render_text(registry: Optional[Registry] = None) -> str:
+    """
+    the metrics in the prometheus text exposition format
+    """
+    if registry is None:
+        registry = REGISTRY
+    registry.collect()
+    lines = []
+    for metric in sorted(registry.metrics(), key=lambda _: _.name):
+        samples = metric.samples()
+        lines.append(f'# HELP {metric.name} {_escape(metric.documentation, quotes=False)}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for values, value in sorted(samples, key=lambda _: _[0]):
+            if metric.type == METRIC_TYPE.HISTOGRAM:
+                for bound, total in value.cumulative():
+                    labels = _format_labels(metric.labelnames, values, extra=('le', _format_value(float(bound))))
+                    lines.append(f'{metric.name}_bucket{labels} {total}')
+                labels = _format_labels(metric.labelnames, values)
+                lines.append(f'{metric.name}_sum{labels} {_format_value(value.sum)}')
+                lines.append(f'{metric.name}_count{labels} {value.count}')
+            else:
+                lines.append(f'{metric.name}{_format_labels(metric.labelnames, values)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,102 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from common.consts import PROGRAM
+from common.logs import Log
+from common.metrics import CONTENT_TYPE_TEXT, render_text
+
+
+class METRICS_SERVER_DEFAULTS_KEYS:
+    HOST = 'metrics_host'
+    PORT = 'metrics_port'
+
+
+METRICS_SERVER_DEFAULTS = {
+    # loopback only - the endpoint has no authentication
+    METRICS_SERVER_DEFAULTS_KEYS.HOST: '127.0.0.1',
+    # disabled unless a port is configured
+    METRICS_SERVER_DEFAULTS_KEYS.PORT: None,
+}
+
+
+TEndpointHandler = Callable[[Dict[str, List[str]]], Tuple[str, bytes]]
+
+# path -> handler of the query parameters, returning the content type and the body
+_endpoints: Dict[str, TEndpointHandler] = {
+    '/metrics': lambda query: (CONTENT_TYPE_TEXT, render_text().encode('utf-8')),
+}
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def register_endpoint(path: str,
+                      handler: TEndpointHandler):
+    _endpoints[path] = handler
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        handler = _endpoints.get(path)
+        if handler is None:
+            self.send_error(404)
+            return
+        try:
+            content_type, body = handler(parse_qs(query))
+        except Exception as ex:
+            Log.exception(f'failed to handle "{self.path}" - error: "{str(ex)}"')
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        Log.debug(f'metrics server: {format % args}')
+
+
+def program_metrics_port(port: Optional[int],
+                         program: Optional[str] = None) -> Optional[int]:
+    """
+    the programs of an agent share its config, every one of them serves on its own port - metrics_port plus the
+    index of the program
+    """
+    if not port or program not in PROGRAM.ALL:
+        return port
+    return port + PROGRAM.ALL.index(program)
+
+
+def start_metrics_server(port: Optional[int] = None,
+                         host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    global _server
+    if not port:
+        return None
+    if not host:
+        host = METRICS_SERVER_DEFAULTS[METRICS_SERVER_DEFAULTS_KEYS.HOST]
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _RequestHandler)
+        except OSError as ex:
+            Log.error(f'failed to start the metrics server on {host}:{port} - error: "{str(ex)}"')
+            return None
+        _server.daemon_threads = True
+        thread = threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True)
+        thread.start()
+        Log.info(f'metrics are served on http://{host}:{port}/metrics')
+        return _server
+
+
+def stop_metrics_server():
+    global _server
+    with _server_lock:
+        server, _server = _server, None
+    if server is not None:
+        server.shutdown()
+        server.server_close()
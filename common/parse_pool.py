@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.logs import Log
+from common.metrics import histogram
+
+
+class PARSE_POOL_DEFAULTS_KEYS:
+    PROCESSES = 'parse_processes'
+    MIN_BYTES = 'parse_min_bytes'
+
+
+PARSE_POOL_DEFAULTS = {
+    # 0 - the output is parsed by the polling thread
+    PARSE_POOL_DEFAULTS_KEYS.PROCESSES: 0,
+    # smaller outputs are parsed in-process, the IPC costs more than the parse
+    PARSE_POOL_DEFAULTS_KEYS.MIN_BYTES: 64 * 1024,
+}
+
+
+_PARSE_CPU_SECONDS = histogram('secunity_parse_cpu_seconds',
+                               'CPU time spent parsing the router output',
+                               labelnames=('vendor', 'device', 'offloaded'))
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_min_bytes: int = PARSE_POOL_DEFAULTS[PARSE_POOL_DEFAULTS_KEYS.MIN_BYTES]
+_pool_lock = threading.Lock()
+
+
+def init_parse_pool(processes: Optional[int] = None,
+                    min_bytes: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    global _pool, _min_bytes
+    if not processes or processes <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+
+            # spawn - the parse processes must not inherit the polling threads and their locks
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+            Log.info(f'parsing router output in {processes} processes')
+        if min_bytes is not None:
+            _min_bytes = min_bytes
+        return _pool
+
+
+def shutdown_parse_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def _encode_lines(lines: List[str]) -> bytes:
+    # a single buffer pickles much faster than a list of many small strings
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _decode_lines(raw: bytes) -> List[str]:
+    return raw.decode('utf-8').split('\n') if raw else []
+
+
+def parse_in_process(vendor: str,
+                     raw: bytes,
+                     filter_kwargs: Dict[str, Any]) -> Tuple[bytes, float]:
+    """
+    runs in a pool process - returns the parsed lines (encoded) and the CPU time of the parse
+    """
+    from command_workers import get_command_worker_class
+
+    start = time.process_time()
+    result = get_command_worker_class(vendor)()._filter_result(_decode_lines(raw), **filter_kwargs)
+    return _encode_lines(result), time.process_time() - start
+
+
+def _should_offload(lines: List[str]) -> bool:
+    if _pool is None:
+        return False
+    size = 0
+    for line in lines:
+        size += len(line) + 1
+        if size >= _min_bytes:
+            return True
+    return False
+
+
+def parse_output(command_worker: Any,
+                 lines: List[str],
+                 device: Optional[str] = None,
+                 **filter_kwargs) -> List[str]:
+    """
+    runs command_worker._filter_result, in the parse pool when it is enabled and the output is large
+    """
+    vendor = command_worker.vendor
+    if _should_offload(lines):
+        raw, cpu_seconds = _pool.submit(parse_in_process, vendor, _encode_lines(lines), filter_kwargs).result()
+        result, offloaded = _decode_lines(raw), True
+    else:
+        start = time.thread_time()
+        result = command_worker._filter_result(lines, **filter_kwargs)
+        cpu_seconds, offloaded = time.thread_time() - start, False
+    _PARSE_CPU_SECONDS.observe(cpu_seconds, vendor=vendor, device=device or '', offloaded=str(offloaded).lower())
+    Log.debug(f'parsed {len(lines)} lines of "{device}" in {cpu_seconds * 1000:.1f} CPU ms'
+              f'{" (offloaded)" if offloaded else ""}')
+    return result
+
+
+async def parse_output_async(command_worker: Any,
+                             lines: List[str],
+                             device: Optional[str] = None,
+                             **filter_kwargs) -> List[str]:
+    if not _should_offload(lines):
+        return parse_output(command_worker, lines, device=device, **filter_kwargs)
+    import asyncio
+
+    vendor = command_worker.vendor
+    future = _pool.submit(parse_in_process, vendor, _encode_lines(lines), filter_kwargs)
+    raw, cpu_seconds = await asyncio.wrap_future(future)
+    _PARSE_CPU_SECONDS.observe(cpu_seconds, vendor=vendor, device=device or '', offloaded='true')
+    Log.debug(f'parsed {len(lines)} lines of "{device}" in {cpu_seconds * 1000:.1f} CPU ms (offloaded)')
+    return _decode_lines(raw)
@@ -0,0 +1,233 @@
+import contextlib
+import datetime
+import os
+import re
+import signal
+import threading
+import time
+from typing import Optional
+
+from common.logs import Log
+
+
+class PROFILE_MODE:
+    CPU = 'cpu'
+    MEMORY = 'memory'
+    BOTH = 'both'
+
+    DEFAULT = CPU
+
+    ALL = (CPU, MEMORY, BOTH)
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> str:
+        if not value:
+            return cls.DEFAULT
+        value = str(value).strip().lower()
+        if value not in cls.ALL:
+            raise ValueError(f'invalid profile mode: "{value}"')
+        return value
+
+
+class PROFILING_DEFAULTS_KEYS:
+    FOLDER = 'profiles_folder'
+    ITERATIONS = 'profile_iterations'
+    MODE = 'profile_mode'
+    TRIGGER_FILE = 'profile_trigger_file'
+    MAX_OVERHEAD = 'profile_max_overhead'
+    TOP_ALLOCATIONS = 'profile_top_allocations'
+
+
+PROFILING_DEFAULTS = {
+    PROFILING_DEFAULTS_KEYS.FOLDER: '/var/log/secunity/profiles',
+    # iterations profiled per trigger
+    PROFILING_DEFAULTS_KEYS.ITERATIONS: 1,
+    PROFILING_DEFAULTS_KEYS.MODE: PROFILE_MODE.DEFAULT,
+    # "touch" it to trigger, it may contain "<iterations> <mode>" - "trigger-<program>" in the profiles folder by
+    # default, every program checks its own file
+    PROFILING_DEFAULTS_KEYS.TRIGGER_FILE: None,
+    # profiled iterations take at most this share of the wall time, later iterations wait for their turn
+    PROFILING_DEFAULTS_KEYS.MAX_OVERHEAD: 0.05,
+    PROFILING_DEFAULTS_KEYS.TOP_ALLOCATIONS: 30,
+}
+
+
+# seconds between checks of the trigger file
+_TRIGGER_CHECK_INTERVAL = 1
+
+
+class Profiler:
+
+    def __init__(self,
+                 folder: Optional[str] = None,
+                 iterations: Optional[int] = None,
+                 mode: Optional[str] = None,
+                 trigger_file: Optional[str] = None,
+                 max_overhead: Optional[float] = None,
+                 top_allocations: Optional[int] = None,
+                 program: Optional[str] = None,
+                 **kwargs):
+        """
+        Profiles the next iterations (cProfile and/or tracemalloc) once it is triggered by SIGUSR1 or by the
+        trigger file - a single iteration is profiled at a time, the others run as usual
+        """
+        self._folder = folder or PROFILING_DEFAULTS[PROFILING_DEFAULTS_KEYS.FOLDER]
+        self._iterations = iterations or PROFILING_DEFAULTS[PROFILING_DEFAULTS_KEYS.ITERATIONS]
+        self._mode = PROFILE_MODE.parse(mode)
+        self._trigger_file = trigger_file or PROFILING_DEFAULTS[PROFILING_DEFAULTS_KEYS.TRIGGER_FILE] or \
+            os.path.join(self._folder, f'trigger-{program}' if program else 'trigger')
+        self._max_overhead = max_overhead or PROFILING_DEFAULTS[PROFILING_DEFAULTS_KEYS.MAX_OVERHEAD]
+        self._top_allocations = top_allocations or PROFILING_DEFAULTS[PROFILING_DEFAULTS_KEYS.TOP_ALLOCATIONS]
+        self._remaining = 0
+        self._signaled = False
+        self._armed_mode = self._mode
+        self._next_allowed = 0.0
+        self._next_trigger_check = 0.0
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def request(self,
+                iterations: Optional[int] = None,
+                mode: Optional[str] = None):
+        """
+        profiles the next iterations
+        """
+        with self._lock:
+            self._remaining = iterations or self._iterations
+            self._armed_mode = PROFILE_MODE.parse(mode) if mode else self._mode
+        Log.warning(f'profiling the next {self._remaining} iterations ({self._armed_mode})')
+
+    def on_signal(self, signum=None, frame=None):
+        # only sets a flag - the interrupted thread may hold the lock
+        self._signaled = True
+
+    def _check_trigger_file(self):
+        now = time.monotonic()
+        if now < self._next_trigger_check:
+            return
+        self._next_trigger_check = now + _TRIGGER_CHECK_INTERVAL
+        if not os.path.exists(self._trigger_file):
+            return
+        try:
+            with open(self._trigger_file) as f:
+                content = f.read().split()
+            os.remove(self._trigger_file)
+        except FileNotFoundError:
+            # consumed by another thread
+            return
+        except OSError as ex:
+            Log.warning(f'failed to read the profile trigger file - error: "{str(ex)}"')
+            return
+        try:
+            iterations = int(content[0]) if content else None
+            mode = content[1] if len(content) > 1 else None
+            self.request(iterations=iterations, mode=mode)
+        except ValueError as ex:
+            Log.error(f'invalid profile trigger "{" ".join(content)}" - error: "{str(ex)}"')
+
+    def _acquire(self) -> Optional[str]:
+        """
+        returns the mode of the iteration to profile, None when it is not profiled
+        """
+        if self._signaled:
+            self._signaled = False
+            self.request()
+        self._check_trigger_file()
+        if not self._remaining or time.monotonic() < self._next_allowed:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        with self._lock:
+            if not self._remaining:
+                self._active.release()
+                return None
+            self._remaining -= 1
+            return self._armed_mode
+
+    def _release(self, elapsed: float):
+        # the profiled iteration is slower than usual - the next one waits for the overhead ceiling
+        self._next_allowed = time.monotonic() + elapsed * (1 / self._max_overhead - 1)
+        self._active.release()
+
+    @contextlib.contextmanager
+    def profile(self, name: str):
+        mode = self._acquire()
+        if not mode:
+            yield
+            return
+        import cProfile
+        import tracemalloc
+
+        cpu = mode in (PROFILE_MODE.CPU, PROFILE_MODE.BOTH)
+        memory = mode in (PROFILE_MODE.MEMORY, PROFILE_MODE.BOTH)
+        profiler = cProfile.Profile() if cpu else None
+        snapshot = None
+        started_tracemalloc = False
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracemalloc = True
+            snapshot = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            try:
+                self._write(name, profiler, snapshot, elapsed)
+            finally:
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                self._release(elapsed)
+
+    def _write(self, name: str, profiler, snapshot, elapsed: float):
+        import tracemalloc
+
+        name = re.sub(r'[^\w.-]+', '_', name)
+        prefix = os.path.join(self._folder, f'{name}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S.%f}')
+        try:
+            os.makedirs(self._folder, exist_ok=True)
+            if profiler:
+                profiler.dump_stats(f'{prefix}.pstats')
+            if snapshot:
+                stats = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+                with open(f'{prefix}.allocations.txt', 'w') as f:
+                    current, peak = tracemalloc.get_traced_memory()
+                    f.write(f'top {self._top_allocations} allocations retained by "{name}" ({elapsed:.3f} seconds), '
+                            f'traced memory: {current} bytes, peak: {peak} bytes\n')
+                    for stat in stats[:self._top_allocations]:
+                        f.write(f'{stat}\n')
+            Log.warning(f'profile of "{name}" ({elapsed:.3f} seconds) was written to "{prefix}.*"')
+        except Exception as ex:
+            Log.exception(f'failed to write the profile of "{name}" - error: "{str(ex)}"')
+
+
+_profiler: Optional[Profiler] = None
+
+
+def init_profiling(**kwargs) -> Profiler:
+    """
+    installs the SIGUSR1 trigger when called from the main thread
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(**kwargs)
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, _profiler.on_signal)
+    return _profiler
+
+
+@contextlib.contextmanager
+def profile_iteration(name: str):
+    """
+    a no-op until profiling is initialized and triggered
+    """
+    if _profiler is None:
+        yield
+        return
+    with _profiler.profile(name):
+        yield
@@ -0,0 +1,210 @@
+import datetime
+import ipaddress
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from common.logs import Log
+
+
+class RECORDING_DEFAULTS_KEYS:
+    FOLDER = 'record_folder'
+    MAX_TRANSCRIPTS = 'record_max_transcripts'
+
+
+RECORDING_DEFAULTS = {
+    # None - recording is disabled
+    RECORDING_DEFAULTS_KEYS.FOLDER: None,
+    # transcripts recorded per vendor and command
+    RECORDING_DEFAULTS_KEYS.MAX_TRANSCRIPTS: 20,
+}
+
+
+# the parameters the parsers get along with the output (see SshCommandWorker._parse_result)
+TRANSCRIPT_PARAMS = ('interface_name', 'stats_type', 'model')
+
+_IPV4 = re.compile(r'(?<![\w.])(\d{1,3}(?:\.\d{1,3}){3})(?!\.?\d)')
+# with the dotted quad tail of mapped and embedded IPv4 addresses (::ffff:10.2.3.4)
+_IPV6 = re.compile(r'(?<![\w:.])([0-9a-fA-F]{0,4}(?::[0-9a-fA-F]{0,4}){2,7}(?::\d{1,3}(?:\.\d{1,3}){3})?)'
+                   r'(?![\w:]|\.\d)')
+_HUAWEI_PROMPT = re.compile(r'^(\s*)<[^>]+>')
+
+
+def _is_address(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+
+class Sanitizer:
+
+    def __init__(self,
+                 secrets: Optional[List[str]] = None,
+                 comment_prefix: Optional[str] = None):
+        """
+        Replaces the addresses with documentation ones (the same address is replaced by the same one in a
+        transcript, the prefix lengths are kept), the secrets with "secret" and the prompts with "<router>"
+        """
+        # addresses are replaced as any other address
+        secrets = sorted({str(_) for _ in secrets or () if _ and len(str(_)) > 2 and not _is_address(str(_))},
+                         key=len, reverse=True)
+        self._secrets = re.compile(r'(?<!\w)(%s)(?!\w)' % '|'.join(map(re.escape, secrets))) if secrets else None
+        self._comment_prefix = comment_prefix
+        self._addresses: Dict[str, str] = {}
+
+    def _replace_ipv4(self, match) -> str:
+        address = match.group(1)
+        if address == '0.0.0.0' or address.startswith('255.'):
+            # masks and wildcards
+            return address
+        try:
+            ipaddress.IPv4Address(address)
+        except ValueError:
+            return address
+        if address not in self._addresses:
+            index = len(self._addresses) + 1
+            # 198.18.0.0/15 - reserved for benchmarks
+            self._addresses[address] = f'198.{18 + ((index >> 16) & 1)}.{(index >> 8) & 0xff}.{index & 0xff}'
+        return self._addresses[address]
+
+    def _replace_ipv6(self, match) -> str:
+        address = match.group(1)
+        try:
+            if ipaddress.IPv6Address(address) == ipaddress.IPv6Address('::'):
+                return address
+        except ValueError:
+            # times, MAC addresses
+            return address
+        if address not in self._addresses:
+            self._addresses[address] = f'2001:db8::{len(self._addresses) + 1:x}'
+        return self._addresses[address]
+
+    def line(self, value: str) -> str:
+        if self._secrets:
+            value = self._secrets.sub('secret', value)
+        value = _HUAWEI_PROMPT.sub(r'\1<router>', value)
+        # IPv6 first - the IPv4 tail of an IPv6 address is a part of it
+        if '::' in value or value.count(':') > 2:
+            value = _IPV6.sub(self._replace_ipv6, value)
+        if '.' in value:
+            value = _IPV4.sub(self._replace_ipv4, value)
+        return value
+
+    def row(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        result = {}
+        for k, v in value.items():
+            if k == 'comment' and self._comment_prefix is not None and isinstance(v, str) and \
+                    not v.startswith(self._comment_prefix):
+                # comments of rules that are not secunity's are free text
+                v = 'comment'
+            result[k] = self.line(v) if isinstance(v, str) else v
+        return result
+
+
+class Recorder:
+
+    def __init__(self,
+                 folder: str,
+                 max_transcripts: Optional[int] = None,
+                 **kwargs):
+        """
+        Writes sanitized raw router outputs (a json file per command execution) to
+        "<folder>/<vendor>/<command>-<time>.json" - the fixture corpus of bin/bench_parsers.py
+        """
+        self._folder = folder
+        self._max_transcripts = max_transcripts or RECORDING_DEFAULTS[RECORDING_DEFAULTS_KEYS.MAX_TRANSCRIPTS]
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, vendor: str, command: str) -> bool:
+        with self._lock:
+            count = self._counts.get((vendor, command), 0)
+            if count >= self._max_transcripts:
+                return False
+            self._counts[(vendor, command)] = count + 1
+        if count + 1 == self._max_transcripts:
+            Log.info(f'recorded {count + 1} transcripts of "{vendor}" command "{command}", stopped recording it')
+        return True
+
+    def record(self,
+               vendor: str,
+               command: str,
+               output: Union[List[str], List[Dict[str, Any]]],
+               credentials: Optional[Dict[str, Any]] = None,
+               params: Optional[Dict[str, Any]] = None,
+               comment_prefix: Optional[str] = None,
+               **kwargs) -> Optional[str]:
+        vendor, command = str(vendor), str(command).strip()
+        if not isinstance(output, list) or not self._reserve(vendor, command):
+            return None
+        try:
+            credentials, params = credentials or {}, params or {}
+            sanitizer = Sanitizer(secrets=[credentials.get(_) for _ in ('host', 'ip', 'user', 'username',
+                                                                       'password', 'pass')],
+                                  comment_prefix=comment_prefix)
+            transcript = dict(vendor=vendor,
+                              command=sanitizer.line(command),
+                              recorded_at=datetime.datetime.utcnow().isoformat(),
+                              params={k: params[k] for k in TRANSCRIPT_PARAMS if params.get(k) is not None},
+                              output=[sanitizer.row(_) if isinstance(_, dict) else sanitizer.line(str(_))
+                                      for _ in output])
+            folder = os.path.join(self._folder, re.sub(r'[^\w.-]+', '_', vendor))
+            os.makedirs(folder, exist_ok=True)
+            name = re.sub(r'[^\w.-]+', '_', transcript['command']).strip('_')[:80]
+            filename = os.path.join(folder, f'{name}-{datetime.datetime.utcnow():%Y%m%dT%H%M%S.%f}.json')
+            with open(f'{filename}.tmp', 'w') as f:
+                json.dump(transcript, f, indent=1)
+            os.replace(f'{filename}.tmp', filename)
+            return filename
+        except Exception as ex:
+            Log.exception(f'failed to record the output of "{vendor}" command "{command}" - error: "{str(ex)}"')
+            return None
+
+
+_recorder: Optional[Recorder] = None
+
+
+def init_recording(folder: Optional[str] = None,
+                   max_transcripts: Optional[int] = None,
+                   **kwargs) -> Optional[Recorder]:
+    global _recorder
+    folder = folder or RECORDING_DEFAULTS[RECORDING_DEFAULTS_KEYS.FOLDER]
+    if _recorder is None and folder:
+        _recorder = Recorder(folder=folder, max_transcripts=max_transcripts)
+        Log.warning(f'recording sanitized router outputs to "{folder}"')
+    return _recorder
+
+
+def record_transcript(vendor: str,
+                      command: str,
+                      output: Union[List[str], List[Dict[str, Any]]],
+                      credentials: Optional[Dict[str, Any]] = None,
+                      params: Optional[Dict[str, Any]] = None,
+                      **kwargs) -> Optional[str]:
+    """
+    a no-op until recording is initialized
+    """
+    if _recorder is None:
+        return None
+    return _recorder.record(vendor, command, output, credentials=credentials, params=params, **kwargs)
+
+
+def load_corpus(folder: str,
+                vendors: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    result = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.endswith('.json'):
+                continue
+            filename = os.path.join(root, name)
+            with open(filename) as f:
+                transcript = json.load(f)
+            if vendors and transcript.get('vendor') not in vendors:
+                continue
+            transcript['filename'] = filename
+            result.append(transcript)
+    return result
@@ -1,6 +1,7 @@
 import datetime
 from typing import Optional, Union, Iterable
 
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, JobEvent
 from apscheduler.job import Job
 from apscheduler.schedulers.background import BackgroundScheduler, BaseScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
@@ -10,10 +11,16 @@ import pytz
 
 from common.consts import BOOL_VALUES
 from common.logs import Log
+from common.metrics import counter
 
 
 _scheduler: Optional[BackgroundScheduler] = None
 
+_JOBS_SKIPPED = counter('secunity_scheduler_jobs_skipped_total',
+                        'Scheduled runs that were skipped - the previous run was still running (max_instances) or '
+                        'the run started too late (missed)',
+                        labelnames=('job', 'reason'))
+
 
 class SCHEDULER_SETTINGS_KEYS:
     START = 'start'
@@ -47,6 +54,7 @@ def start_scheduler(start: Optional[bool] = None,
     _scheduler = BackgroundScheduler(executors={'default': ThreadPoolExecutor(threadpool_size)},
                                      job_defaults={'max_instances': 1},
                                      timezone=timezone)
+    _scheduler.add_listener(_on_job_skipped, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
     if start:
         _scheduler.start()
         Log.debug('scheduler initialized and started')
@@ -56,6 +64,12 @@ def start_scheduler(start: Optional[bool] = None,
     return _scheduler
 
 
+def _on_job_skipped(event: JobEvent):
+    job = _scheduler.get_job(event.job_id) if _scheduler else None
+    reason = 'max_instances' if event.code == EVENT_JOB_MAX_INSTANCES else 'missed'
+    _JOBS_SKIPPED.inc(job=job.name if job else event.job_id, reason=reason)
+
+
 def shutdown_scheduler(wait: bool = True):
     _scheduler.shutdown(wait=wait)
 
@@ -0,0 +1,345 @@
+import datetime
+import decimal
+import gzip
+import io
+import json
+import re
+import uuid
+from typing import Any, Dict, Iterator, Optional, Tuple, List, Union
+
+from bson.objectid import ObjectId
+
+from common.logs import Log
+
+
+class PAYLOAD_FORMAT:
+    JSON = 'json'
+    MSGPACK = 'msgpack'
+    CBOR = 'cbor'
+
+    DEFAULT = JSON
+
+    ALL = (JSON, MSGPACK, CBOR)
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> str:
+        if not value:
+            return cls.DEFAULT
+        value = str(value).strip().lower()
+        if value not in cls.ALL:
+            raise ValueError(f'invalid payload format: "{value}"')
+        return value
+
+
+class CONTENT_TYPE:
+    JSON = 'application/json'
+    MSGPACK = 'application/msgpack'
+    CBOR = 'application/cbor'
+
+    BY_FORMAT = {
+        PAYLOAD_FORMAT.JSON: JSON,
+        PAYLOAD_FORMAT.MSGPACK: MSGPACK,
+        PAYLOAD_FORMAT.CBOR: CBOR,
+    }
+
+
+class CONTENT_ENCODING:
+    GZIP = 'gzip'
+
+
+class SERIALIZERS_DEFAULTS_KEYS:
+    CHUNK_SIZE = 'chunk_size'
+    COMPRESS_LEVEL = 'compress_level'
+
+
+SERIALIZERS_DEFAULTS = {
+    SERIALIZERS_DEFAULTS_KEYS.CHUNK_SIZE: 64 * 1024,
+    SERIALIZERS_DEFAULTS_KEYS.COMPRESS_LEVEL: 6,
+}
+
+
+def json_default(obj: Any) -> Any:
+    """
+    json "default" hook for the types remove_unserializable_types used to convert up-front
+    """
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    elif isinstance(obj, decimal.Decimal):
+        return float(obj)
+    elif isinstance(obj, (ObjectId, uuid.UUID)):
+        return str(obj)
+    elif isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+
+_JSON_KEY_TYPES = (str, int, float, bool, type(None))
+_JSON_CONTAINER_TYPES = (dict, list, tuple)
+
+
+def _json_key(key: Any) -> Any:
+    if isinstance(key, _JSON_KEY_TYPES):
+        return key
+    value = json_default(key)
+    return value if isinstance(value, _JSON_KEY_TYPES) else str(value)
+
+
+def json_keys(obj: Any) -> Any:
+    """
+    the encoder never calls "default" for dict keys - converts the keys json_default handles (ObjectId, datetime..).
+    obj itself is returned when all the keys are serializable, the containers are copied only when a key changes
+    """
+    if isinstance(obj, dict):
+        result, changed = {}, False
+        for k, v in obj.items():
+            key, value = _json_key(k), json_keys(v)
+            changed = changed or key is not k or value is not v
+            result[key] = value
+        return result if changed else obj
+    if isinstance(obj, (list, tuple)):
+        if not any(isinstance(_, _JSON_CONTAINER_TYPES) for _ in obj):
+            return obj
+        values = [json_keys(_) for _ in obj]
+        return values if any(a is not b for a, b in zip(values, obj)) else obj
+    return obj
+
+
+# allow_nan=False - NaN and Infinity are not valid json, the same as the bodies requests encodes
+_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'), allow_nan=False)
+
+
+def encode_json(payload: Any,
+                compress: Optional[bool] = False,
+                compress_level: Optional[int] = None) -> bytes:
+    """
+    Serialize payload in a single pass (C encoder) - no intermediate copy of the payload is built
+    """
+    try:
+        body = _encoder.encode(payload)
+    except TypeError:
+        # rare - dict keys that only json_default can convert
+        body = _encoder.encode(json_keys(payload))
+    body = body.encode('utf-8')
+    if compress:
+        if compress_level is None:
+            compress_level = SERIALIZERS_DEFAULTS[SERIALIZERS_DEFAULTS_KEYS.COMPRESS_LEVEL]
+        body = gzip.compress(body, compresslevel=compress_level)
+    return body
+
+
+def iter_json(payload: Any,
+              compress: Optional[bool] = False,
+              chunk_size: Optional[int] = None,
+              compress_level: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Serialize payload incrementally, yielding (optionally gzip compressed) chunks of about chunk_size bytes.
+    Suitable as a chunked transfer-encoding request body - the whole document is never held in memory
+    """
+    if not chunk_size:
+        chunk_size = SERIALIZERS_DEFAULTS[SERIALIZERS_DEFAULTS_KEYS.CHUNK_SIZE]
+    if compress_level is None:
+        compress_level = SERIALIZERS_DEFAULTS[SERIALIZERS_DEFAULTS_KEYS.COMPRESS_LEVEL]
+    buffer = io.BytesIO()
+    writer = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=compress_level) if compress else buffer
+    pending, pending_size = [], 0
+
+    def _drain() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    # the stream can't be restarted on a TypeError - the keys are converted up front
+    for part in _encoder.iterencode(json_keys(payload)):
+        pending.append(part)
+        pending_size += len(part)
+        if pending_size >= chunk_size:
+            writer.write(''.join(pending).encode('utf-8'))
+            pending, pending_size = [], 0
+            data = _drain()
+            if data:
+                yield data
+    if pending:
+        writer.write(''.join(pending).encode('utf-8'))
+    if compress:
+        writer.close()
+    data = _drain()
+    if data:
+        yield data
+
+
+__IMPORTS__ = {
+    PAYLOAD_FORMAT.MSGPACK: None,
+    PAYLOAD_FORMAT.CBOR: None,
+}
+
+
+def get_import(payload_format: Union[PAYLOAD_FORMAT, str]):
+    value = __IMPORTS__.get(payload_format)
+    if value:
+        return value
+    if payload_format == PAYLOAD_FORMAT.MSGPACK:
+        import msgpack
+        __IMPORTS__[payload_format] = msgpack
+    elif payload_format == PAYLOAD_FORMAT.CBOR:
+        import cbor2
+        __IMPORTS__[payload_format] = cbor2
+    else:
+        return Log.error_raise(f'invalid payload format: "{str(payload_format)}"')
+    return __IMPORTS__[payload_format]
+
+
+def is_payload_format_available(payload_format: Union[PAYLOAD_FORMAT, str]) -> bool:
+    if payload_format == PAYLOAD_FORMAT.JSON:
+        return True
+    try:
+        get_import(payload_format)
+        return True
+    except Exception:
+        return False
+
+
+# compact stats encoding: the output lines are split to templates and their integer tokens (counters, ports,
+# address octets). templates are interned in a table, and the payload is sent column-wise - the template index of
+# every line and a flat list of all the integers
+COMPACT_STATS_VERSION = 1
+_TEMPLATE_PLACEHOLDER = '\0'
+_digits_regex = re.compile(r'([0-9]+)')
+# integers that survive an int() round trip (no leading zeros) and fit in 64 bits
+_integer_regex = re.compile(r'((?<![0-9])(?:0|[1-9][0-9]{0,17})(?![0-9]))')
+
+
+def _epoch_ms(dt: datetime.datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def compact_stats_payload(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    returns None if payload is not a stats payload (a "data" list of single line strings)
+    """
+    data = payload.get('data') if isinstance(payload, dict) else None
+    if not isinstance(data, list) or not all(isinstance(_, str) for _ in data):
+        return None
+    text = '\n'.join(data)
+    if _TEMPLATE_PLACEHOLDER in text or text.count('\n') != max(len(data) - 1, 0):
+        return None
+
+    parts = _digits_regex.split(text)
+    tokens = parts[1::2]
+    counters = list(map(int, tokens))
+    if _TEMPLATE_PLACEHOLDER.join(map(str, counters)) != _TEMPLATE_PLACEHOLDER.join(tokens):
+        # leading zeros or huge numbers - keep these in the templates
+        parts = _integer_regex.split(text)
+        counters = list(map(int, parts[1::2]))
+    templates: Dict[str, int] = {}
+    lines = [templates.setdefault(_, len(templates))
+             for _ in _TEMPLATE_PLACEHOLDER.join(parts[::2]).split('\n')] if data else []
+
+    result = {k: v for k, v in payload.items() if k != 'data'}
+    result['v'] = COMPACT_STATS_VERSION
+    local_time = result.get('local_time')
+    if isinstance(local_time, datetime.datetime):
+        result['local_time'] = _epoch_ms(local_time)
+    result['templates'] = list(templates)
+    result['lines'] = lines
+    result['counters'] = counters
+    return result
+
+
+def expand_stats_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    reverse of compact_stats_payload - the decoding the backend performs
+    """
+    templates = [_.split(_TEMPLATE_PLACEHOLDER) for _ in payload.get('templates') or []]
+    counters = iter(payload.get('counters') or [])
+    data = []
+    for index in payload.get('lines') or []:
+        parts = templates[index]
+        if len(parts) == 1:
+            data.append(parts[0])
+            continue
+        data.append(''.join([_ for part in parts[:-1] for _ in (part, str(next(counters)))] + [parts[-1]]))
+    result = {k: v for k, v in payload.items() if k not in ('v', 'templates', 'lines', 'counters')}
+    result['data'] = data
+    return result
+
+
+def iter_stats_chunks(payload: Dict[str, Any],
+                      chunk_bytes: int) -> Iterator[Dict[str, Any]]:
+    """
+    Splits a stats payload to payloads of about chunk_bytes of lines each (json size, before compression).
+    When split, every chunk carries the upload id, its sequence number and the number of chunks so the API can
+    reassemble the upload. A payload smaller than chunk_bytes is yielded as is
+    """
+    data = payload.get('data') if isinstance(payload, dict) else None
+    if not isinstance(data, list) or not data or chunk_bytes <= 0:
+        yield payload
+        return
+    bounds, size = [0], 0
+    for i, line in enumerate(data):
+        # quotes and a separator per line, escapes are ignored
+        line_size = len(line) + 3
+        if size and size + line_size > chunk_bytes:
+            bounds.append(i)
+            size = 0
+        size += line_size
+    if len(bounds) == 1:
+        yield payload
+        return
+    bounds.append(len(data))
+    upload_id = uuid.uuid4().hex
+    chunks = len(bounds) - 1
+    for chunk in range(chunks):
+        result = {k: v for k, v in payload.items() if k != 'data'}
+        result['data'] = data[bounds[chunk]:bounds[chunk + 1]]
+        result['upload_id'] = upload_id
+        result['chunk'] = chunk
+        result['chunks'] = chunks
+        yield result
+
+
+def encode_binary(payload: Any,
+                  payload_format: Union[PAYLOAD_FORMAT, str],
+                  compact: Optional[bool] = True) -> bytes:
+    module = get_import(payload_format)
+    if compact:
+        payload = compact_stats_payload(payload) or payload
+    if payload_format == PAYLOAD_FORMAT.MSGPACK:
+        return module.packb(payload, default=json_default, use_bin_type=True)
+    return module.dumps(payload, timezone=datetime.timezone.utc,
+                        default=lambda encoder, value: encoder.encode(json_default(value)))
+
+
+def decode_binary(body: bytes,
+                  payload_format: Union[PAYLOAD_FORMAT, str]) -> Any:
+    module = get_import(payload_format)
+    if payload_format == PAYLOAD_FORMAT.MSGPACK:
+        payload = module.unpackb(body, raw=False)
+    else:
+        payload = module.loads(body)
+    if isinstance(payload, dict) and payload.get('v') == COMPACT_STATS_VERSION and 'templates' in payload:
+        payload = expand_stats_payload(payload)
+    return payload
+
+
+def encode_request_body(payload: Any,
+                        compress: Optional[bool] = False,
+                        payload_format: Optional[Union[PAYLOAD_FORMAT, str]] = None,
+                        compact: Optional[bool] = True,
+                        **kwargs) -> Tuple[bytes, Dict[str, str]]:
+    payload_format = PAYLOAD_FORMAT.parse(payload_format)
+    headers = {'Content-Type': CONTENT_TYPE.BY_FORMAT[payload_format]}
+    if payload_format == PAYLOAD_FORMAT.JSON:
+        body = encode_json(payload, compress=compress, **kwargs)
+    else:
+        body = encode_binary(payload, payload_format=payload_format, compact=compact)
+        if compress:
+            body = gzip.compress(body, compresslevel=kwargs.get('compress_level') or
+                                 SERIALIZERS_DEFAULTS[SERIALIZERS_DEFAULTS_KEYS.COMPRESS_LEVEL])
+    if compress:
+        headers['Content-Encoding'] = CONTENT_ENCODING.GZIP
+    return body, headers
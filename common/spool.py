@@ -0,0 +1,349 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, List, NamedTuple, Dict, Tuple
+
+from common.logs import Log
+from common.metrics import gauge, counter
+
+
+class SPOOL_DEFAULTS_KEYS:
+    PATH = 'path'
+    FALLBACK_PATH = 'fallback_path'
+    MAX_BYTES = 'max_bytes'
+    MAX_AGE = 'max_age'
+    SEGMENT_BYTES = 'segment_bytes'
+    REPLAY_BATCH = 'replay_batch'
+
+
+SPOOL_DEFAULTS = {
+    SPOOL_DEFAULTS_KEYS.PATH: '/var/lib/secunity/spool',
+    SPOOL_DEFAULTS_KEYS.FALLBACK_PATH: '/tmp/secunity-spool',
+    SPOOL_DEFAULTS_KEYS.MAX_BYTES: 256 * 1024 * 1024,
+    SPOOL_DEFAULTS_KEYS.MAX_AGE: 24 * 60 * 60,  # seconds
+    SPOOL_DEFAULTS_KEYS.SEGMENT_BYTES: 8 * 1024 * 1024,
+    SPOOL_DEFAULTS_KEYS.REPLAY_BATCH: 10,
+}
+
+
+class SPOOL_DROP_REASON:
+    SIZE = 'size'
+    AGE = 'age'
+    CORRUPT = 'corrupt'
+
+    ALL = (SIZE, AGE, CORRUPT)
+
+
+_BACKLOG_RECORDS = gauge('secunity_spool_backlog_records',
+                         'Records waiting in the spool to be replayed',
+                         labelnames=('spool',))
+_BACKLOG_BYTES = gauge('secunity_spool_backlog_bytes',
+                       'Bytes on disk used by the spool segments',
+                       labelnames=('spool',))
+_DROPPED = counter('secunity_spool_dropped_total',
+                   'Spooled records dropped before they were replayed',
+                   labelnames=('spool', 'reason'))
+
+# directory layout:
+#   <seq>.seg - the records, appended back to back
+#   <seq>.idx - fixed size entry per record - offset in the segment, length, crc32, timestamp (ms)
+#   cursor    - segment seq and entry index of the next record to replay
+# a record is visible once its index entry is written, so a crash between the two writes leaves an unreferenced
+# tail in the segment that is truncated on the next open.
+_ENTRY = struct.Struct('<QIIQ')
+_CURSOR = struct.Struct('<QQ')
+_SEGMENT_SUFFIX = '.seg'
+_INDEX_SUFFIX = '.idx'
+_CURSOR_FILENAME = 'cursor'
+
+
+class SpoolRecord(NamedTuple):
+    segment: int
+    index: int
+    timestamp: float
+    body: bytes
+
+
+class _Segment:
+
+    __slots__ = ('seq', 'entries', 'size', 'first_ms', 'last_ms')
+
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.entries = 0
+        self.size = 0
+        self.first_ms = 0
+        self.last_ms = 0
+
+
+class Spool:
+
+    def __init__(self,
+                 name: str,
+                 path: Optional[str] = None,
+                 max_bytes: Optional[int] = None,
+                 max_age: Optional[int] = None,
+                 segment_bytes: Optional[int] = None):
+        """
+        Bounded, append-only on-disk queue of opaque records, read back in append order.
+        Segments are dropped (oldest first) when the spool exceeds max_bytes and records older than
+        max_age seconds are skipped.
+        """
+        if not path:
+            path = SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.PATH]
+            if not os.path.isdir(os.path.dirname(path)):
+                path = SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.FALLBACK_PATH]
+        self._name = name
+        self._path = os.path.join(path, name)
+        self._max_bytes = max_bytes or SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.MAX_BYTES]
+        self._max_age_ms = (max_age or SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.MAX_AGE]) * 1000
+        self._segment_bytes = min(segment_bytes or SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.SEGMENT_BYTES],
+                                  self._max_bytes)
+        self._lock = threading.Lock()
+        self._segments: Dict[int, _Segment] = {}
+        self._cursor: Tuple[int, int] = (0, 0)
+
+        os.makedirs(self._path, exist_ok=True)
+        with self._lock:
+            self._load()
+            self._enforce_limits()
+            self._update_metrics()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _filename(self,
+                  seq: int,
+                  suffix: str) -> str:
+        return os.path.join(self._path, f'{seq:016d}{suffix}')
+
+    def _load(self):
+        for filename in os.listdir(self._path):
+            if filename.endswith(_INDEX_SUFFIX):
+                try:
+                    seq = int(filename[:-len(_INDEX_SUFFIX)])
+                except ValueError:
+                    continue
+                self._segments[seq] = self._load_segment(seq)
+        try:
+            with open(os.path.join(self._path, _CURSOR_FILENAME), 'rb') as f:
+                self._cursor = _CURSOR.unpack(f.read(_CURSOR.size))
+        except Exception:
+            self._cursor = (min(self._segments), 0) if self._segments else (0, 0)
+        self._normalize_cursor()
+
+    def _load_segment(self, seq: int) -> _Segment:
+        segment = _Segment(seq)
+        index_filename = self._filename(seq, _INDEX_SUFFIX)
+        segment_filename = self._filename(seq, _SEGMENT_SUFFIX)
+        with open(index_filename, 'rb') as f:
+            data = f.read()
+        data_size = os.path.getsize(segment_filename) if os.path.isfile(segment_filename) else 0
+        entries = len(data) // _ENTRY.size
+        # drop entries which point past the end of the segment (interrupted write)
+        while entries:
+            offset, length, _, _ = _ENTRY.unpack_from(data, (entries - 1) * _ENTRY.size)
+            if offset + length <= data_size:
+                break
+            entries -= 1
+        if entries:
+            offset, length, _, segment.last_ms = _ENTRY.unpack_from(data, (entries - 1) * _ENTRY.size)
+            segment.first_ms = _ENTRY.unpack_from(data, 0)[3]
+            segment.size = offset + length
+        segment.entries = entries
+        if len(data) != entries * _ENTRY.size:
+            os.truncate(index_filename, entries * _ENTRY.size)
+        if data_size != segment.size:
+            with open(segment_filename, 'ab') as f:
+                f.truncate(segment.size)
+        return segment
+
+    def _active(self) -> Optional[_Segment]:
+        return self._segments[max(self._segments)] if self._segments else None
+
+    def _remove_segment(self, seq: int):
+        self._segments.pop(seq, None)
+        for suffix in (_INDEX_SUFFIX, _SEGMENT_SUFFIX):
+            try:
+                os.remove(self._filename(seq, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _normalize_cursor(self):
+        """
+        moves the cursor past fully replayed segments and removes them. the active segment is kept
+        """
+        seq, index = self._cursor
+        for cur in sorted(self._segments):
+            segment = self._segments[cur]
+            if cur < seq or (cur == seq and index >= segment.entries and segment is not self._active()):
+                self._remove_segment(cur)
+                continue
+            if cur > seq:
+                seq, index = cur, 0
+            break
+        else:
+            if not self._segments:
+                seq, index = seq + 1 if index else seq, 0
+        self._cursor = (seq, index)
+
+    def _write_cursor(self):
+        filename = os.path.join(self._path, _CURSOR_FILENAME)
+        with open(f'{filename}.tmp', 'wb') as f:
+            f.write(_CURSOR.pack(*self._cursor))
+        os.replace(f'{filename}.tmp', filename)
+
+    def _pending(self, segment: _Segment) -> int:
+        seq, index = self._cursor
+        if segment.seq < seq:
+            return 0
+        return segment.entries - index if segment.seq == seq else segment.entries
+
+    def _drop_segment(self,
+                      seq: int,
+                      reason: str):
+        dropped = self._pending(self._segments[seq])
+        if dropped:
+            _DROPPED.inc(dropped, spool=self._name, reason=reason)
+            Log.warning(f'spool "{self._name}" is dropping {dropped} records - reason: "{reason}"')
+        self._remove_segment(seq)
+        if self._cursor[0] <= seq:
+            self._cursor = (seq + 1, 0)
+            self._normalize_cursor()
+            self._write_cursor()
+
+    def _enforce_limits(self):
+        min_ms = int(time.time() * 1000) - self._max_age_ms
+        for seq in sorted(self._segments):
+            segment = self._segments[seq]
+            if segment.entries and segment.last_ms < min_ms:
+                self._drop_segment(seq, reason=SPOOL_DROP_REASON.AGE)
+        while len(self._segments) > 1 and sum(_.size for _ in self._segments.values()) > self._max_bytes:
+            self._drop_segment(min(self._segments), reason=SPOOL_DROP_REASON.SIZE)
+
+    def _update_metrics(self):
+        _BACKLOG_RECORDS.set(self.depth, spool=self._name)
+        _BACKLOG_BYTES.set(self.size, spool=self._name)
+
+    @property
+    def depth(self) -> int:
+        return sum(self._pending(_) for _ in self._segments.values())
+
+    @property
+    def size(self) -> int:
+        return sum(_.size for _ in self._segments.values())
+
+    def append(self,
+               body: bytes,
+               timestamp: Optional[float] = None):
+        if not body:
+            return
+        timestamp_ms = int((timestamp if timestamp is not None else time.time()) * 1000)
+        with self._lock:
+            segment = self._active()
+            if segment is None or (segment.entries and segment.size + len(body) > self._segment_bytes):
+                seq = segment.seq + 1 if segment else max(self._cursor[0], 1)
+                segment = self._segments[seq] = _Segment(seq)
+                # the previous segment is no longer active, remove it if it was fully replayed
+                cursor = self._cursor
+                self._normalize_cursor()
+                if cursor != self._cursor:
+                    self._write_cursor()
+            entry = _ENTRY.pack(segment.size, len(body), zlib.crc32(body), timestamp_ms)
+            with open(self._filename(segment.seq, _SEGMENT_SUFFIX), 'ab') as f:
+                f.write(body)
+            with open(self._filename(segment.seq, _INDEX_SUFFIX), 'ab') as f:
+                f.write(entry)
+            if not segment.entries:
+                segment.first_ms = timestamp_ms
+            segment.entries += 1
+            segment.size += len(body)
+            segment.last_ms = timestamp_ms
+            self._enforce_limits()
+            self._update_metrics()
+
+    def peek(self,
+             limit: Optional[int] = None) -> List[SpoolRecord]:
+        """
+        returns up to limit of the oldest records, without removing them - call ack once a record was handled.
+        expired and corrupted records are skipped (and dropped)
+        """
+        if not limit:
+            limit = SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.REPLAY_BATCH]
+        records = []
+        with self._lock:
+            min_ms = int(time.time() * 1000) - self._max_age_ms
+            skipped = {}
+            done = False
+            for seq in sorted(self._segments):
+                segment = self._segments[seq]
+                start = self._cursor[1] if seq == self._cursor[0] else 0
+                if seq < self._cursor[0] or start >= segment.entries or not segment.size:
+                    continue
+                with open(self._filename(seq, _INDEX_SUFFIX), 'rb') as f:
+                    f.seek(start * _ENTRY.size)
+                    entries = f.read((segment.entries - start) * _ENTRY.size)
+                with open(self._filename(seq, _SEGMENT_SUFFIX), 'rb') as f, \
+                        mmap.mmap(f.fileno(), segment.size, access=mmap.ACCESS_READ) as data:
+                    for i in range(segment.entries - start):
+                        offset, length, crc, timestamp_ms = _ENTRY.unpack_from(entries, i * _ENTRY.size)
+                        body = data[offset:offset + length]
+                        reason = SPOOL_DROP_REASON.AGE if timestamp_ms < min_ms else \
+                            SPOOL_DROP_REASON.CORRUPT if zlib.crc32(body) != crc else None
+                        if reason and records:
+                            # keep the returned batch contiguous, the record is skipped on the next call
+                            done = True
+                        elif reason:
+                            self._cursor = (seq, start + i + 1)
+                            skipped[reason] = skipped.get(reason, 0) + 1
+                            continue
+                        else:
+                            records.append(SpoolRecord(segment=seq, index=start + i,
+                                                       timestamp=timestamp_ms / 1000, body=body))
+                            done = len(records) >= limit
+                        if done:
+                            break
+                if done:
+                    break
+            if skipped:
+                for reason, count in skipped.items():
+                    _DROPPED.inc(count, spool=self._name, reason=reason)
+                    Log.warning(f'spool "{self._name}" skipped {count} records - reason: "{reason}"')
+                self._normalize_cursor()
+                self._write_cursor()
+                self._update_metrics()
+        return records
+
+    def ack(self, record: SpoolRecord):
+        """
+        marks record, and every record before it, as handled
+        """
+        with self._lock:
+            if (record.segment, record.index + 1) <= self._cursor:
+                return
+            self._cursor = (record.segment, record.index + 1)
+            self._normalize_cursor()
+            self._write_cursor()
+            self._update_metrics()
+
+
+_spools: Dict[str, Spool] = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool(name: str,
+              path: Optional[str] = None,
+              **kwargs) -> Spool:
+    with _spools_lock:
+        spool = _spools.get(name)
+        if spool is None:
+            spool = _spools[name] = Spool(name=name, path=path, **kwargs)
+        return spool
@@ -1,12 +1,15 @@
 import re
+import sys
 import time
-from typing import Dict, Any
-
-import paramiko
+from typing import Dict, Any, Optional, TYPE_CHECKING
 
 from common.configs import CONFIG_KEY
 from common.consts import SSH_PORT
 
+if TYPE_CHECKING:
+    import asyncssh
+    import paramiko
+
 
 class SSH_DEFAULTS_KEYS:
     PORT = 'port'
@@ -38,7 +41,47 @@ def get_ssh_credentials_from_config(config: Dict[str, Any]) -> Dict[str, Any]:
     return result
 
 
-def read_and_wait(shell: paramiko.Channel, prompt: re.Pattern) -> str:
+# asyncssh equivalents of paramiko's exceptions
+_ASYNCSSH_EXCEPTIONS = {
+    'AuthenticationException': 'PermissionDenied',
+    'SSHException': 'Error',
+}
+
+
+def is_ssh_exception(ex: BaseException,
+                     name: str) -> bool:
+    # paramiko and asyncssh are imported lazily - if one was never imported, ex cannot be one of its exceptions
+    for module_name, cls_name in (('paramiko.ssh_exception', name), ('asyncssh', _ASYNCSSH_EXCEPTIONS.get(name))):
+        module = sys.modules.get(module_name)
+        cls = getattr(module, cls_name, None) if module is not None and cls_name else None
+        if cls is not None and isinstance(ex, cls):
+            return True
+    return False
+
+
+def is_connectivity_error(ex: Optional[BaseException]) -> bool:
+    """
+    whether ex is a failure to reach the router (connect, authentication, socket and transport errors) - errors of a
+    single command or rule (e.g. RouterOS traps) are not
+    """
+    seen = set()
+    # the command workers re-raise the errors of the clients as LException (raised from or while handling them)
+    while ex is not None and id(ex) not in seen:
+        seen.add(id(ex))
+        if isinstance(ex, (OSError, EOFError)) or type(ex).__name__ == 'TimeoutError':
+            return True
+        if is_ssh_exception(ex, 'SSHException'):
+            return True
+        # RouterOS-api, the Mikrotik client - a closed connection is one of its connection errors
+        module = sys.modules.get('routeros_api.exceptions')
+        cls = getattr(module, 'RouterOsApiConnectionError', None) if module is not None else None
+        if cls is not None and isinstance(ex, cls):
+            return True
+        ex = ex.__cause__ or ex.__context__
+    return False
+
+
+def read_and_wait(shell: 'paramiko.Channel', prompt: re.Pattern) -> str:
     full_output = []
 
     while True:
@@ -58,3 +101,28 @@ def read_and_wait(shell: paramiko.Channel, prompt: re.Pattern) -> str:
         time.sleep(0.1)
 
     return "".join(full_output)
+
+
+async def read_and_wait_async(process: 'asyncssh.SSHClientProcess',
+                              prompt: re.Pattern,
+                              timeout: Optional[float] = None) -> str:
+    import asyncio
+
+    if timeout is None:
+        timeout = SSH_DEFAULTS[SSH_DEFAULTS_KEYS.TIMEOUT]
+    full_output = []
+
+    while True:
+        try:
+            output = await asyncio.wait_for(process.stdout.read(1024), timeout)
+        except asyncio.TimeoutError:
+            break
+        if not output:
+            # eof
+            break
+        full_output.append(output)
+
+        if prompt.search(output):
+            break
+
+    return "".join(full_output)
@@ -0,0 +1,221 @@
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os.path
+import queue
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from common.logs import Log, NonBlockingQueueHandler
+
+
+class TRACING_DEFAULTS_KEYS:
+    ENABLED = 'tracing'
+    FOLDER = 'tracing_folder'
+    MAX_BYTES = 'tracing_max_bytes'
+    BACKUP_COUNT = 'tracing_backup_count'
+    BUFFER_SIZE = 'tracing_buffer_size'
+
+
+TRACING_DEFAULTS = {
+    TRACING_DEFAULTS_KEYS.ENABLED: False,
+    TRACING_DEFAULTS_KEYS.FOLDER: '/var/log/secunity',
+    TRACING_DEFAULTS_KEYS.MAX_BYTES: 20 * 1024 * 1024,
+    TRACING_DEFAULTS_KEYS.BACKUP_COUNT: 3,
+    # the latest traces served on /traces, 0 - disabled
+    TRACING_DEFAULTS_KEYS.BUFFER_SIZE: 200,
+}
+
+
+class Span:
+
+    __slots__ = ('name', 'attrs', 'start', 'duration', 'error', 'children', '_perf')
+
+    def __init__(self,
+                 name: str,
+                 attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List['Span'] = []
+        self._perf = time.perf_counter()
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._perf
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = dict(name=self.name,
+                      start=round(self.start, 6),
+                      duration_ms=round((self.duration or 0) * 1000, 3))
+        if self.attrs:
+            result['attrs'] = self.attrs
+        if self.error:
+            result['error'] = self.error
+        if self.children:
+            result['children'] = [_.to_dict() for _ in self.children]
+        return result
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('secunity_span', default=None)
+_enabled = False
+_writer: Optional[logging.Logger] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_buffer: Optional[Deque[Dict[str, Any]]] = None
+_lock = threading.Lock()
+
+
+def init_tracing(enabled: Optional[bool] = None,
+                 module: Optional[str] = None,
+                 folder: Optional[str] = None,
+                 max_bytes: Optional[int] = None,
+                 backup_count: Optional[int] = None,
+                 buffer_size: Optional[int] = None,
+                 **kwargs) -> bool:
+    global _enabled, _writer, _listener, _buffer
+    if enabled is not True:
+        return False
+    with _lock:
+        if _enabled:
+            return True
+        if not folder:
+            folder = TRACING_DEFAULTS[TRACING_DEFAULTS_KEYS.FOLDER]
+        if max_bytes is None:
+            max_bytes = TRACING_DEFAULTS[TRACING_DEFAULTS_KEYS.MAX_BYTES]
+        if backup_count is None:
+            backup_count = TRACING_DEFAULTS[TRACING_DEFAULTS_KEYS.BACKUP_COUNT]
+        if buffer_size is None:
+            buffer_size = TRACING_DEFAULTS[TRACING_DEFAULTS_KEYS.BUFFER_SIZE]
+        filename = os.path.join(folder, f'{module or "secunity"}-traces.jsonl')
+        try:
+            handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+        except OSError as ex:
+            Log.error(f'failed to open the traces file "{filename}" - error: "{str(ex)}"')
+            return False
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        # the file is written by the listener thread, like the log file
+        trace_queue = queue.Queue(maxsize=10000)
+        writer = logging.getLogger(f'{__name__}.{module or "secunity"}')
+        writer.setLevel(logging.INFO)
+        writer.propagate = False
+        writer.addHandler(NonBlockingQueueHandler(trace_queue))
+        _listener = logging.handlers.QueueListener(trace_queue, handler)
+        _listener.start()
+        _writer = writer
+        if buffer_size > 0:
+            _buffer = collections.deque(maxlen=buffer_size)
+            from common.metrics_server import register_endpoint
+
+            register_endpoint('/traces', _traces_endpoint)
+        _enabled = True
+        Log.info(f'iteration traces are written to "{filename}"')
+        return True
+
+
+def stop_tracing():
+    global _enabled, _listener
+    with _lock:
+        _enabled = False
+        listener, _listener = _listener, None
+    if listener:
+        listener.stop()
+
+
+def is_tracing() -> bool:
+    return _enabled
+
+
+@contextlib.contextmanager
+def trace(name: str, **attrs):
+    """
+    the root span of an iteration - the tree is written when it finishes
+    """
+    if not _enabled or _current.get() is not None:
+        with span(name, **attrs) as result:
+            yield result
+        return
+    root = Span(name, attrs)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as ex:
+        root.error = f'{type(ex).__name__}: {str(ex)}'
+        raise
+    finally:
+        _current.reset(token)
+        root.finish()
+        _emit(root)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    a nested timing of the running trace, a no-op outside of a trace
+    """
+    parent: Optional[Span] = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as ex:
+        child.error = f'{type(ex).__name__}: {str(ex)}'
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+
+def _emit(root: Span):
+    try:
+        value = root.to_dict()
+        if _writer is not None:
+            _writer.info(json.dumps(value, separators=(',', ':'), default=str))
+        if _buffer is not None:
+            _buffer.append(value)
+    except Exception as ex:
+        Log.warning(f'failed to write trace "{root.name}" - error: "{str(ex)}"')
+
+
+def get_traces(device: Optional[str] = None,
+               worker: Optional[str] = None,
+               min_ms: Optional[float] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    the buffered traces, newest first
+    """
+    result = []
+    for value in reversed(list(_buffer or ())):
+        attrs = value.get('attrs', {})
+        if device and attrs.get('device') != device:
+            continue
+        if worker and attrs.get('worker') != worker:
+            continue
+        if min_ms and value['duration_ms'] < min_ms:
+            continue
+        result.append(value)
+        if limit and len(result) >= limit:
+            break
+    return result
+
+
+def _traces_endpoint(query: Dict[str, List[str]]) -> Tuple[str, bytes]:
+    def _get(key: str) -> Optional[str]:
+        values = query.get(key)
+        return values[0] if values else None
+
+    min_ms = _get('min_ms')
+    limit = _get('limit')
+    traces = get_traces(device=_get('device'),
+                        worker=_get('worker'),
+                        min_ms=float(min_ms) if min_ms else None,
+                        limit=int(limit) if limit else None)
+    return 'application/json', json.dumps(traces, separators=(',', ':'), default=str).encode('utf-8')
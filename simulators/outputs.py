@@ -0,0 +1,191 @@
+import random
+from typing import List, Dict, Any, Optional, Union
+
+from common.enums import VENDOR
+
+
+def flowspec_rules(count: int,
+                   seed: Optional[int] = 0,
+                   ip_type: Optional[str] = 'IPv4') -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(count):
+        if ip_type == 'IPv6':
+            destination = f'2001:db8:{i // 65536:x}:{i % 65536:x}::/64'
+            source = f'2001:db8:ffff:{rnd.randrange(65536):x}::/64' if rnd.random() < 0.5 else None
+        else:
+            destination = f'203.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}/32'
+            source = f'198.51.{rnd.randrange(256)}.0/24' if rnd.random() < 0.5 else None
+        packets = rnd.randrange(0, 10 ** 9)
+        rules.append({
+            'index': i + 1,
+            'destination': destination,
+            'source': source,
+            'protocol': rnd.choice((6, 17, 1)),
+            'destination_port': rnd.choice((53, 80, 123, 443, 11211, None)),
+            'rate': rnd.choice((0, 0, 0, 1000000, 10000000)),
+            'packets': packets,
+            'bytes': packets * rnd.randrange(64, 1500),
+        })
+    return rules
+
+
+def cisco_output(rules: List[Dict[str, Any]],
+                 ip_type: Optional[str] = 'IPv4') -> str:
+    lines = ['VRF: default', f'  AFI: {ip_type}']
+    for rule in rules:
+        flow = [f'Dest:{rule["destination"]}']
+        if rule['source']:
+            flow.append(f'Source:{rule["source"]}')
+        if rule['destination_port']:
+            flow.append(f'DPort:={rule["destination_port"]}')
+        flow.append(f'Proto:={rule["protocol"]}')
+        dropped = (rule['packets'], rule['bytes']) if not rule['rate'] else (0, 0)
+        transmitted = (0, 0) if not rule['rate'] else (rule['packets'], rule['bytes'])
+        lines += [
+            f'    Flow           :{",".join(flow)}',
+            f'      Actions      :Traffic-rate: {rule["rate"]} bps  (bgp.1)',
+            '      Statistics                        (packets/bytes)',
+            f'        Matched             : {rule["packets"]:>18}/{rule["bytes"]}',
+            f'        Transmitted         : {transmitted[0]:>18}/{transmitted[1]}',
+            f'        Dropped             : {dropped[0]:>18}/{dropped[1]}',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def arista_output(rules: List[Dict[str, Any]],
+                  ip_type: Optional[str] = 'IPv4') -> str:
+    lines = ['Flow-spec rules for VRF: default', '  Configured on: Ethernet1']
+    for rule in rules:
+        matches = [rule['destination'], rule['source'] or '*', f'IP:{rule["protocol"]}']
+        if rule['destination_port']:
+            matches.append(f'DP:{rule["destination_port"]}')
+        lines += [
+            f'  Flow-spec rule: {";".join(matches)};',
+            f'    Rule identifier: {3000 + rule["index"]}',
+            '    Matches:',
+            f'      Destination prefix: {rule["destination"]}',
+        ]
+        if rule['source']:
+            lines.append(f'      Source prefix: {rule["source"]}')
+        lines += [
+            f'      IP protocol: {rule["protocol"]}',
+            '    Actions:',
+            f'      {"Police: " + str(rule["rate"]) + " bps" if rule["rate"] else "Drop"}',
+            '    Status:',
+            '      Installed: yes',
+            f'      Counter: {rule["packets"]} packets, {rule["bytes"]} bytes',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def juniper_output(rules: List[Dict[str, Any]],
+                   ip_type: Optional[str] = 'IPv4',
+                   interface_name: Optional[str] = 'default') -> str:
+    inet = 'inet6' if ip_type == 'IPv6' else 'inet'
+    lines = [f'Filter: __flowspec_{interface_name}_{inet}__', 'Counters:',
+             f'{"Name":<60}{"Bytes":>20}{"Packets":>20}']
+    for rule in rules:
+        name = [rule['destination'].split('/')[0], rule['source'].split('/')[0] if rule['source'] else '*',
+                f'proto={rule["protocol"]}']
+        if rule['destination_port']:
+            name.append(f'dstport={rule["destination_port"]}')
+        lines.append(f'{",".join(name):<60}{rule["bytes"]:>20}{rule["packets"]:>20}')
+    return '\n'.join(lines) + '\n'
+
+
+HUAWEI_PROMPT = '<HUAWEI>'
+
+
+def huawei_routing_table(rules: List[Dict[str, Any]]) -> str:
+    lines = [' BGP Local router ID is 10.1.1.1',
+             ' Status codes: * - valid, > - best, d - damped, x - best external, a - add path,',
+             '               h - history,  i - internal, s - suppressed, S - Stale',
+             ' Origin : i - IGP, e - EGP, ? - incomplete',
+             f' Total Number of Routes: {len(rules)}', '']
+    for rule in rules:
+        lines += [
+            f' * >  ReIndex : {rule["index"]}',
+            '      Dissemination Rules :',
+            f'       Destination IP : {rule["destination"]}',
+        ]
+        if rule['source']:
+            lines.append(f'       Source IP      : {rule["source"]}')
+        lines.append(f'       Protocol       : eq {rule["protocol"]}')
+        if rule['destination_port']:
+            lines.append(f'       Destination Port : eq {rule["destination_port"]}')
+        lines += ['       MED      : 0            PrefVal  : 0', '       LocalPref: 100',
+                  '       Path/Ogn : 65001i', '']
+    return '\n'.join(lines) + '\n'
+
+
+def huawei_statistics(rule: Dict[str, Any]) -> str:
+    dropped = (rule['packets'], rule['bytes']) if not rule['rate'] else (0, 0)
+    passed = (0, 0) if not rule['rate'] else (rule['packets'], rule['bytes'])
+    lines = [
+        f' ReIndex                        : {rule["index"]}',
+        ' Dissemination Rules:',
+        f'  Destination IP                : {rule["destination"]}',
+        f' Matched                        : Packets {rule["packets"]}, Bytes {rule["bytes"]}',
+        f' Passed                         : Packets {passed[0]}, Bytes {passed[1]}',
+        f' Dropped                        : Packets {dropped[0]}, Bytes {dropped[1]}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def huawei_lines(rules: List[Dict[str, Any]]) -> List[str]:
+    """
+    The lines HuaweiCommandWorker.execute_cli returns - the routing table followed by the statistics of every rule
+    """
+    lines = huawei_routing_table(rules).splitlines() + [HUAWEI_PROMPT]
+    for rule in rules:
+        lines += ['\f'] + huawei_statistics(rule).splitlines() + [HUAWEI_PROMPT]
+    return lines
+
+
+def vendor_output(vendor: Union[VENDOR, str],
+                  rules: List[Dict[str, Any]],
+                  ip_type: Optional[str] = 'IPv4') -> str:
+    vendor = VENDOR.parse(vendor)
+    if vendor == VENDOR.CISCO:
+        return cisco_output(rules, ip_type=ip_type)
+    elif vendor == VENDOR.ARISTA:
+        return arista_output(rules, ip_type=ip_type)
+    elif vendor == VENDOR.JUNIPER:
+        return juniper_output(rules, ip_type=ip_type)
+    elif vendor == VENDOR.HUAWEI:
+        return '\n'.join(huawei_lines(rules)) + '\n'
+    raise ValueError(f'unsupported vendor: "{vendor}"')
+
+
+def vendor_lines(vendor: Union[VENDOR, str],
+                 count: int,
+                 ip_type: Optional[str] = 'IPv4',
+                 seed: Optional[int] = 0) -> List[str]:
+    rules = flowspec_rules(count, seed=seed, ip_type=ip_type)
+    if VENDOR.parse(vendor) == VENDOR.HUAWEI:
+        return huawei_lines(rules)
+    return vendor_output(vendor, rules, ip_type=ip_type).splitlines()
+
+
+def mikrotik_rows(rules: List[Dict[str, Any]],
+                  other_rules: Optional[int] = 10) -> List[Dict[str, str]]:
+    """
+    The rows routeros_api returns for "/ip/firewall/raw/print" (the ".id" key is cleaned to "id") - the secunity
+    flows preceded by rules of the router's own
+    """
+    rows = [{'id': f'*{i + 1:X}', 'chain': 'prerouting', 'action': 'accept', 'src-address-list': 'trusted',
+             'comment': f'management {i + 1}', 'bytes': '0', 'packets': '0', 'invalid': 'false', 'dynamic': 'false',
+             'disabled': 'false'} for i in range(other_rules)]
+    for rule in rules:
+        row = {'id': f'*{other_rules + rule["index"]:X}', 'chain': 'prerouting', 'action': 'drop',
+               'dst-address': rule['destination']}
+        if rule['source']:
+            row['src-address'] = rule['source']
+        row['protocol'] = {6: 'tcp', 17: 'udp', 1: 'icmp'}[rule['protocol']]
+        if rule['destination_port'] and rule['protocol'] != 1:
+            row['dst-port'] = str(rule['destination_port'])
+        row.update({'comment': f'SECUNITY_{rule["index"]:024x}', 'bytes': str(rule['bytes']),
+                    'packets': str(rule['packets']), 'invalid': 'false', 'dynamic': 'false', 'disabled': 'false'})
+        rows.append(row)
+    return rows
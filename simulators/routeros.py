@@ -0,0 +1,315 @@
+import binascii
+import hashlib
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ROUTEROS_DEFAULTS_KEYS:
+    HOST = 'host'
+    PORT = 'port'
+    USERNAME = 'username'
+    PASSWORD = 'password'
+    LATENCY = 'latency'
+
+
+ROUTEROS_DEFAULTS = {
+    ROUTEROS_DEFAULTS_KEYS.HOST: '127.0.0.1',
+    ROUTEROS_DEFAULTS_KEYS.PORT: 0,  # a free port
+    ROUTEROS_DEFAULTS_KEYS.USERNAME: 'secunity',
+    ROUTEROS_DEFAULTS_KEYS.PASSWORD: 'secunity',
+    ROUTEROS_DEFAULTS_KEYS.LATENCY: 0.0,  # seconds per command
+}
+
+
+# the tables the agent reads and writes
+ROUTEROS_TABLES = ('/ip/firewall/raw', '/ip/firewall/filter')
+
+COUNTERS = ('connections', 'logins', 'sentences', 'replies', 'reads', 'rows_read', 'adds', 'removes', 'traps')
+
+
+def _encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return length.to_bytes(1, 'big')
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xF0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words: List[bytes]) -> bytes:
+    return b''.join(_encode_length(len(_)) + _ for _ in words) + b'\x00'
+
+
+class _Reader:
+
+    def __init__(self, client: socket.socket):
+        self._client = client
+        self._buffer = bytearray()
+
+    def read(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            data = self._client.recv(65536)
+            if not data:
+                raise EOFError('connection closed')
+            self._buffer += data
+        result = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return result
+
+    def read_length(self) -> int:
+        first = self.read(1)[0]
+        if first < 0x80:
+            return first
+        if first < 0xC0:
+            return int.from_bytes(bytes([first & 0x3F]) + self.read(1), 'big')
+        if first < 0xE0:
+            return int.from_bytes(bytes([first & 0x1F]) + self.read(2), 'big')
+        if first < 0xF0:
+            return int.from_bytes(bytes([first & 0x0F]) + self.read(3), 'big')
+        return int.from_bytes(self.read(4), 'big')
+
+    def read_sentence(self) -> List[bytes]:
+        words = []
+        while True:
+            length = self.read_length()
+            if not length:
+                return words
+            words.append(self.read(length))
+
+
+class _Command:
+
+    __slots__ = ('path', 'command', 'attributes', 'queries', 'tag')
+
+    def __init__(self, words: List[bytes]):
+        path, _, command = words[0].decode('utf-8').rpartition('/')
+        self.path = path or '/'
+        self.command = command
+        self.attributes: Dict[str, str] = {}
+        self.queries: Dict[str, str] = {}
+        self.tag: Optional[bytes] = None
+        for word in words[1:]:
+            if word.startswith(b'.tag='):
+                self.tag = word[len(b'.tag='):]
+                continue
+            target = self.attributes if word.startswith(b'=') else self.queries if word.startswith(b'?') else None
+            if target is None:
+                continue
+            key, _, value = word[1:].decode('utf-8').partition('=')
+            target[key] = value
+
+
+class RouterOsApiSimulator:
+
+    def __init__(self,
+                 latency: Optional[float] = None,
+                 host: Optional[str] = None,
+                 port: Optional[int] = None,
+                 username: Optional[str] = None,
+                 password: Optional[str] = None,
+                 **kwargs):
+        """
+        A local RouterOS API server (the sentences protocol of port 8728) - login, print/add/remove on the
+        firewall tables, the rules are kept in memory
+        """
+        self.latency = latency if latency is not None else ROUTEROS_DEFAULTS[ROUTEROS_DEFAULTS_KEYS.LATENCY]
+        self.host = host or ROUTEROS_DEFAULTS[ROUTEROS_DEFAULTS_KEYS.HOST]
+        self.username = username or ROUTEROS_DEFAULTS[ROUTEROS_DEFAULTS_KEYS.USERNAME]
+        self.password = password or ROUTEROS_DEFAULTS[ROUTEROS_DEFAULTS_KEYS.PASSWORD]
+        self._port = port if port is not None else ROUTEROS_DEFAULTS[ROUTEROS_DEFAULTS_KEYS.PORT]
+        self._tables: Dict[str, Dict[str, Dict[str, str]]] = {_: {} for _ in ROUTEROS_TABLES}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._stats = {_: 0 for _ in COUNTERS}
+        self._socket: Optional[socket.socket] = None
+        self._stopped = threading.Event()
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1] if self._socket else self._port
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def credentials(self) -> Dict[str, Any]:
+        return dict(host=self.host, api_port=self.port, username=self.username, password=self.password,
+                    vendor='mikrotik')
+
+    def table(self, path: str) -> List[Dict[str, str]]:
+        with self._lock:
+            return [dict(_, **{'.id': rule_id}) for rule_id, _ in self._tables[path.rstrip('/')].items()]
+
+    def clear(self):
+        with self._lock:
+            for table in self._tables.values():
+                table.clear()
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self._stats[key] += value
+
+    def start(self) -> 'RouterOsApiSimulator':
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self._port))
+        self._socket.listen(128)
+        threading.Thread(target=self._accept, name='routeros-accept', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._socket:
+            self._socket.close()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), name='routeros-client', daemon=True).start()
+
+    def _serve(self, client: socket.socket):
+        self._count('connections')
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = _Reader(client)
+        session = dict(logged_in=False, challenge=None)
+        try:
+            while not self._stopped.is_set():
+                words = reader.read_sentence()
+                if not words:
+                    continue
+                self._count('sentences')
+                if self.latency:
+                    time.sleep(self.latency)
+                command = _Command(words)
+                replies = self._handle(command, session)
+                if command.tag is not None:
+                    replies = [_ + [b'.tag=' + command.tag] for _ in replies]
+                self._count('replies', len(replies))
+                client.sendall(b''.join(encode_sentence(_) for _ in replies))
+        except (EOFError, OSError):
+            pass
+        finally:
+            client.close()
+
+    def _handle(self,
+                command: _Command,
+                session: Dict[str, Any]) -> List[List[bytes]]:
+        if command.path == '/' and command.command == 'login':
+            return self._login(command, session)
+        if not session['logged_in']:
+            return self._trap('not logged in')
+        table = self._tables.get(command.path)
+        if table is None:
+            return self._trap('no such command prefix')
+        if command.command == 'print':
+            return self._print(table, command)
+        if command.command == 'add':
+            return self._add(table, command)
+        if command.command == 'remove':
+            return self._remove(table, command)
+        return self._trap('no such command')
+
+    def _trap(self, message: str) -> List[List[bytes]]:
+        self._count('traps')
+        return [[b'!trap', f'=message={message}'.encode('utf-8')], [b'!done']]
+
+    def _login(self,
+               command: _Command,
+               session: Dict[str, Any]) -> List[List[bytes]]:
+        name = command.attributes.get('name')
+        if 'password' in command.attributes:
+            valid = name == self.username and command.attributes['password'] == self.password
+        elif 'response' in command.attributes and session['challenge']:
+            # the pre 6.43 challenge login
+            digest = hashlib.md5(b'\x00' + self.password.encode('utf-8') + session['challenge']).hexdigest()
+            valid = name == self.username and command.attributes['response'] == f'00{digest}'
+        else:
+            session['challenge'] = os.urandom(16)
+            return [[b'!done', b'=ret=' + binascii.hexlify(session['challenge'])]]
+        if not valid:
+            return self._trap('invalid user name or password (6)')
+        session['logged_in'] = True
+        self._count('logins')
+        return [[b'!done']]
+
+    def _print(self,
+               table: Dict[str, Dict[str, str]],
+               command: _Command) -> List[List[bytes]]:
+        with self._lock:
+            rows: List[Tuple[str, Dict[str, str]]] = [
+                (rule_id, dict(rule)) for rule_id, rule in table.items()
+                if all(rule.get(k) == v for k, v in command.queries.items())]
+            self._stats['reads'] += 1
+            self._stats['rows_read'] += len(rows)
+        replies = [[b'!re', f'=.id={rule_id}'.encode('utf-8')] +
+                   [f'={k}={v}'.encode('utf-8') for k, v in rule.items()]
+                   for rule_id, rule in rows]
+        replies.append([b'!done'])
+        return replies
+
+    def _add(self,
+             table: Dict[str, Dict[str, str]],
+             command: _Command) -> List[List[bytes]]:
+        with self._lock:
+            rule_id = f'*{self._next_id:X}'
+            self._next_id += 1
+            table[rule_id] = dict(command.attributes)
+            self._stats['adds'] += 1
+        return [[b'!done', f'=ret={rule_id}'.encode('utf-8')]]
+
+    def _remove(self,
+                table: Dict[str, Dict[str, str]],
+                command: _Command) -> List[List[bytes]]:
+        ids = [_ for _ in command.attributes.get('.id', '').split(',') if _]
+        with self._lock:
+            missing = next((_ for _ in ids if _ not in table), None)
+            if missing is None:
+                for rule_id in ids:
+                    del table[rule_id]
+                self._stats['removes'] += len(ids)
+        if missing is not None or not ids:
+            return self._trap('no such item')
+        return [[b'!done']]
+
+
+
+def _run_in_process(count: int,
+                    params: Dict[str, Any],
+                    ready: Any,
+                    ports: Any):
+    routers = [RouterOsApiSimulator(**params).start() for _ in range(count)]
+    for i, router in enumerate(routers):
+        ports[i] = router.port
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def start_in_process(count: Optional[int] = 1,
+                     **kwargs) -> Tuple[multiprocessing.Process, List[Dict[str, Any]]]:
+    """
+    runs count simulators in another process - their CPU, memory and threads are not measured with the agent's.
+    returns the process and the credentials of every simulator
+    """
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    ports = context.Array('i', count)
+    process = context.Process(target=_run_in_process, args=(count, kwargs, ready, ports), name='routeros',
+                              daemon=True)
+    process.start()
+    if not ready.wait(timeout=60):
+        process.terminate()
+        raise RuntimeError('the routeros api simulators did not start')
+    router = RouterOsApiSimulator(**kwargs)
+    return process, [dict(router.credentials(), api_port=_) for _ in ports]
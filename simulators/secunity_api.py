@@ -0,0 +1,386 @@
+import json
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+class SECUNITY_API_DEFAULTS_KEYS:
+    HOST = 'host'
+    PORT = 'port'
+    LATENCY = 'latency'
+    ERROR_RATE = 'error_rate'
+    FLOWS = 'flows'
+    CHURN = 'churn'
+    SEED = 'seed'
+
+
+SECUNITY_API_DEFAULTS = {
+    SECUNITY_API_DEFAULTS_KEYS.HOST: '127.0.0.1',
+    SECUNITY_API_DEFAULTS_KEYS.PORT: 0,  # a free port
+    # seconds per request, or [min, max]
+    SECUNITY_API_DEFAULTS_KEYS.LATENCY: 0.0,
+    # share of the requests answered with 500
+    SECUNITY_API_DEFAULTS_KEYS.ERROR_RATE: 0.0,
+    # active flows per device
+    SECUNITY_API_DEFAULTS_KEYS.FLOWS: 0,
+    # flows replaced per device per minute
+    SECUNITY_API_DEFAULTS_KEYS.CHURN: 0.0,
+    SECUNITY_API_DEFAULTS_KEYS.SEED: 0,
+}
+
+# settings that a scenario step may change
+SCENARIO_KEYS = (SECUNITY_API_DEFAULTS_KEYS.LATENCY, SECUNITY_API_DEFAULTS_KEYS.ERROR_RATE,
+                 SECUNITY_API_DEFAULTS_KEYS.FLOWS, SECUNITY_API_DEFAULTS_KEYS.CHURN)
+
+
+class ENDPOINT:
+    STATS = 'stats'
+    GET_FLOWS = 'get_flows'
+    SET_FLOW = 'set_flow'
+    OTHER = 'other'
+
+    ALL = (STATS, GET_FLOWS, SET_FLOW, OTHER)
+
+
+_ROUTES = (
+    ('PUT', re.compile(r'^/fstats/(?P<identifier>[^/]+)/flows/stat/?$'), ENDPOINT.STATS),
+    ('GET', re.compile(r'^/fstats/(?P<identifier>[^/]+)/flows/(?P<flow_type>[^/]+)/?$'), ENDPOINT.GET_FLOWS),
+    ('POST', re.compile(r'^/fstats/(?P<identifier>[^/]+)/flows/(?P<flow_id>[^/]+)/status/(?P<status>[^/]+)/?$'),
+     ENDPOINT.SET_FLOW),
+)
+
+
+def percentile(values: List[float],
+               q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+class _Flows:
+
+    def __init__(self, identifier: str):
+        """
+        the flows of a device as the backend sees them - "apply" until the agent reports "applied", "remove"
+        until it reports "removed"
+        """
+        self.identifier = identifier
+        self.flows: Dict[str, Dict[str, Any]] = {}
+        self._churn_due = 0.0
+        self._updated = time.monotonic()
+
+    def _new_flow(self, index: int) -> Dict[str, Any]:
+        return {
+            'chain': 'prerouting',
+            'action': 'drop',
+            'protocol': 'udp',
+            'src-address': f'10.{(index >> 16) & 0xff}.{(index >> 8) & 0xff}.{index & 0xff}/32',
+            'dst-address': '192.0.2.1/32',
+            'dst-port': str(1024 + index % 60000),
+        }
+
+    def reconcile(self,
+                  target: int,
+                  churn: float,
+                  next_id):
+        now = time.monotonic()
+        self._churn_due += churn * (now - self._updated) / 60
+        self._updated = now
+        active = [_ for _, flow in self.flows.items() if flow['status'] in ('apply', 'applied')]
+        replaced = min(int(self._churn_due), len(active))
+        self._churn_due -= replaced
+        # the oldest flows are withdrawn first
+        withdrawn = active[:replaced] + active[replaced:][target:]
+        for flow_id in withdrawn:
+            flow = self.flows[flow_id]
+            if flow['status'] == 'apply':
+                # never reached the router
+                del self.flows[flow_id]
+            else:
+                flow['status'] = 'remove'
+        for _ in range(max(target - (len(active) - len(withdrawn)), 0)):
+            index = next_id()
+            self.flows[f'{index:024x}'] = dict(rule=self._new_flow(index), status='apply', created=time.time())
+
+    def get(self, flow_type: str) -> List[Dict[str, Any]]:
+        statuses = ('applied',) if flow_type == 'applied' else \
+                   (flow_type,) if flow_type in ('apply', 'remove') else ('apply', 'remove')
+        return [dict(flow['rule'], id=flow_id, status=flow['status'], created_at=flow['created'])
+                for flow_id, flow in self.flows.items() if flow['status'] in statuses]
+
+    def set_status(self,
+                   flow_id: str,
+                   status: str) -> Optional[float]:
+        """
+        returns the time to mitigate of a newly applied flow
+        """
+        flow = self.flows.get(flow_id)
+        if flow is None:
+            return None
+        if status == 'applied' and flow['status'] == 'apply':
+            flow['status'] = 'applied'
+            return time.time() - flow['created']
+        if status == 'removed':
+            del self.flows[flow_id]
+        return None
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        self.server.count(length)
+        code, body, endpoint = self.server.handle(self.command, self.path, body=body)
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.observe(endpoint, code, time.perf_counter() - start)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SecunityApiServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self,
+                 *args,
+                 latency: Optional[Union[float, List[float]]] = None,
+                 error_rate: Optional[float] = None,
+                 flows: Optional[int] = None,
+                 churn: Optional[float] = None,
+                 seed: Optional[int] = None,
+                 **kwargs):
+        """
+        A local mock of the agent endpoints (/fstats/{identifier}/flows/...) - stats uploads, flows of the devices
+        and their status updates, with injectable latency and errors. Every device gets the configured number of
+        flows on its first request
+        """
+        super().__init__(*args, **kwargs)
+        self.requests = 0
+        self.bytes_received = 0
+        self._settings = {_: SECUNITY_API_DEFAULTS[_] for _ in SCENARIO_KEYS}
+        self.configure(latency=latency, error_rate=error_rate, flows=flows, churn=churn)
+        if seed is None:
+            seed = SECUNITY_API_DEFAULTS[SECUNITY_API_DEFAULTS_KEYS.SEED]
+        self._random = random.Random(seed)
+        self._devices: Dict[str, _Flows] = {}
+        self._next_flow = 0
+        self._started = time.monotonic()
+        # (seconds since start, endpoint, status code, seconds)
+        self._samples: List[Tuple[float, str, int, float]] = []
+        # (seconds since start, time to mitigate)
+        self._time_to_mitigate: List[Tuple[float, float]] = []
+        # (seconds since start, the timings reported by the agent)
+        self._reported_timings: List[Tuple[float, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # clients stopped in the middle of a request
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self, size: int):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += size
+
+    def configure(self, **settings):
+        for key, value in settings.items():
+            if key not in SCENARIO_KEYS:
+                raise ValueError(f'invalid setting: "{key}"')
+            if value is not None:
+                self._settings[key] = value
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return dict(self._settings)
+
+    def run_scenario(self, steps: List[Dict[str, Any]]) -> threading.Thread:
+        """
+        applies every step ({"at": <seconds>, <setting>: <value>...}) at its offset from now
+        """
+        steps = sorted(steps, key=lambda _: _.get('at', 0))
+
+        def _run():
+            start = time.monotonic()
+            for step in steps:
+                delay = step.get('at', 0) - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+                self.configure(**{k: v for k, v in step.items() if k != 'at'})
+
+        thread = threading.Thread(target=_run, name='secunity-api-scenario', daemon=True)
+        thread.start()
+        return thread
+
+    def _next_flow_id(self) -> int:
+        self._next_flow += 1
+        return self._next_flow
+
+    def _reconcile(self, device: _Flows):
+        device.reconcile(target=self._settings[SECUNITY_API_DEFAULTS_KEYS.FLOWS],
+                         churn=self._settings[SECUNITY_API_DEFAULTS_KEYS.CHURN],
+                         next_id=self._next_flow_id)
+
+    def reconcile(self):
+        """
+        creates and withdraws the flows of the known devices - flows appear independently of the agent's polls, so
+        the time to mitigate includes the wait for the next poll
+        """
+        with self._lock:
+            for device in self._devices.values():
+                self._reconcile(device)
+
+    def _sleep(self):
+        latency = self._settings[SECUNITY_API_DEFAULTS_KEYS.LATENCY]
+        if isinstance(latency, (list, tuple)):
+            latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def handle(self,
+               method: str,
+               path: str,
+               body: Optional[bytes] = None) -> Tuple[int, Any, str]:
+        path = path.split('?')[0]
+        match, endpoint = None, ENDPOINT.OTHER
+        for _method, regex, _endpoint in _ROUTES:
+            match = regex.match(path) if _method == method else None
+            if match:
+                endpoint = _endpoint
+                break
+        self._sleep()
+        if match is None:
+            return 404, {'error': 'not found'}, endpoint
+        if self._random.random() < self._settings[SECUNITY_API_DEFAULTS_KEYS.ERROR_RATE]:
+            return 500, {'error': 'injected error'}, endpoint
+        if endpoint == ENDPOINT.STATS:
+            return 200, {}, endpoint
+        params = match.groupdict()
+        with self._lock:
+            device = self._devices.get(params['identifier'])
+            if device is None:
+                device = self._devices[params['identifier']] = _Flows(params['identifier'])
+                self._reconcile(device)
+            if endpoint == ENDPOINT.GET_FLOWS:
+                return 200, device.get(params['flow_type']), endpoint
+            time_to_mitigate = device.set_status(params['flow_id'], params['status'])
+            if time_to_mitigate is not None:
+                self._time_to_mitigate.append((time.monotonic() - self._started, time_to_mitigate))
+                timings = self._parse_timings(body)
+                if timings:
+                    self._reported_timings.append((time.monotonic() - self._started, timings))
+        return 200, {}, endpoint
+
+    @staticmethod
+    def _parse_timings(body: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        try:
+            timings = json.loads(body).get('timings') if body else None
+        except (ValueError, AttributeError):
+            return None
+        return timings if isinstance(timings, dict) else None
+
+    def observe(self,
+                endpoint: str,
+                code: int,
+                seconds: float):
+        with self._lock:
+            self._samples.append((time.monotonic() - self._started, endpoint, code, seconds))
+
+    def summary(self,
+                since: Optional[float] = None,
+                until: Optional[float] = None) -> Dict[str, Any]:
+        """
+        requests, errors and latency percentiles per endpoint and the time to mitigate (as measured by the
+        backend and as reported by the agent) of the flows applied between since and until (seconds since the
+        server started)
+        """
+        since = since or 0.0
+        until = until if until is not None else float('inf')
+        with self._lock:
+            samples = [_ for _ in self._samples if since <= _[0] < until]
+            time_to_mitigate = [_[1] for _ in self._time_to_mitigate if since <= _[0] < until]
+            reported = [_[1] for _ in self._reported_timings if since <= _[0] < until]
+            flows = {identifier: len(device.flows) for identifier, device in self._devices.items()}
+        result = {}
+        for endpoint in ENDPOINT.ALL:
+            seconds = [_[3] for _ in samples if _[1] == endpoint]
+            if not seconds:
+                continue
+            result[endpoint] = dict(requests=len(seconds),
+                                    errors=sum(1 for _ in samples if _[1] == endpoint and _[2] >= 400),
+                                    p50_ms=percentile(seconds, 50) * 1000,
+                                    p99_ms=percentile(seconds, 99) * 1000)
+        return dict(endpoints=result,
+                    time_to_mitigate=dict(flows=len(time_to_mitigate),
+                                          p50=percentile(time_to_mitigate, 50),
+                                          p99=percentile(time_to_mitigate, 99)),
+                    reported_timings={key: dict(flows=len(values), p50=percentile(values, 50),
+                                                p99=percentile(values, 99))
+                                      for key in ('created_to_applied_seconds', 'seen_to_applied_seconds')
+                                      for values in [[_[key] for _ in reported if key in _]]},
+                    flows=flows)
+
+    @property
+    def uptime(self) -> float:
+        return time.monotonic() - self._started
+
+
+def start_api_server(host: Optional[str] = '127.0.0.1',
+                     port: Optional[int] = 0,
+                     reconcile_interval: Optional[float] = 1.0,
+                     **kwargs) -> SecunityApiServer:
+    server = SecunityApiServer((host, port), _RequestHandler, **kwargs)
+    threading.Thread(target=server.serve_forever, name='secunity-api', daemon=True).start()
+
+    def _reconcile():
+        while True:
+            time.sleep(reconcile_interval)
+            server.reconcile()
+
+    threading.Thread(target=_reconcile, name='secunity-api-reconcile', daemon=True).start()
+    return server
+
+
+def _run_in_process(params: Dict[str, Any],
+                    ready: Any,
+                    port: Any):
+    server = start_api_server(**params)
+    port.value = server.server_port
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def start_in_process(**kwargs) -> Tuple[multiprocessing.Process, int]:
+    """
+    runs the server in another process - its CPU and memory are not measured with the agent's.
+    returns the process and the port
+    """
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    port = context.Value('i', 0)
+    process = context.Process(target=_run_in_process, args=(kwargs, ready, port), name='secunity-api', daemon=True)
+    process.start()
+    if not ready.wait(timeout=60):
+        process.terminate()
+        raise RuntimeError('the secunity api server did not start')
+    return process, port.value
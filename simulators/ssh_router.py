@@ -0,0 +1,372 @@
+import multiprocessing
+import random
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional, Union, TYPE_CHECKING
+
+from common.enums import VENDOR
+from simulators.outputs import HUAWEI_PROMPT, arista_output, cisco_output, flowspec_rules, huawei_routing_table, \
+    huawei_statistics, juniper_output
+
+if TYPE_CHECKING:
+    import paramiko
+
+
+class SSH_ROUTER_DEFAULTS_KEYS:
+    HOST = 'host'
+    PORT = 'port'
+    USERNAME = 'username'
+    PASSWORD = 'password'
+    RULES = 'rules'
+    LATENCY = 'latency'
+    ERROR_RATE = 'error_rate'
+    SEED = 'seed'
+
+
+SSH_ROUTER_DEFAULTS = {
+    SSH_ROUTER_DEFAULTS_KEYS.HOST: '127.0.0.1',
+    SSH_ROUTER_DEFAULTS_KEYS.PORT: 0,  # a free port
+    SSH_ROUTER_DEFAULTS_KEYS.USERNAME: 'secunity',
+    SSH_ROUTER_DEFAULTS_KEYS.PASSWORD: 'secunity',
+    SSH_ROUTER_DEFAULTS_KEYS.RULES: 100,
+    SSH_ROUTER_DEFAULTS_KEYS.LATENCY: 0.0,  # seconds per command
+    # share of the commands answered by closing the channel
+    SSH_ROUTER_DEFAULTS_KEYS.ERROR_RATE: 0.0,
+    SSH_ROUTER_DEFAULTS_KEYS.SEED: 0,
+}
+
+
+SSH_VENDORS = (VENDOR.CISCO, VENDOR.ARISTA, VENDOR.JUNIPER, VENDOR.HUAWEI)
+
+# read_and_wait reads the shell in chunks of this size
+_SHELL_CHUNK_SIZE = 1024
+
+_juniper_filter_regex = re.compile(r'__flowspec_(?P<interface>\S+)_(?P<inet>inet6?)__')
+_huawei_statistics_regex = re.compile(r'statistics\s+(?P<index>\d+)')
+
+
+def rules_for_bytes(vendor: Union[VENDOR, str],
+                    output_bytes: int,
+                    seed: Optional[int] = 0) -> int:
+    """
+    the number of rules of an output of about output_bytes
+    """
+    sample = 100
+    rules = flowspec_rules(sample, seed=seed)
+    if VENDOR.parse(vendor) == VENDOR.HUAWEI:
+        size = len(huawei_routing_table(rules)) + sum(len(huawei_statistics(_)) for _ in rules)
+    else:
+        size = len(RouterOutputs(vendor, rules=sample, seed=seed).output(_sample_command(vendor)) or '')
+    return max(int(output_bytes * sample / max(size, 1)), 1)
+
+
+def _sample_command(vendor: str) -> str:
+    return {
+        VENDOR.CISCO: 'show flowspec vrf all ipv4 detail',
+        VENDOR.ARISTA: 'sh flow-spec ipv4',
+        VENDOR.JUNIPER: 'show firewall filter detail __flowspec_default_inet__',
+    }[VENDOR.parse(vendor)]
+
+
+class RouterOutputs:
+
+    def __init__(self,
+                 vendor: Union[VENDOR, str],
+                 rules: Optional[int] = None,
+                 seed: Optional[int] = None):
+        """
+        The outputs of the flowspec commands the command workers send
+        """
+        self.vendor = VENDOR.parse(vendor)
+        if self.vendor not in SSH_VENDORS:
+            raise ValueError(f'unsupported vendor: "{self.vendor}"')
+        count = rules if rules is not None else SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.RULES]
+        if seed is None:
+            seed = SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.SEED]
+        self._rules = {ip_type: flowspec_rules(count, seed=seed, ip_type=ip_type) for ip_type in ('IPv4', 'IPv6')}
+        self._cache: Dict[str, str] = {}
+
+    def output(self, command: str) -> Optional[str]:
+        """
+        None for an unknown command
+        """
+        command = command.strip()
+        result = self._cache.get(command)
+        if result is None:
+            result = self._output(command)
+            # the statistics of a single huawei rule are not worth caching
+            if result is not None and self.vendor != VENDOR.HUAWEI:
+                self._cache[command] = result
+        return result
+
+    def _output(self, command: str) -> Optional[str]:
+        ip_type = 'IPv6' if re.search(r'ipv6|inet6|vpnv6', command) else 'IPv4'
+        rules = self._rules[ip_type]
+        if self.vendor == VENDOR.CISCO and command.startswith('show flowspec'):
+            return cisco_output(rules, ip_type=ip_type)
+        elif self.vendor == VENDOR.ARISTA and command.startswith('sh flow-spec'):
+            return arista_output(rules, ip_type=ip_type)
+        elif self.vendor == VENDOR.JUNIPER and command.startswith('show firewall'):
+            match = _juniper_filter_regex.search(command)
+            return juniper_output(rules, ip_type=ip_type, interface_name=match.group('interface') if match else 'default')
+        elif self.vendor == VENDOR.HUAWEI and command.startswith('display'):
+            if 'routing-table' in command:
+                return huawei_routing_table(rules)
+            match = _huawei_statistics_regex.search(command)
+            if match and 0 < int(match.group('index')) <= len(rules):
+                return huawei_statistics(rules[int(match.group('index')) - 1])
+        return None
+
+
+class SshRouterSimulator:
+
+    def __init__(self,
+                 vendor: Union[VENDOR, str],
+                 rules: Optional[int] = None,
+                 latency: Optional[float] = None,
+                 host: Optional[str] = None,
+                 port: Optional[int] = None,
+                 username: Optional[str] = None,
+                 password: Optional[str] = None,
+                 seed: Optional[int] = None,
+                 error_rate: Optional[float] = None,
+                 counters: Optional[Dict[str, Any]] = None,
+                 **kwargs):
+        """
+        A local SSH server that answers the flowspec commands like a router of vendor - exec requests for cisco,
+        arista and juniper, an interactive shell with a prompt for huawei.
+        counters may hold shared multiprocessing values (see start_in_process)
+        """
+        self.outputs = RouterOutputs(vendor, rules=rules, seed=seed)
+        self.vendor = self.outputs.vendor
+        self.latency = latency if latency is not None else SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.LATENCY]
+        self.host = host or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.HOST]
+        self.username = username or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.USERNAME]
+        self.password = password or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.PASSWORD]
+        self._port = port if port is not None else SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.PORT]
+        self.error_rate = error_rate or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.ERROR_RATE]
+        self._random = random.Random(SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.SEED] if seed is None else seed)
+        self._counters = counters
+        self._stats = dict(connections=0, commands=0, bytes_sent=0, errors=0)
+        self._stats_lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._host_key = None
+        self._stopped = threading.Event()
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1] if self._socket else self._port
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def credentials(self) -> Dict[str, Any]:
+        return dict(host=self.host, port=self.port, username=self.username, password=self.password,
+                    vendor=self.vendor)
+
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self._stats[key] += value
+        if self._counters is not None:
+            with self._counters[key].get_lock():
+                self._counters[key].value += value
+
+    def start(self) -> 'SshRouterSimulator':
+        import paramiko
+
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self._port))
+        self._socket.listen(128)
+        threading.Thread(target=self._accept, name='ssh-router-accept', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._socket:
+            self._socket.close()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), name='ssh-router-client', daemon=True).start()
+
+    def _serve(self, client: socket.socket):
+        import paramiko
+
+        self._count('connections')
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self._host_key)
+        # a channel is closed when it is garbage collected
+        channels = []
+        try:
+            transport.start_server(server=_get_server_interface_class()(self))
+            while transport.is_active() and not self._stopped.is_set():
+                # the channels are served by the exec/shell threads
+                channel = transport.accept(timeout=1)
+                if channel is not None:
+                    channels.append(channel)
+        except Exception:
+            pass
+        finally:
+            transport.close()
+
+    def _send(self, channel: 'paramiko.Channel', data: str):
+        body = data.encode('utf-8')
+        channel.sendall(body)
+        self._count('bytes_sent', len(body))
+
+    def _respond(self, command: str) -> Optional[str]:
+        self._count('commands')
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self._count('errors')
+            # the channel is closed by the caller
+            raise ConnectionAbortedError(f'dropped command "{command}"')
+        return self.outputs.output(command)
+
+    def exec_command(self, channel: 'paramiko.Channel', command: str):
+        try:
+            output = self._respond(command)
+            if output is None:
+                channel.sendall_stderr(f'% Invalid input detected: "{command}"\n'.encode('utf-8'))
+                channel.send_exit_status(1)
+            else:
+                self._send(channel, output.replace('\n', '\r\n'))
+                channel.send_exit_status(0)
+            # eof instead of close - paramiko replies to the exec request after this thread was started,
+            # a closed channel fails the request. the client closes the channel
+            channel.shutdown_write()
+        except Exception:
+            channel.close()
+
+    def _shell_prompt(self, output: str) -> str:
+        """
+        read_and_wait looks for the prompt in every chunk it reads - pad the response so the prompt is not split
+        between two chunks
+        """
+        output = output.replace('\n', '\r\n')
+        prompt = f'\r\n{HUAWEI_PROMPT}'
+        padding = -(len(output.encode('utf-8')) + len(prompt)) % _SHELL_CHUNK_SIZE
+        return f'{output}{" " * padding}{prompt}'
+
+    def shell(self, channel: 'paramiko.Channel'):
+        try:
+            self._send(channel, self._shell_prompt('Info: The max number of VTY users is 10.\n'))
+            buffer = b''
+            while not self._stopped.is_set():
+                data = channel.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                while b'\n' in buffer:
+                    line, buffer = buffer.split(b'\n', 1)
+                    command = line.decode('utf-8').strip()
+                    if not command:
+                        continue
+                    output = self._respond(command)
+                    if output is None:
+                        output = f'Error: Unrecognized command found at \'^\' position.\n'
+                    self._send(channel, self._shell_prompt(output))
+        except Exception:
+            pass
+        finally:
+            channel.close()
+
+
+_server_interface_class = None
+
+
+def _get_server_interface_class():
+    """
+    paramiko is imported on first use
+    """
+    global _server_interface_class
+    if _server_interface_class is not None:
+        return _server_interface_class
+    import paramiko
+
+    class ServerInterface(paramiko.ServerInterface):
+
+        def __init__(self, simulator: SshRouterSimulator):
+            self._simulator = simulator
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            if username == self._simulator.username and password == self._simulator.password:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+            return True
+
+        def check_channel_exec_request(self, channel, command):
+            command = command.decode('utf-8') if isinstance(command, bytes) else command
+            threading.Thread(target=self._simulator.exec_command, args=(channel, command), daemon=True).start()
+            return True
+
+        def check_channel_shell_request(self, channel):
+            threading.Thread(target=self._simulator.shell, args=(channel,), daemon=True).start()
+            return True
+
+    _server_interface_class = ServerInterface
+    return _server_interface_class
+
+
+COUNTERS = ('connections', 'commands', 'bytes_sent', 'errors')
+
+
+def _run_in_process(params: Dict[str, Any],
+                    counters: Dict[str, Any],
+                    ready: Any,
+                    port: Any):
+    simulator = SshRouterSimulator(counters=counters, **params).start()
+    port.value = simulator.port
+    ready.set()
+    while True:
+        time.sleep(3600)
+
+
+def start_in_process(vendor: Union[VENDOR, str],
+                     **kwargs):
+    """
+    runs the simulator in another process - its CPU and memory are not measured with the agent's.
+    returns the process, the credentials and the shared counters
+    """
+    context = multiprocessing.get_context('spawn')
+    counters = {_: context.Value('q', 0) for _ in COUNTERS}
+    ready = context.Event()
+    port = context.Value('i', 0)
+    params = dict(kwargs, vendor=vendor)
+    process = context.Process(target=_run_in_process, args=(params, counters, ready, port),
+                              name=f'ssh-router-{vendor}', daemon=True)
+    process.start()
+    if not ready.wait(timeout=60):
+        process.terminate()
+        raise RuntimeError(f'the {vendor} ssh router simulator did not start')
+    credentials = dict(host=kwargs.get('host') or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.HOST],
+                       port=port.value,
+                       username=kwargs.get('username') or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.USERNAME],
+                       password=kwargs.get('password') or SSH_ROUTER_DEFAULTS[SSH_ROUTER_DEFAULTS_KEYS.PASSWORD],
+                       vendor=str(VENDOR.parse(vendor)))
+    return process, credentials, counters
+
+
+def read_counters(counters: Dict[str, Any]) -> Dict[str, int]:
+    return {k: v.value for k, v in counters.items()}
@@ -0,0 +1,26 @@
+import os
+from typing import Dict, Optional
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_usage(pid: Optional[int] = None) -> Optional[Dict[str, float]]:
+    """
+    RSS, CPU seconds, threads and open file descriptors of a process (linux /proc), None when it is gone
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # the command may contain spaces, the fields start after its closing parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * _PAGE_SIZE
+        fds = len(os.listdir(f'/proc/{pid}/fd'))
+    except (OSError, IndexError, ValueError):
+        return None
+    return dict(rss_mib=rss / 2 ** 20,
+                cpu_seconds=(int(fields[11]) + int(fields[12])) / _CLOCK_TICKS,
+                threads=int(fields[17]),
+                fds=fds)
@@ -0,0 +1,153 @@
+import base64
+import os
+import types
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from common import cloud_db
+
+MONGODB_PARAMS = dict(host='mongo.test', username='agent', password='secret')
+CIPHER_KEY = base64.b64encode(b'k' * 32).decode('utf-8')
+
+
+def _encrypt(word: str) -> str:
+    from Crypto.Cipher import AES
+
+    iv = os.urandom(AES.block_size)
+    cipher = AES.new(base64.b64decode(CIPHER_KEY), AES.MODE_CFB, iv)
+    return base64.b64encode(iv + cipher.encrypt(word.encode('utf-8'))).decode('utf-8')
+
+
+def _device(agent_id: ObjectId, host: str, password: str = 'router-password'):
+    return {
+        'vendor': 'cisco',
+        'model': None,
+        'default_stats_interface_name': 'vrf1',
+        'client': {'flowspec': {
+            'stats_settings': {'use_agent': True, 'agent_id': agent_id},
+            'ssh_settings': {'username': 'admin', 'password': _encrypt(password), 'ip': host, 'port': 22},
+        }},
+    }
+
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cloud_db, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def db(clock):
+    client = mongomock.MongoClient()
+    cloud_db.get_mongo_client(MONGODB_PARAMS, client=client)
+    db = cloud_db.get_mongo_db(MONGODB_PARAMS)
+    db.SecunitySettings.insert_one({'_id': cloud_db.CLOUD_DB_DEFAULTS[cloud_db.CLOUD_DB_DEFAULTS_KEYS.CIPHER_KEY_ID],
+                                    'value': CIPHER_KEY})
+    yield db
+    cloud_db.invalidate_credentials()
+    cloud_db.close_mongo_clients()
+
+
+@pytest.fixture
+def device_lookups(monkeypatch):
+    """
+    counts the single device queries (find_one of AccountNetworkDevices)
+    """
+    calls = []
+    find_one = mongomock.collection.Collection.find_one
+
+    def _find_one(self, *args, **kwargs):
+        if self.name == 'AccountNetworkDevices':
+            calls.append(args)
+        return find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'find_one', _find_one)
+    return calls
+
+
+def test_credentials_are_served_from_cache_within_ttl(db, device_lookups):
+    agent_id = ObjectId()
+    db.AccountNetworkDevices.insert_one(_device(agent_id, '10.0.0.1'))
+
+    first = cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)
+    second = cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)
+
+    assert first == second
+    assert first['host'] == '10.0.0.1'
+    assert first['password'] == 'router-password'
+    assert len(device_lookups) == 1
+
+
+def test_expired_credentials_are_reloaded(db, clock, device_lookups):
+    agent_id = ObjectId()
+    db.AccountNetworkDevices.insert_one(_device(agent_id, '10.0.0.1'))
+    cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)
+    db.AccountNetworkDevices.update_one({'client.flowspec.stats_settings.agent_id': agent_id},
+                                        {'$set': {'client.flowspec.ssh_settings.ip': '10.0.0.2'}})
+
+    clock.now += 30
+    assert cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)['host'] == '10.0.0.1'
+    clock.now += 31
+    assert cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)['host'] == '10.0.0.2'
+    assert len(device_lookups) == 2
+
+
+def test_invalidate_credentials_forces_a_reload(db, device_lookups):
+    agent_id = ObjectId()
+    db.AccountNetworkDevices.insert_one(_device(agent_id, '10.0.0.1'))
+    cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)
+    db.AccountNetworkDevices.update_one({'client.flowspec.stats_settings.agent_id': agent_id},
+                                        {'$set': {'client.flowspec.ssh_settings.password': _encrypt('rotated')}})
+
+    cloud_db.invalidate_credentials(str(agent_id))
+
+    assert cloud_db.get_device_credentials(MONGODB_PARAMS, str(agent_id), ttl=60)['password'] == 'rotated'
+    assert len(device_lookups) == 2
+
+
+def test_load_devices_credentials_in_one_query(db, monkeypatch):
+    agent_ids = [ObjectId() for _ in range(3)]
+    for i, agent_id in enumerate(agent_ids):
+        db.AccountNetworkDevices.insert_one(_device(agent_id, f'10.0.1.{i + 1}'))
+    # not polled by an agent
+    db.AccountNetworkDevices.insert_one(dict(_device(ObjectId(), '10.0.1.99'),
+                                             client={'flowspec': {'stats_settings': {'use_agent': False}}}))
+    queries = []
+    find = mongomock.collection.Collection.find
+
+    def _find(self, *args, **kwargs):
+        queries.append(args)
+        return find(self, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'find', _find)
+
+    result = cloud_db.load_devices_credentials(db, [str(_) for _ in agent_ids] + [str(agent_ids[0]), str(ObjectId())])
+
+    device_queries = [_ for _ in queries if '$in' in str(_)]
+    assert len(device_queries) == 1
+    assert sorted(result) == sorted(str(_) for _ in agent_ids)
+    assert {_['host'] for _ in result.values()} == {'10.0.1.1', '10.0.1.2', '10.0.1.3'}
+    assert all(_['password'] == 'router-password' for _ in result.values())
+
+
+def test_preload_credentials_fills_the_cache(db, device_lookups):
+    agent_ids = [str(ObjectId()) for _ in range(2)]
+    for i, agent_id in enumerate(agent_ids):
+        db.AccountNetworkDevices.insert_one(_device(ObjectId(agent_id), f'10.0.2.{i + 1}'))
+
+    assert cloud_db.preload_credentials(db, agent_ids, ttl=60) == 2
+    for agent_id in agent_ids:
+        assert cloud_db.get_device_credentials(MONGODB_PARAMS, agent_id, ttl=60)
+    assert not device_lookups
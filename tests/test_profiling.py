@@ -0,0 +1,23 @@
+from common.consts import PROGRAM
+from common.profiling import PROFILE_MODE, Profiler
+
+
+def test_trigger_file_per_program(tmp_path):
+    applier = Profiler(folder=str(tmp_path), program=PROGRAM.FLOWS_APPLIER)
+    sync = Profiler(folder=str(tmp_path), program=PROGRAM.FLOWS_SYNC)
+    (tmp_path / f'trigger-{PROGRAM.FLOWS_SYNC}').write_text('1 memory')
+
+    assert applier._acquire() is None
+    assert (tmp_path / f'trigger-{PROGRAM.FLOWS_SYNC}').exists()
+    assert sync._acquire() == PROFILE_MODE.MEMORY
+    assert not (tmp_path / f'trigger-{PROGRAM.FLOWS_SYNC}').exists()
+
+
+def test_configured_trigger_file_and_top_allocations(tmp_path):
+    trigger_file = tmp_path / 'profile-now'
+    profiler = Profiler(folder=str(tmp_path), trigger_file=str(trigger_file), top_allocations=5,
+                        program=PROGRAM.STATS_FETCHER)
+    trigger_file.touch()
+
+    assert profiler._acquire() == PROFILE_MODE.CPU
+    assert profiler._top_allocations == 5
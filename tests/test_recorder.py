@@ -0,0 +1,26 @@
+import pytest
+
+from common.recorder import Sanitizer
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('ip route 10.2.3.4/24 next-hop 10.2.3.5', 'ip route 198.18.0.1/24 next-hop 198.18.0.2'),
+    ('source fe80::1/64 destination 2a00:1:2::3', 'source 2001:db8::1/64 destination 2001:db8::2'),
+    ('mapped ::ffff:10.2.3.4 and 10.2.3.4', 'mapped 2001:db8::1 and 198.18.0.2'),
+    ('embedded 64:ff9b::10.2.3.4/96', 'embedded 2001:db8::1/96'),
+    ('route to fe80::1.', 'route to 2001:db8::1.'),
+    ('uptime 12:30:45 mask 255.255.255.0 any 0.0.0.0 ::', 'uptime 12:30:45 mask 255.255.255.0 any 0.0.0.0 ::'),
+])
+def test_line_addresses(line, expected):
+    assert Sanitizer().line(line) == expected
+
+
+def test_line_same_address_same_replacement():
+    sanitizer = Sanitizer()
+    first = sanitizer.line('peer ::ffff:10.2.3.4 up')
+    assert sanitizer.line('peer ::ffff:10.2.3.4 down') == first.replace('up', 'down')
+
+
+def test_line_secrets_and_prompt():
+    sanitizer = Sanitizer(secrets=['edge-router-1', 'admin'])
+    assert sanitizer.line('<edge-router-1>display bgp peer user admin') == '<router>display bgp peer user secret'
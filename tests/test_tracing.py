@@ -0,0 +1,19 @@
+import json
+
+from common import tracing
+from workers.flows_applier import FlowsApplier
+from workers.flows_sync import FlowsSync
+
+
+def test_traces_file_per_program(tmp_path):
+    for worker in (FlowsApplier, FlowsSync):
+        assert tracing.init_tracing(enabled=True, module=worker.module_name(), folder=str(tmp_path), buffer_size=0)
+        try:
+            with tracing.trace('iteration', worker=worker.module_name(), device='d1'):
+                pass
+        finally:
+            tracing.stop_tracing()
+
+    for worker in (FlowsApplier, FlowsSync):
+        lines = (tmp_path / f'{worker.module_name()}-traces.jsonl').read_text().splitlines()
+        assert [json.loads(_)['attrs']['worker'] for _ in lines] == [worker.module_name()]
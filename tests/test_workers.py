@@ -0,0 +1,25 @@
+import pytest
+
+from common.consts import PROGRAM
+from common.metrics_server import program_metrics_port
+from workers.device_controller import DeviceController
+from workers.flows_applier import FlowsApplier
+from workers.flows_sync import FlowsSync
+from workers.stats_fetcher import StatsFetcher
+
+WORKERS = (StatsFetcher, FlowsApplier, FlowsSync, DeviceController)
+
+
+def test_program_per_worker():
+    assert sorted(_.module_name() for _ in WORKERS) == sorted(PROGRAM.ALL)
+
+
+@pytest.mark.parametrize('worker', WORKERS)
+def test_heartbeat_name_is_program(worker):
+    assert worker.heartbeat_name() == worker.module_name()
+
+
+def test_metrics_port_per_program():
+    ports = [program_metrics_port(9100, _.module_name()) for _ in WORKERS]
+    assert sorted(ports) == list(range(9100, 9100 + len(WORKERS)))
+    assert program_metrics_port(9100, FlowsSync.module_name()) == 9102
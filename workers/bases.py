@@ -1,30 +1,43 @@
+import copy
 import os
+import sys
 from abc import ABC, abstractmethod
 import datetime
 import time
 from typing import Union, Optional, Dict, Callable, Any, Tuple, List
 
-import paramiko.ssh_exception
-
-try:
-    import jstyleson as json
-except:
-    import json
-from dateutil.parser import parse as date_parse
-
 from common.consts import DEFAULTS, DEFAULT_KEYS
 from command_workers import init_command_worker
 from command_workers.bases import ICommandWorker, TCommandWorker
 from common.api_secunity import URL_SETTING_KEY, URL_SETTING_DEFAULTS
+from common.circuit_breaker import CircuitBreaker
 from common.configs import load_env_settings, parse_config_file, update_config_types
 from common.enums import VENDOR
-from common.files_handler import FILE, read_file, write_line, MODE
+from common.flow_queue import FlowQueue
+from common.flows import FlowTimings
+from common.heartbeats import HEARTBEAT_TARGET, HEARTBEAT_OUTCOME, get_heartbeat_store, init_heartbeat_store
 from common.logs import Log, LException
-from common.schedulers import add_job, start_scheduler, shutdown_scheduler
-from common.sshutils import get_ssh_credentials_from_config
+from common.metrics import counter, histogram
+from common.profiling import profile_iteration
+from common.sshutils import get_ssh_credentials_from_config, is_connectivity_error, is_ssh_exception
+from common.tracing import span, trace
 from common.utils import get_float
 
 
+_ITERATION_SECONDS = histogram('secunity_iteration_duration_seconds',
+                               'Duration of worker iterations',
+                               labelnames=('worker',))
+_ITERATION_ERRORS = counter('secunity_iteration_errors_total',
+                            'Worker iterations that raised an error',
+                            labelnames=('worker',))
+_ITERATIONS_SKIPPED = counter('secunity_iterations_skipped_total',
+                              'Skipped worker iterations',
+                              labelnames=('worker', 'reason'))
+_FLOWS = counter('secunity_flows_total',
+                 'Flows applied to or removed from the router',
+                 labelnames=('worker', 'action', 'outcome'))
+
+
 class BaseWorker(ABC):
 
     @classmethod
@@ -34,19 +47,36 @@ class BaseWorker(ABC):
 
     _argparse_params: Union[tuple, list] = tuple()
     _seconds_interval: int = -1
+    # config key that overrides _seconds_interval, None when the interval of the worker is fixed
+    _interval_key: Optional[str] = None
+    # whether router connectivity failures open a per device circuit breaker that skips iterations
+    _uses_breaker: bool = False
     _argparse_title: str = None
+    # vendors of the devices handled by the worker when a list of devices is configured, None for all
+    _devices_vendors: Optional[Tuple[str, ...]] = None
 
     def __init__(self, *args, **kwargs):
         self._identifier = None
         self._args: Dict[str, Any] = self.initialize_start(**kwargs)
-        try:
-            self._vendor = VENDOR.parse(self._args.get('vendor', 'unknown'))
-        except Exception as ex:
-            Log.warning(f'failed to parse vendor - error: "{str(ex)}"')
-            self._vendor = ''
+        self._vendor = self._parse_vendor(self._args)
         self._model = self._args.get('model')
         self._jobs = []
         self._command_worker = None
+        self._breaker: Optional[CircuitBreaker] = None
+        self._flow_timings: Optional[FlowTimings] = None
+        self._flow_queue: Optional[FlowQueue] = None
+        self._devices: Optional[List['BaseWorker']] = None
+
+    @staticmethod
+    def _parse_vendor(args: Dict[str, Any]) -> str:
+        if not args.get('vendor') and args.get('cloud'):
+            # cloud mode devices get their vendor with the credentials from the db
+            return ''
+        try:
+            return VENDOR.parse(args.get('vendor', 'unknown'))
+        except Exception as ex:
+            Log.warning(f'failed to parse vendor - error: "{str(ex)}"')
+            return ''
 
     def initialize_start(self, **kwargs) -> dict:
         # argsparse_params = self.get_argsparse_params(title=self._argparse_title, **kwargs)
@@ -64,9 +94,132 @@ class BaseWorker(ABC):
         args = update_config_types(config=args)
         enabled = args.get('log') is True or args.get('verbose') is True
         Log.initialize(module=self.module_name(), enabled=enabled, **args)
+        init_heartbeat_store(path=args.get('heartbeats_path'), flush_ms=args.get('heartbeats_flush_ms'))
         self._identifier = args.get('identifier')
         return args
 
+    def for_device(self, device: Dict[str, Any]) -> 'BaseWorker':
+        """
+        a copy of the worker for one entry of the "devices" config list - the entry overrides the top level
+        settings (identifier, host, vendor, credentials...)
+        """
+        args = {k: v for k, v in self._args.items() if k != 'devices'}
+        args.update(device)
+        worker = copy.copy(self)
+        worker._args = update_config_types(config=args)
+        worker._identifier = worker._args.get('identifier')
+        worker._vendor = self._parse_vendor(worker._args)
+        worker._model = worker._args.get('model')
+        worker._jobs = []
+        worker._command_worker = None
+        worker._breaker = None
+        worker._flow_timings = None
+        worker._flow_queue = None
+        worker._devices = None
+        return worker
+
+    @property
+    def devices(self) -> List['BaseWorker']:
+        """
+        a worker per configured device, or the worker itself when no "devices" list is configured
+        """
+        if self._devices is not None:
+            return self._devices
+        devices = self._args.get('devices')
+        if not devices:
+            self._devices = [self]
+            return self._devices
+        if not isinstance(devices, list):
+            Log.error_raise(f'devices must be a list, got "{type(devices)}"')
+        workers, identifiers = [], set()
+        for i, device in enumerate(devices):
+            if not isinstance(device, dict) or not device.get('identifier'):
+                Log.error(f'device #{i} is invalid (expected an object with an identifier) - skipping it')
+                continue
+            if device['identifier'] in identifiers:
+                Log.error(f'device "{device["identifier"]}" is configured more than once - skipping it')
+                continue
+            worker = self.for_device(device)
+            if self._devices_vendors and worker.vendor not in self._devices_vendors:
+                Log.debug(f'device "{worker.identifier}" ({worker.vendor}) is not handled by {self.module_name()}')
+                continue
+            identifiers.add(device['identifier'])
+            workers.append(worker)
+        self._devices = workers
+        return self._devices
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """
+        per device circuit breaker of the router connections - while open, iterations of the device are skipped
+        (only for workers with _uses_breaker)
+        """
+        if self._breaker is None:
+            self._breaker = CircuitBreaker(name=f'{self.heartbeat_name()}/{self._identifier or "-"}',
+                                           failure_threshold=self._args.get('breaker_failure_threshold'),
+                                           reset_timeout=self._args.get('breaker_reset_timeout'))
+        return self._breaker
+
+    @property
+    def flow_timings(self) -> FlowTimings:
+        """
+        per device times of the flows to apply, from their creation in the backend to their status report
+        """
+        if self._flow_timings is None:
+            self._flow_timings = FlowTimings(worker=self.module_name())
+        return self._flow_timings
+
+    @property
+    def flow_queue(self) -> FlowQueue:
+        """
+        per device flow operations by priority, the ones the time budget of an iteration did not reach are left to
+        the next iteration
+        """
+        if self._flow_queue is None:
+            self._flow_queue = FlowQueue(worker=self.module_name(),
+                                         device=self._identifier,
+                                         budget=self._args.get('flows_iteration_budget'),
+                                         interval=self.seconds_interval)
+        return self._flow_queue
+
+    def run_work(self, *args, **kwargs):
+        if self._uses_breaker and not self.breaker.allow():
+            Log.debug(f'skipping iteration of device "{self._identifier}" - circuit breaker is open')
+            _ITERATIONS_SKIPPED.inc(worker=self.module_name(), reason='breaker_open')
+            return None
+        start = time.perf_counter()
+        try:
+            with trace('iteration', worker=self.module_name(), device=self._identifier), \
+                    profile_iteration(f'{self.module_name()}-{self._identifier}'):
+                return self.work(*args, **kwargs)
+        except Exception as ex:
+            self._on_work_exception(ex)
+            return None
+        finally:
+            _ITERATION_SECONDS.observe(time.perf_counter() - start, worker=self.module_name())
+
+    async def run_work_async(self, *args, **kwargs):
+        if self._uses_breaker and not self.breaker.allow():
+            Log.debug(f'skipping iteration of device "{self._identifier}" - circuit breaker is open')
+            _ITERATIONS_SKIPPED.inc(worker=self.module_name(), reason='breaker_open')
+            return None
+        start = time.perf_counter()
+        try:
+            # the profile of an asyncio iteration includes the other devices running on the loop meanwhile
+            with trace('iteration', worker=self.module_name(), device=self._identifier), \
+                    profile_iteration(f'{self.module_name()}-{self._identifier}'):
+                return await self.work_async(*args, **kwargs)
+        except Exception as ex:
+            self._on_work_exception(ex)
+            return None
+        finally:
+            _ITERATION_SECONDS.observe(time.perf_counter() - start, worker=self.module_name())
+
+    def _on_work_exception(self, ex: Exception):
+        _ITERATION_ERRORS.inc(worker=self.module_name())
+        logged = f'logged - ' if isinstance(ex, LException) else ''
+        Log.exception(f'iteration of device "{self._identifier}" failed - {logged}error: "{str(ex)}"')
+
     def _initialize_url_settings(self,
                                  **kwargs) -> Dict[URL_SETTING_KEY, Any]:
         result = {
@@ -80,13 +233,16 @@ class BaseWorker(ABC):
                 seconds_interval: Optional[int] = None,
                 func_kwargs: Optional[Dict] = None,
                 start: Optional[bool] = True,
+                delay: Optional[float] = None,
                 **kwargs):
+        from common.schedulers import add_job
+
         if not func:
             func = self.work
         seconds_interval = get_float(seconds_interval if seconds_interval else self.seconds_interval)
         if not func_kwargs:
             func_kwargs = self.args
-        next_run_time = datetime.timedelta(seconds=2) if start else None
+        next_run_time = datetime.timedelta(seconds=2 + (delay or 0)) if start else None
         job = add_job(func=func,
                       interval=seconds_interval,
                       func_kwargs=func_kwargs,
@@ -94,6 +250,11 @@ class BaseWorker(ABC):
         self._jobs.append(job)
         return job
 
+    def remove_job(self, job):
+        if job in self._jobs:
+            self._jobs.remove(job)
+        job.remove()
+
     def _start_pre_infinite_loop(self):
         pass
 
@@ -112,29 +273,155 @@ class BaseWorker(ABC):
             add_job = True
         if start_job not in (True, False):
             start_job = True
-        start_scheduler(start=scheduler)
+        from common.aio import RUNTIME
+
+        self.init_runtime()
+        if scheduler and add_job and self.runtime == RUNTIME.ASYNCIO:
+            return self._start_asyncio(start_job=start_job)
+        from common.schedulers import start_scheduler, shutdown_scheduler
+
+        start_scheduler(start=scheduler, threadpool_size=self._args.get('max_concurrent_devices'))
         if add_job:
-            self.add_job(func=self.work,
-                         seconds_interval=self.seconds_interval,
-                         start=start_job)
+            devices = self.devices
+            if not devices:
+                Log.error_raise(f'no devices to handle by {self.module_name()}')
+            for i, device in enumerate(devices):
+                # every device has its own job (schedule), the first runs are spread over the interval
+                self.add_job(func=device.run_work,
+                             seconds_interval=device.seconds_interval,
+                             func_kwargs=device.args,
+                             start=start_job,
+                             delay=device.seconds_interval * i / len(devices))
+            if len(devices) > 1:
+                Log.info(f'{self.module_name()} started for {len(devices)} devices')
         self._start_pre_infinite_loop()
         if scheduler:
             try:
                 while True:
                     time.sleep(1)
-            except Exception as ex:
+            except (KeyboardInterrupt, SystemExit):
                 Log.warning(f'Stop signal received, shutting down')
                 shutdown_scheduler()
                 Log.warning('scheduler stopped')
                 Log.warning('quiting')
+            finally:
+                self.close_connections()
+
+    def init_runtime(self,
+                     module: Optional[str] = None,
+                     metrics_port: Optional[int] = None):
+        """
+        the process-wide services of the config - metrics server, tracing, profiling, recording and the parse pool.
+        module names the traces (default: the worker's), metrics_port overrides the port of the worker's program
+        """
+        from common.metrics_server import program_metrics_port, start_metrics_server
+        from common.parse_pool import init_parse_pool
+        from common.profiling import init_profiling
+        from common.recorder import init_recording
+        from common.tracing import init_tracing
+
+        if metrics_port is None:
+            metrics_port = program_metrics_port(self._args.get('metrics_port'), self.module_name())
+        start_metrics_server(port=metrics_port, host=self._args.get('metrics_host'))
+        init_tracing(enabled=self._args.get('tracing'),
+                     module=module or self.module_name(),
+                     folder=self._args.get('tracing_folder'),
+                     max_bytes=self._args.get('tracing_max_bytes'),
+                     backup_count=self._args.get('tracing_backup_count'),
+                     buffer_size=self._args.get('tracing_buffer_size'))
+        init_profiling(folder=self._args.get('profiles_folder'),
+                       iterations=self._args.get('profile_iterations'),
+                       mode=self._args.get('profile_mode'),
+                       trigger_file=self._args.get('profile_trigger_file'),
+                       max_overhead=self._args.get('profile_max_overhead'),
+                       top_allocations=self._args.get('profile_top_allocations'),
+                       program=module or self.module_name())
+        init_recording(folder=self._args.get('record_folder'),
+                       max_transcripts=self._args.get('record_max_transcripts'))
+        init_parse_pool(processes=self._args.get('parse_processes'), min_bytes=self._args.get('parse_min_bytes'))
+
+    @property
+    def runtime(self) -> str:
+        from common.aio import RUNTIME
+
+        try:
+            return RUNTIME.parse(self._args.get('runtime'))
+        except ValueError as ex:
+            return Log.error_raise(str(ex))
+
+    def _start_asyncio(self, start_job: Optional[bool] = True):
+        import asyncio
+
+        devices = self.devices
+        if not devices:
+            Log.error_raise(f'no devices to handle by {self.module_name()}')
+        Log.info(f'{self.module_name()} started for {len(devices)} devices (asyncio runtime)')
+        self._start_pre_infinite_loop()
+        try:
+            asyncio.run(self._run_devices_async(devices, start_job=start_job))
+        except (KeyboardInterrupt, SystemExit):
+            Log.warning(f'Stop signal received, shutting down')
+            Log.warning('quiting')
+        finally:
+            self.close_connections()
+
+    @staticmethod
+    def close_connections():
+        """
+        closes the process-wide router pools and db clients, only of the modules that were loaded
+        """
+        mikrotik = sys.modules.get('command_workers.mikrotik')
+        if mikrotik is not None:
+            mikrotik.MikrotikCommandWorker.close_connections()
+        cloud_db = sys.modules.get('common.cloud_db')
+        if cloud_db is not None:
+            cloud_db.close_mongo_clients()
+
+    async def _run_devices_async(self,
+                                 devices: List['BaseWorker'],
+                                 start_job: Optional[bool] = True):
+        import asyncio
+        from common.aio import init_executor
+        from common.api_secunity import close_sessions
+
+        init_executor(self._args.get('aio_executor_workers'))
+        semaphore = asyncio.Semaphore(self._args.get('max_concurrent_devices') or len(devices))
+        tasks = [
+            # like the scheduler jobs, the first runs are spread over the interval
+            asyncio.ensure_future(device._device_loop_async(
+                semaphore=semaphore,
+                delay=2 + device.seconds_interval * i / len(devices) if start_job else device.seconds_interval))
+            for i, device in enumerate(devices)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await close_sessions()
+
+    async def _device_loop_async(self,
+                                 semaphore: 'asyncio.Semaphore',
+                                 delay: float):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(delay)
+        while True:
+            started = loop.time()
+            async with semaphore:
+                await self.run_work_async(**self.args)
+            await asyncio.sleep(max(self.seconds_interval - (loop.time() - started), 0))
 
     @property
     def args(self) -> dict:
         return self._args
 
     @property
-    def seconds_interval(self) -> int:
-        return self._seconds_interval
+    def seconds_interval(self) -> Union[int, float]:
+        if not self._interval_key:
+            return self._seconds_interval
+        return get_float(self._args.get(self._interval_key), exception=False) or self._seconds_interval
 
     def _pre_validate_work_params(self, **kwargs) -> bool:
         if not self.identifier:
@@ -155,6 +442,14 @@ class BaseWorker(ABC):
     def work(self, *args, **kwargs):
         raise NotImplementedError()
 
+    async def work_async(self, *args, **kwargs):
+        """
+        asyncio runtime iteration - workers without an asyncio implementation run work() in the executor
+        """
+        from common.aio import run_blocking
+
+        return await run_blocking(self.work, *args, **kwargs)
+
     @classmethod
     def get_argsparse_params(cls,
                              title: str = None,
@@ -206,61 +501,59 @@ class BaseWorker(ABC):
                             *args, **kwargs):
         return False
 
-    @staticmethod
-    def _write_file(file: FILE,
-                    data: Optional[Union[str, Dict]] = None,
-                    now: Optional[datetime.datetime] = None):
-        if not now:
-            now = datetime.datetime.utcnow().isoformat()
-        if data:
-            if not isinstance(data, str):
-                data = json.dumps(data)
-            line = f'"{now}",{data}'
-        else:
-            line = now
-        write_line(file=file, line=line, lock=True, mode=MODE.WRITE)
-
-    @staticmethod
-    def _read_last_time(file: FILE,
+    @classmethod
+    def heartbeat_name(cls) -> str:
+        return cls.module_name()
+
+    def _write_heartbeat(self,
+                         target: Union[HEARTBEAT_TARGET, str],
+                         outcome: Union[HEARTBEAT_OUTCOME, str],
+                         **kwargs):
+        get_heartbeat_store().beat(worker=self.heartbeat_name(),
+                                   identifier=self._identifier,
+                                   target=target,
+                                   outcome=outcome)
+        if target == HEARTBEAT_TARGET.ROUTER and self._uses_breaker:
+            if outcome == HEARTBEAT_OUTCOME.SUCCESS:
+                self.breaker.record_success()
+            elif is_connectivity_error(kwargs.get('ex')):
+                # errors of a single command do not open the breaker
+                self.breaker.record_failure()
+
+    def _read_last_time(self,
+                        target: Union[HEARTBEAT_TARGET, str],
+                        outcome: Union[HEARTBEAT_OUTCOME, str],
                         **kwargs) -> Optional[datetime.datetime]:
-        lines = read_file(file=file, lock=True)
-        if not lines:
-            return None
-
-        def try_parse(date_str) -> Optional[datetime.datetime]:
-            try:
-                return date_parse(date_str.strip())
-            except:
-                return None
-
-        dt = next((try_parse(_) for _ in lines if try_parse(_)), None)
-        return dt
+        heartbeat = get_heartbeat_store().last(identifier=self._identifier,
+                                               target=target,
+                                               outcome=outcome)
+        return heartbeat.utc_datetime() if heartbeat else None
 
     def set_success_api_call(self, **kwargs):
-        self._write_file(file=FILE.SUCCESS_API, **kwargs)
+        self._write_heartbeat(target=HEARTBEAT_TARGET.API, outcome=HEARTBEAT_OUTCOME.SUCCESS, **kwargs)
 
     def set_failed_api_call(self,
                             **kwargs):
-        self._write_file(file=FILE.FAILED_API, **kwargs)
+        self._write_heartbeat(target=HEARTBEAT_TARGET.API, outcome=HEARTBEAT_OUTCOME.FAILED, **kwargs)
 
     def set_success_router_call(self,
                                 **kwargs):
-        self._write_file(file=FILE.SUCCESS_ROUTER, **kwargs)
+        self._write_heartbeat(target=HEARTBEAT_TARGET.ROUTER, outcome=HEARTBEAT_OUTCOME.SUCCESS, **kwargs)
 
     def set_failed_router_call(self, **kwargs):
-        self._write_file(file=FILE.FAILED_ROUTER, **kwargs)
+        self._write_heartbeat(target=HEARTBEAT_TARGET.ROUTER, outcome=HEARTBEAT_OUTCOME.FAILED, **kwargs)
 
     def get_last_success_api_call(self, **kwargs) -> Optional[datetime.datetime]:
-        return self._read_last_time(file=FILE.SUCCESS_API)
+        return self._read_last_time(target=HEARTBEAT_TARGET.API, outcome=HEARTBEAT_OUTCOME.SUCCESS)
 
     def get_last_failed_api_call(self, **kwargs) -> Optional[datetime.datetime]:
-        return self._read_last_time(file=FILE.FAILED_API)
+        return self._read_last_time(target=HEARTBEAT_TARGET.API, outcome=HEARTBEAT_OUTCOME.FAILED)
 
     def get_last_success_router_call(self, **kwargs) -> Optional[datetime.datetime]:
-        return self._read_last_time(file=FILE.SUCCESS_ROUTER)
+        return self._read_last_time(target=HEARTBEAT_TARGET.ROUTER, outcome=HEARTBEAT_OUTCOME.SUCCESS)
 
     def get_last_failed_router_call(self, **kwargs) -> Optional[datetime.datetime]:
-        return self._read_last_time(file=FILE.FAILED_ROUTER)
+        return self._read_last_time(target=HEARTBEAT_TARGET.ROUTER, outcome=HEARTBEAT_OUTCOME.FAILED)
 
     def get_flows_from_router(self,
                               command_worker: ICommandWorker,
@@ -275,31 +568,67 @@ class BaseWorker(ABC):
                                                          flow_number=flow_number,
                                                          vrf=kwargs.get('vrf'),
                                                          stats_type=kwargs.get('stats_type', 'IPv4'), model=kwargs.get('model'))
-        except paramiko.ssh_exception.AuthenticationException as cto_ex:
-            logged = f'logged - ' if isinstance(cto_ex, LException) else ''
-            Log.error(f'failed to get flows from the router - {logged}error: {str(cto_ex)}')
-            time_to_sleep: int = 60 * 10
-            Log.error(f'Authentication Error - Sleep for {str(time_to_sleep)} seconds')
-            time.sleep(time_to_sleep)
-            self.set_failed_router_call()
-            return None
-        except paramiko.ssh_exception.NoValidConnectionsError as ex:
-            time_to_sleep: int = 60
-            Log.error(f'No Connection Error - Sleep for {str(time_to_sleep)} seconds')
-            time.sleep(time_to_sleep)
-            logged = f'logged - ' if isinstance(ex, LException) else ''
-            Log.error(f'failed to get flows from the router - {logged}error: {str(ex)}')
-            self.set_failed_router_call()
+        except Exception as ex:
+            time_to_sleep = self._on_router_exception(ex)
+            if time_to_sleep:
+                time.sleep(time_to_sleep)
+            self.set_failed_router_call(ex=ex)
             return None
+
+        self.set_success_router_call()
+        return flows
+
+    async def get_flows_from_router_async(self,
+                                          command_worker: ICommandWorker,
+                                          resource: Optional = None,
+                                          credentials: Optional[Dict[str, Any]] = None,
+                                          flow_number: Optional[bool] = False,
+                                          *args, **kwargs) -> Optional[List[Dict[str, Any]]]:
+        import asyncio
+        from common.aio import run_blocking
+
+        params = dict(credentials=credentials,
+                      resource=resource,
+                      filter_by_prefix=True,
+                      flow_number=flow_number,
+                      vrf=kwargs.get('vrf'),
+                      stats_type=kwargs.get('stats_type', 'IPv4'), model=kwargs.get('model'))
+        try:
+            get_flows_async = getattr(command_worker, 'get_flows_from_router_async', None)
+            if get_flows_async:
+                flows = await get_flows_async(**params)
+            else:
+                flows = await run_blocking(command_worker.get_flows_from_router, **params)
         except Exception as ex:
-            logged = f'logged - ' if isinstance(ex, LException) else ''
-            Log.error(f'failed to get flows from the router - {logged}error: {str(ex)}')
-            self.set_failed_router_call()
+            time_to_sleep = self._on_router_exception(ex)
+            if time_to_sleep:
+                await asyncio.sleep(time_to_sleep)
+            self.set_failed_router_call(ex=ex)
             return None
 
         self.set_success_router_call()
         return flows
 
+    def _on_router_exception(self, ex: Exception) -> int:
+        """
+        logs a failed router call, returns the seconds to wait before the router is called again
+        """
+        logged = f'logged - ' if isinstance(ex, LException) else ''
+        Log.error(f'failed to get flows from the router - {logged}error: {str(ex)}')
+        if is_ssh_exception(ex, 'AuthenticationException'):
+            self._on_router_auth_failure()
+            time_to_sleep: int = 60 * 10
+            Log.error(f'Authentication Error - Sleep for {str(time_to_sleep)} seconds')
+            return time_to_sleep
+        if is_ssh_exception(ex, 'NoValidConnectionsError'):
+            time_to_sleep: int = 60
+            Log.error(f'No Connection Error - Sleep for {str(time_to_sleep)} seconds')
+            return time_to_sleep
+        return 0
+
+    def _on_router_auth_failure(self):
+        pass
+
     def remove_flow(self,
                     flow: Dict[str, Any],
                     command_worker: Optional[TCommandWorker] = None,
@@ -313,20 +642,29 @@ class BaseWorker(ABC):
                                                  credentials=credentials)
         flow_id = flow['id']
         try:
-            result = command_worker.remove_flow(flow=flow,
-                                                credentials=credentials,
-                                                resource=resource)
+            with span('flow.remove', flow=flow_id):
+                result = command_worker.remove_flow(flow=flow,
+                                                    credentials=credentials,
+                                                    resource=resource)
         except Exception as ex:
             logged = f'logged - ' if isinstance(ex, LException) else ''
             Log.exception(f'failed to get stats from router - {logged}error: "{str(ex)}"')
             self.set_failed_router_call()
+            _FLOWS.inc(worker=self.module_name(), action='remove', outcome='failed')
+            return False
+        if not result:
+            Log.error(f'failed to remove flow ({flow_id}) from the router')
+            self.set_failed_router_call()
+            _FLOWS.inc(worker=self.module_name(), action='remove', outcome='failed')
             return False
         self.set_success_router_call()
+        _FLOWS.inc(worker=self.module_name(), action='remove', outcome='success')
 
         try:
             result = command_worker.set_flow_status_api(identifier=self._identifier,
                                                         flow_id=flow_id,
-                                                        status='removed')
+                                                        status='removed',
+                                                        config=self.args)
         except Exception as ex:
             logged = f'logged - ' if isinstance(ex, LException) else ''
             Log.exception(f'failed to set flow status (api call) - {logged}error: "{str(ex)}"')
@@ -348,20 +686,31 @@ class BaseWorker(ABC):
             command_worker = init_command_worker(vendor=self.vendor,
                                                  credentials=credentials)
         try:
-            success = command_worker.apply_flow(flow=flow,
-                                                credentials=credentials,
-                                                resource=resource)
-            self.set_success_router_call()
+            with span('flow.apply', flow=flow_id):
+                success = command_worker.apply_flow(flow=flow,
+                                                    credentials=credentials,
+                                                    resource=resource)
         except Exception as ex:
             logged = f'logged - ' if isinstance(ex, LException) else ''
             Log.exception(f'failed to get stats from router - {logged}error: "{str(ex)}"')
             self.set_failed_router_call()
+            _FLOWS.inc(worker=self.module_name(), action='apply', outcome='failed')
             return False
+        if not success:
+            Log.error(f'failed to apply flow ({flow_id}) to the router')
+            self.set_failed_router_call()
+            _FLOWS.inc(worker=self.module_name(), action='apply', outcome='failed')
+            return False
+        self.set_success_router_call()
+        _FLOWS.inc(worker=self.module_name(), action='apply', outcome='success')
+        timings = self.flow_timings.applied(flow_id)
 
         try:
             result = command_worker.set_flow_status_api(identifier=self._identifier,
                                                         flow_id=flow_id,
-                                                        status='applied')
+                                                        status='applied',
+                                                        config=self.args,
+                                                        payload=FlowTimings.to_payload(timings))
         except Exception as ex:
             logged = f'logged - ' if isinstance(ex, LException) else ''
             Log.exception(f'failed to set flow status (api call) - {logged}error: "{str(ex)}"')
@@ -369,6 +718,8 @@ class BaseWorker(ABC):
             return False
 
         self.set_success_api_call()
+        if result is not None:
+            self.flow_timings.reported(flow_id)
         Log.debug(f'flow ({flow_id}) status was updated to backend')
         return True
 
@@ -4,6 +4,7 @@ from typing import Optional, Union, Dict, List, Any
 
 from command_workers.bases import ICommandWorker
 from common.consts import PROGRAM, BOOL_VALUES
+from common.heartbeats import get_heartbeat_store
 from common.logs import Log, LException
 from common.utils import get_float, strftime
 from workers.bases import BaseWorker
@@ -46,7 +47,8 @@ class DeviceController(BaseWorker):
                             f'"{type(remove_only_if_failed_requests)}"')
 
         now = datetime.datetime.utcnow()
-        min_time = now - seconds_limit
+        # heartbeats of other processes become visible up to one flush interval late
+        min_time = now - seconds_limit - get_heartbeat_store().flush_interval
         min_time_str = strftime(min_time)
 
         last_success_router = self.get_last_success_router_call() or datetime.datetime.min
@@ -0,0 +1,269 @@
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import signal
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from common.logs import Log, LException
+
+
+class FLEET_DEFAULTS_KEYS:
+    SHARDS = 'shards'
+    REBALANCE_INTERVAL = 'rebalance_interval'
+    VNODES = 'vnodes'
+    SUPERVISE_INTERVAL = 'supervise_interval'
+
+
+FLEET_DEFAULTS = {
+    FLEET_DEFAULTS_KEYS.SHARDS: 4,
+    FLEET_DEFAULTS_KEYS.REBALANCE_INTERVAL: 300,  # seconds
+    FLEET_DEFAULTS_KEYS.VNODES: 64,  # points on the ring per shard
+    FLEET_DEFAULTS_KEYS.SUPERVISE_INTERVAL: 5,  # seconds
+}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+def shard_name(shard: int) -> str:
+    return f'shard-{shard}'
+
+
+class HashRing:
+
+    def __init__(self,
+                 nodes: Iterable[str],
+                 vnodes: Optional[int] = None):
+        """
+        Consistent hash ring - adding or removing a node only moves the keys of that node, adding or removing a key
+        does not move any other key
+        """
+        vnodes = vnodes or FLEET_DEFAULTS[FLEET_DEFAULTS_KEYS.VNODES]
+        self._ring = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(vnodes))
+        if not self._ring:
+            Log.error_raise('hash ring has no nodes')
+        self._hashes = [_[0] for _ in self._ring]
+
+    def node(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._ring[index][1]
+
+
+def stagger_delay(key: str,
+                  interval: float) -> float:
+    """
+    a stable offset within the interval - a device keeps its slot in the schedule across rebalances
+    """
+    return (_hash(key) % 1000) / 1000 * interval
+
+
+def load_fleet_agent_ids(mongodb_params: Dict[str, Any]) -> List[str]:
+    from common.cloud_db import get_mongo_db
+
+    db = get_mongo_db(mongodb_params)
+    devices = db.AccountNetworkDevices.find({'client.flowspec.stats_settings.use_agent': True},
+                                            {'client.flowspec.stats_settings.agent_id': 1})
+    result = set()
+    for device in devices:
+        agent_id = device.get('client', {}).get('flowspec', {}).get('stats_settings', {}).get('agent_id')
+        if agent_id:
+            result.add(str(agent_id))
+    return sorted(result)
+
+
+class FleetShard:
+
+    def __init__(self,
+                 shard: int,
+                 shards: int,
+                 mongodb: Dict[str, Any],
+                 config: Optional[str] = None,
+                 rebalance_interval: Optional[int] = None,
+                 **kwargs):
+        """
+        Polls the agent-enabled devices that the hash ring assigns to this shard, the assignment is refreshed
+        every rebalance_interval seconds
+        """
+        self._shard = shard
+        self._name = shard_name(shard)
+        self._ring = HashRing(shard_name(_) for _ in range(shards))
+        self._mongodb = mongodb
+        self._config = config
+        self._rebalance_interval = rebalance_interval or \
+            FLEET_DEFAULTS[FLEET_DEFAULTS_KEYS.REBALANCE_INTERVAL]
+        self._device_args = {k: v for k, v in kwargs.items() if v is not None}
+        self._worker = None
+        self._jobs = {}
+
+    def _initialize(self):
+        from common.schedulers import start_scheduler
+        from workers.stats_fetcher import StatsFetcher
+
+        # a log file per shard, rotating a shared file from several processes corrupts it
+        Log.initialize(module=f'fleet-{self._name}', enabled=self._device_args.get('verbose') is True,
+                       **self._device_args)
+        self._worker = StatsFetcher(config=self._config)
+        port = self._worker.args.get('metrics_port')
+        # a metrics port per shard
+        self._worker.init_runtime(module=f'fleet-{self._name}', metrics_port=port + self._shard if port else None)
+        start_scheduler(threadpool_size=self._worker.args.get('max_concurrent_devices'))
+
+    def rebalance(self) -> bool:
+        try:
+            agent_ids = load_fleet_agent_ids(self._mongodb)
+        except Exception as ex:
+            logged = f'logged - ' if isinstance(ex, LException) else ''
+            Log.exception(f'{self._name} failed to load the fleet devices, keeping the current devices - '
+                          f'{logged}error: "{str(ex)}"')
+            return False
+        assigned = {_ for _ in agent_ids if self._ring.node(_) == self._name}
+        removed = [_ for _ in self._jobs if _ not in assigned]
+        added = sorted(_ for _ in assigned if _ not in self._jobs)
+        self._preload_credentials(assigned)
+        for agent_id in removed:
+            self._worker.remove_job(self._jobs.pop(agent_id))
+        for agent_id in added:
+            device = self._worker.for_device(dict(self._device_args,
+                                                  identifier=agent_id,
+                                                  cloud=True,
+                                                  mongodb=self._mongodb))
+            self._jobs[agent_id] = self._worker.add_job(func=device.run_work,
+                                                        seconds_interval=device.seconds_interval,
+                                                        func_kwargs=device.args,
+                                                        delay=stagger_delay(agent_id, device.seconds_interval))
+        if removed or added:
+            Log.info(f'{self._name} rebalanced - {len(self._jobs)} devices ({len(added)} added, '
+                     f'{len(removed)} removed) of {len(agent_ids)}')
+        return True
+
+    def _preload_credentials(self, agent_ids: Iterable[str]):
+        """
+        one query for the credentials of the whole shard instead of a query per device iteration
+        """
+        from common.cloud_db import get_mongo_db, preload_credentials
+
+        try:
+            # valid until the next rebalance refreshes them
+            ttl = self._worker.args.get('credentials_ttl') or 2 * self._rebalance_interval
+            count = preload_credentials(get_mongo_db(self._mongodb), agent_ids, ttl=ttl)
+            Log.debug(f'{self._name} preloaded the credentials of {count} devices')
+        except Exception as ex:
+            logged = f'logged - ' if isinstance(ex, LException) else ''
+            Log.exception(f'{self._name} failed to preload credentials - {logged}error: "{str(ex)}"')
+
+    def run(self):
+        self._initialize()
+        while True:
+            self.rebalance()
+            time.sleep(self._rebalance_interval)
+
+
+def _run_shard(shard: int,
+               shards: int,
+               params: Dict[str, Any]):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        FleetShard(shard=shard, shards=shards, **params).run()
+    except KeyboardInterrupt:
+        pass
+
+
+class FleetRunner:
+
+    def __init__(self,
+                 shards: Optional[int] = None,
+                 supervise_interval: Optional[float] = None,
+                 **kwargs):
+        """
+        Starts a process per shard and restarts shards that exit
+        """
+        self._shards = shards or FLEET_DEFAULTS[FLEET_DEFAULTS_KEYS.SHARDS]
+        if self._shards <= 0:
+            Log.error_raise(f'invalid number of shards: "{self._shards}"')
+        self._supervise_interval = supervise_interval or \
+            FLEET_DEFAULTS[FLEET_DEFAULTS_KEYS.SUPERVISE_INTERVAL]
+        self._params = kwargs
+        # spawn - the shards must not inherit the parent's threads and locks
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: Dict[int, multiprocessing.Process] = {}
+
+    def _start_shard(self, shard: int):
+        # not daemonic - a shard starts the processes of its parse pool. stop() terminates the shards
+        process = self._context.Process(target=_run_shard,
+                                        args=(shard, self._shards, self._params),
+                                        name=shard_name(shard),
+                                        daemon=False)
+        process.start()
+        self._processes[shard] = process
+        Log.info(f'{shard_name(shard)} started - pid: {process.pid}')
+
+    def stop(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def run(self):
+        def _on_sigterm(signum, frame):
+            raise KeyboardInterrupt()
+
+        signal.signal(signal.SIGTERM, _on_sigterm)
+        for shard in range(self._shards):
+            self._start_shard(shard)
+        try:
+            while True:
+                time.sleep(self._supervise_interval)
+                for shard, process in list(self._processes.items()):
+                    if not process.is_alive():
+                        Log.warning(f'{shard_name(shard)} exited (code: {process.exitcode}) - restarting it')
+                        self._start_shard(shard)
+        except KeyboardInterrupt:
+            Log.warning(f'Stop signal received, shutting down')
+        finally:
+            self.stop()
+            Log.warning('quiting')
+
+
+def main():
+    # Set the default values
+    MDB_HOST = '172.17.1.153'
+    MDB_PORT = 27017
+    MDB_USER = 'admin'
+    MDB_AUTH_SOURCE = 'admin'
+
+    args = argparse.ArgumentParser(description='Secunity\'s Cloud Stats Fetcher Fleet')
+    args.add_argument('--host', dest='host', default=MDB_HOST)
+    args.add_argument('--port', dest='port', default=MDB_PORT)
+    args.add_argument('--user', dest='user', default=MDB_USER)
+    args.add_argument('--authSource', dest='authSource', default=MDB_AUTH_SOURCE)
+    args.add_argument('--password', dest='password', required=True, default=None)
+    args.add_argument('--config', dest='config', default=None, help='config file (interval, api settings...)')
+    args.add_argument('--shards', dest='shards', type=int, default=FLEET_DEFAULTS[FLEET_DEFAULTS_KEYS.SHARDS],
+                      help='number of worker processes')
+    args.add_argument('--rebalance-interval', dest='rebalance_interval', type=int,
+                      default=FLEET_DEFAULTS[FLEET_DEFAULTS_KEYS.REBALANCE_INTERVAL],
+                      help='seconds between reloads of the fleet devices')
+    args.add_argument('--interval', dest='interval', type=int, default=None, help='seconds between device polls')
+    args.add_argument('-v', '--verbose', dest='verbose', default=True)
+
+    args_dict = vars(args.parse_args())
+    args_dict['mongodb'] = dict(
+        host=args_dict.pop('host'),
+        port=args_dict.pop('port'),
+        username=args_dict.pop('user'),
+        authSource=args_dict.pop('authSource'),
+        password=args_dict.pop('password')
+    )
+    Log.initialize(module='fleet', enabled=args_dict.get('verbose') is True)
+    FleetRunner(**args_dict).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ from abc import ABC
 from command_workers.mikrotik import MikrotikCommandWorker
 from common.consts import PROGRAM
 from common.enums import FLOW_TYPE, VENDOR
+from common.flow_queue import FLOW_OPERATION
 from common.flows import default_callback__get_flow_status
 from common.logs import Log, LException
 from workers.bases import BaseWorker
@@ -23,6 +24,8 @@ class BaseFlowsApplier(BaseWorker, ABC):
 
     _filter_flows_to_handle_statuses = tuple()
 
+    _devices_vendors = (VENDOR.MIKROTIK,)
+
     def _parse_flow_type(self,
                          flow_type: Optional[Union[FLOW_TYPE, str]] = None,
                          **kwargs) -> Union[FLOW_TYPE, str]:
@@ -98,8 +101,11 @@ class BaseFlowsApplier(BaseWorker, ABC):
             self.set_failed_api_call()
             return self.report_task_failure()
         self.set_success_api_call()
+        self.flow_timings.track(flows_by_status)
 
         if not flows_by_status:
+            # nothing is left to do
+            self.flow_queue.update({})
             return self.report_task_success()
 
         try:
@@ -166,36 +172,34 @@ class BaseFlowsApplier(BaseWorker, ABC):
         flows_by_status_str = self.flows_by_status_str(flows_by_status)
         Log.debug(f'after filter, {total_flows} flows remain. breakdown by status: {flows_by_status_str}')
 
+        # the flows left by the previous iteration are polled again, they keep their place in the queue
+        queue = self.flow_queue
+        queue.update(flows_by_status)
         success_flows, failed_flows = [], []
-        for status, flows in flows_by_status.items():
-            Log.debug(f'starting to handle {len(flows)} flows of status "{status}"')
-            for flow in flows:
-                if status in ('apply', 'applied'):
-                    func = self.apply_flow
-                elif status in ('remove', 'removed'):
-                    func = self.remove_flow
-                else:
-                    Log.error(f'invalid flow status: "{status}"')
-                    continue
-                try:
-                    result = func(flow=flow,
-                                  command_worker=command_worker,
-                                  resource=resource,
-                                  credentials=credentials)
-                except Exception as ex:
-                    logged = f'logged - ' if isinstance(ex, LException) else ''
-                    Log.exception(f'failed to handle flow - action: "{func.__name__}" - {logged}error: "{str(ex)}"')
-                    result = None
-                if result:
-                    self.set_success_router_call()
-                    success_flows.append(flow)
-                else:
-                    self.set_failed_router_call()
-                    failed_flows.append(flow)
+        for operation, flow in queue.run():
+            flow_id = flow.get('id')
+            func = self.apply_flow if operation == FLOW_OPERATION.APPLY else self.remove_flow
+            try:
+                result = func(flow=flow,
+                              command_worker=command_worker,
+                              resource=resource,
+                              credentials=credentials)
+            except Exception as ex:
+                logged = f'logged - ' if isinstance(ex, LException) else ''
+                Log.exception(f'failed to handle flow - action: "{func.__name__}" - {logged}error: "{str(ex)}"')
+                result = None
+            if result:
+                self.set_success_router_call()
+                success_flows.append(flow)
+                queue.done(operation, flow_id)
+            else:
+                self.set_failed_router_call()
+                failed_flows.append(flow)
 
         Log.debug(f'finished handling {total_flows} flows - breakdown by status: {flows_by_status_str} - '
                   f'success: {len(success_flows)} - '
-                  f'failed - {len(failed_flows)}')
+                  f'failed - {len(failed_flows)} - '
+                  f'left to the next iteration: {len(queue) - len(failed_flows)}')
         return len(failed_flows) == 0
 
 
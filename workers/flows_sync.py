@@ -2,6 +2,7 @@ import datetime
 from typing import Optional, Dict, List, Any
 
 from command_workers.mikrotik import MikrotikCommandWorker
+from common.consts import PROGRAM
 from common.enums import FLOW_TYPE
 from common.flows import default_callback__get_flow_status
 from common.logs import Log, LException
@@ -14,6 +15,10 @@ class FlowsSync(BaseFlowsApplier):
     _flow_type = FLOW_TYPE.APPLIED
     _filter_flows_to_handle_statuses = tuple()
 
+    @classmethod
+    def module_name(cls) -> str:
+        return PROGRAM.FLOWS_SYNC
+
     def handle_flows(self,
                      flows_by_status: Dict[str, List[Dict[str, Any]]],
                      command_worker: Optional[MikrotikCommandWorker],
@@ -1,33 +1,32 @@
 import argparse
 import datetime
+import json
+import time
 from typing import List, Optional, Dict, Any
 
-from common.api_secunity import send_request, REQUEST_TYPE
+from common.api_secunity import send_request, send_request_async, REQUEST_TYPE, ApiConnectionError
+from common.cloud_db import get_device_credentials, invalidate_credentials
 from common.consts import PROGRAM
 from common.logs import Log, LException
+from common.serializers import encode_json, iter_stats_chunks
+from common.spool import Spool, get_spool, SPOOL_DEFAULTS, SPOOL_DEFAULTS_KEYS
+from common.tracing import span
 from common.utils import is_bool
 from workers.bases import BaseWorker
 
 
-def decrypt_symetric(db, word, key=None):
-    from Crypto.Cipher import AES
-    import base64
-    if isinstance(word, str):
-        word = word.encode('utf-8')
-    if key is None:
-        key = db.SecunitySettings.find_one('cipher-symetric_default')['value']
+class STATS_UPLOAD_DEFAULTS_KEYS:
+    CHUNK_BYTES = 'stats_chunk_bytes'
+    CHUNK_RETRIES = 'stats_chunk_retries'
+    RETRY_DELAY = 'retry_delay'
 
-    word = base64.b64decode(word)
-    iv = word[0:AES.block_size]
-    cipher = AES.new(base64.b64decode(key), AES.MODE_CFB, iv)
-    return cipher.decrypt(word[16:]).decode('utf-8')
 
+STATS_UPLOAD_DEFAULTS = {
+    STATS_UPLOAD_DEFAULTS_KEYS.CHUNK_BYTES: 2 * 1024 * 1024,
+    STATS_UPLOAD_DEFAULTS_KEYS.CHUNK_RETRIES: 2,
+    STATS_UPLOAD_DEFAULTS_KEYS.RETRY_DELAY: 1,  # seconds, doubled on every retry
+}
 
-def decrypt(db, word):
-    try:
-        return decrypt_symetric(db, word=word)
-    except Exception as ex:
-        return word
 
 class StatsFetcher(BaseWorker):
 
@@ -40,12 +39,21 @@ class StatsFetcher(BaseWorker):
     _argparse_title: str = 'Secunity\'s On-Prem Statistics Fetcher'
 
     _seconds_interval = 60
+    # the flows workers keep their own intervals
+    _interval_key = 'interval'
+    _uses_breaker = True
+
+    def _stats_request_params(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        params = dict(request_type=REQUEST_TYPE.SEND_STATS,
+                      identifier=self._identifier,
+                      payload=payload)
+        params.update({k: v for k, v in self.args.items() if k not in params})
+        return params
 
     def report_task_failure(self, *args, **kwargs):
         try:
             result = self.wrap_result(success=False, payload=list(args), cur_time=True)
-            params = dict(request_type=REQUEST_TYPE.SEND_STATS, identifier=self._identifier, payload=result)
-            params.update({k: v for k, v in self.args.items() if k not in params})
+            params = self._stats_request_params(result)
 
             result = send_request(config=self.args, **params)
 
@@ -55,6 +63,19 @@ class StatsFetcher(BaseWorker):
             Log.error(err_msg)
             return None
 
+    async def report_task_failure_async(self, *args, **kwargs):
+        try:
+            result = self.wrap_result(success=False, payload=list(args), cur_time=True)
+            params = self._stats_request_params(result)
+
+            result = await send_request_async(config=self.args, **params)
+
+            return result
+        except Exception as e:
+            err_msg = f'failed report_task_failure - "{str(e)}"'
+            Log.error(err_msg)
+            return None
+
     def work(self, credentials: Optional[Dict[str, Any]] = None, *args, **kwargs):
         Log.debug('starting a new iteration')
         start_time = datetime.datetime.utcnow()
@@ -62,20 +83,7 @@ class StatsFetcher(BaseWorker):
         if not self._pre_validate_work_params(**kwargs):
             return self.report_task_failure()
 
-        vrf = kwargs.get('vrf')
-        model = kwargs.get('model')
-        if kwargs.get('cloud'):
-            db_credentials = self._get_credentials_from_db(kwargs.get('mongodb'))
-            if db_credentials:
-                dvrf = db_credentials.pop('vrf', None)
-                dmodel = db_credentials.pop('model', None)
-                vrf = dvrf if dvrf else vrf
-                model = dmodel if dmodel else model
-                credentials = db_credentials
-            else:
-                err_msg = f'failed to get credentials from db'
-                Log.error(err_msg)
-                # return self.report_task_failure(err_msg)
+        credentials, vrf, model = self._resolve_work_params(credentials, **kwargs)
 
         command_worker = self.init_command_worker(credentials=credentials)
         if not command_worker:
@@ -84,28 +92,107 @@ class StatsFetcher(BaseWorker):
             return self.report_task_failure(err_msg)
 
         Log.debug(f'Get flows: vendor: "{self.vendor}", IPv4 vrf: "{vrf}", Model: "{model}"')
-        pres = self._perform_flows(command_worker, credentials, vrf, 'IPv4', model=model)
+        with span('stats', stats_type='IPv4'):
+            pres = self._perform_flows(command_worker, credentials, vrf, 'IPv4', model=model)
         if not pres:
             Log.error(f'Failed to get flows for IPv4: {pres}')
             return self.report_task_failure()
 
         Log.debug(f'Get flows: vendor: "{self.vendor}", IPv6 vrf: "{vrf}", Model: "{model}"')
-        pres = self._perform_flows(command_worker, credentials, vrf, 'IPv6', model=model)
+        with span('stats', stats_type='IPv6'):
+            pres = self._perform_flows(command_worker, credentials, vrf, 'IPv6', model=model)
         if not pres:
             Log.error(f'Failed to get flows for IPv6: {pres}')
             return self.report_task_failure()
 
+        self._replay_spool()
+
         end_time = datetime.datetime.utcnow()
         Log.debug(f'finished iteration successfully - duration: "{(end_time-start_time).total_seconds():.2f}" seconds')
 
         return self.report_task_success()
 
-    def _perform_flows(self, command_worker, credentials, vrf, stats_type, model=None):
+    async def work_async(self, credentials: Optional[Dict[str, Any]] = None, *args, **kwargs):
+        from common.aio import run_blocking
+
+        Log.debug('starting a new iteration')
+        start_time = datetime.datetime.utcnow()
+
+        if not self._pre_validate_work_params(**kwargs):
+            return await self.report_task_failure_async()
+
+        # the db client is blocking
+        credentials, vrf, model = await run_blocking(self._resolve_work_params, credentials, **kwargs)
+
+        command_worker = self.init_command_worker(credentials=credentials)
+        if not command_worker:
+            err_msg = f'failed to initialize command_worker - vendor: "{self.vendor}"'
+            Log.error(err_msg)
+            return await self.report_task_failure_async(err_msg)
+
+        for stats_type in ('IPv4', 'IPv6'):
+            Log.debug(f'Get flows: vendor: "{self.vendor}", {stats_type} vrf: "{vrf}", Model: "{model}"')
+            with span('stats', stats_type=stats_type):
+                pres = await self._perform_flows_async(command_worker, credentials, vrf, stats_type, model=model)
+            if not pres:
+                Log.error(f'Failed to get flows for {stats_type}: {pres}')
+                return await self.report_task_failure_async()
+
+        await self._replay_spool_async()
+
+        end_time = datetime.datetime.utcnow()
+        Log.debug(f'finished iteration successfully - duration: "{(end_time-start_time).total_seconds():.2f}" seconds')
+
+        return self.report_task_success()
+
+    def _resolve_work_params(self, credentials: Optional[Dict[str, Any]] = None, **kwargs):
+        """
+        returns the credentials, vrf and model of the iteration - from the db in cloud mode
+        """
+        vrf = kwargs.get('vrf')
+        model = kwargs.get('model')
+        if kwargs.get('cloud'):
+            with span('credentials'):
+                db_credentials = self._get_credentials_from_db(kwargs.get('mongodb'))
+            if db_credentials:
+                dvrf = db_credentials.pop('vrf', None)
+                dmodel = db_credentials.pop('model', None)
+                vrf = dvrf if dvrf else vrf
+                model = dmodel if dmodel else model
+                credentials = db_credentials
+            else:
+                err_msg = f'failed to get credentials from db'
+                Log.error(err_msg)
+                # return self.report_task_failure(err_msg)
+        return credentials, vrf, model
+
+    def _wrap_stats(self, router_flows, stats_type):
+        """
+        returns the stats payload and None, or None and an error message
+        """
+        try:
+            with span('wrap', flows=len(router_flows)):
+                result = self.wrap_result(success=True,
+                                          payload=router_flows,
+                                          cur_time=True)
+            Log.debug(lambda: f'Flows res for {stats_type}: {result}')
+            return result, None
+        except Exception as ex:
+            logged = f'logged - ' if isinstance(ex, LException) else ''
+            err_msg = f'failed to wrap result to api - {logged}error: "{str(ex)}"'
+            Log.exception(err_msg)
+            return None, err_msg
+
+    @staticmethod
+    def _log_perform(credentials, stats_type):
         if credentials is not None:
             Log.debug(f'Perform for {stats_type}, {credentials.get("user")}@{credentials.get("host")}')
         else:
             Log.debug(f'Perform for {stats_type}')
 
+    def _perform_flows(self, command_worker, credentials, vrf, stats_type, model=None):
+        self._log_perform(credentials, stats_type)
+
         router_flows = self.get_flows_from_router(command_worker=command_worker,
                                                   credentials=credentials,
                                                   flow_number=True,
@@ -115,32 +202,192 @@ class StatsFetcher(BaseWorker):
             err_msg = f'an error occurred while trying to get flows from the router'
             Log.warning(err_msg)
             return self.report_task_failure(err_msg)
+        result, err_msg = self._wrap_stats(router_flows, stats_type)
+        if err_msg:
+            return self.report_task_failure(err_msg)
+        chunk_bytes = self._get_upload_setting(STATS_UPLOAD_DEFAULTS_KEYS.CHUNK_BYTES)
+        failed = False
+        for chunk in iter_stats_chunks(result, chunk_bytes=chunk_bytes):
+            if not failed and self._send_stats_chunk(chunk):
+                continue
+            # the chunk failed after all retries - spool it and every chunk after it
+            failed = True
+            self._spool_stats(chunk)
+        if failed:
+            self.set_failed_api_call()
+            return self.report_task_failure(f'failed to send {stats_type} stats to BE api')
+
+        self.set_success_api_call()
+
+        return self.report_task_success()
+
+    async def _perform_flows_async(self, command_worker, credentials, vrf, stats_type, model=None):
+        self._log_perform(credentials, stats_type)
+
+        router_flows = await self.get_flows_from_router_async(command_worker=command_worker,
+                                                              credentials=credentials,
+                                                              flow_number=True,
+                                                              vrf=vrf,
+                                                              stats_type=stats_type, model=model)
+        if router_flows is None:
+            err_msg = f'an error occurred while trying to get flows from the router'
+            Log.warning(err_msg)
+            return await self.report_task_failure_async(err_msg)
+        result, err_msg = self._wrap_stats(router_flows, stats_type)
+        if err_msg:
+            return await self.report_task_failure_async(err_msg)
+        chunk_bytes = self._get_upload_setting(STATS_UPLOAD_DEFAULTS_KEYS.CHUNK_BYTES)
+        failed = False
+        for chunk in iter_stats_chunks(result, chunk_bytes=chunk_bytes):
+            if not failed and await self._send_stats_chunk_async(chunk):
+                continue
+            failed = True
+            self._spool_stats(chunk)
+        if failed:
+            self.set_failed_api_call()
+            return await self.report_task_failure_async(f'failed to send {stats_type} stats to BE api')
+
+        self.set_success_api_call()
+
+        return self.report_task_success()
+
+    def _get_upload_setting(self, key: str) -> int:
+        value = self.args.get(key)
+        return value if value is not None else STATS_UPLOAD_DEFAULTS[key]
+
+    def _send_stats_chunk(self, payload: Dict[str, Any]) -> bool:
+        retries = max(self._get_upload_setting(STATS_UPLOAD_DEFAULTS_KEYS.CHUNK_RETRIES), 0)
+        delay = STATS_UPLOAD_DEFAULTS[STATS_UPLOAD_DEFAULTS_KEYS.RETRY_DELAY]
+        chunk_str = f'chunk {payload["chunk"] + 1}/{payload["chunks"]} ' if 'chunk' in payload else ''
+        for attempt in range(retries + 1):
+            if attempt:
+                Log.warning(f'retrying stats {chunk_str}upload in {delay} seconds ({attempt}/{retries})')
+                time.sleep(delay)
+                delay *= 2
+            try:
+                if self._send_stats(payload, raise_connection_error=True):
+                    return True
+            except ApiConnectionError:
+                # the spool replays it once the API is reachable
+                Log.warning(f'the API cannot be reached - not retrying the stats {chunk_str}upload')
+                return False
+        return False
+
+    async def _send_stats_chunk_async(self, payload: Dict[str, Any]) -> bool:
+        import asyncio
+
+        retries = max(self._get_upload_setting(STATS_UPLOAD_DEFAULTS_KEYS.CHUNK_RETRIES), 0)
+        delay = STATS_UPLOAD_DEFAULTS[STATS_UPLOAD_DEFAULTS_KEYS.RETRY_DELAY]
+        chunk_str = f'chunk {payload["chunk"] + 1}/{payload["chunks"]} ' if 'chunk' in payload else ''
+        for attempt in range(retries + 1):
+            if attempt:
+                Log.warning(f'retrying stats {chunk_str}upload in {delay} seconds ({attempt}/{retries})')
+                await asyncio.sleep(delay)
+                delay *= 2
+            try:
+                if await self._send_stats_async(payload, raise_connection_error=True):
+                    return True
+            except ApiConnectionError:
+                Log.warning(f'the API cannot be reached - not retrying the stats {chunk_str}upload')
+                return False
+        return False
+
+    def _send_stats(self,
+                    payload: Dict[str, Any],
+                    raise_connection_error: Optional[bool] = False) -> bool:
+        params = self._stats_request_params(payload)
         try:
-            result = self.wrap_result(success=True,
-                                      payload=router_flows,
-                                      cur_time=True)
-            Log.debug(f'Flows res for {stats_type}: {result}')
+            # send_request returns None when the request failed
+            return send_request(config=self.args, raise_connection_error=raise_connection_error, **params) is not None
+        except ApiConnectionError:
+            raise
         except Exception as ex:
             logged = f'logged - ' if isinstance(ex, LException) else ''
-            err_msg = f'failed to wrap result to api - {logged}error: "{str(ex)}"'
-            Log.exception(err_msg)
-            return self.report_task_failure(err_msg)
-        params = dict(request_type=REQUEST_TYPE.SEND_STATS,
-                      identifier=self._identifier,
-                      payload=result)
-        params.update({k: v for k, v in self.args.items() if k not in params})
+            Log.error(f'failed to send stats to BE api - {logged}error: "{str(ex)}"')
+            return False
+
+    async def _send_stats_async(self,
+                                payload: Dict[str, Any],
+                                raise_connection_error: Optional[bool] = False) -> bool:
+        params = self._stats_request_params(payload)
         try:
-            result = send_request(config=self.args, **params)
+            return await send_request_async(config=self.args, raise_connection_error=raise_connection_error,
+                                            **params) is not None
+        except ApiConnectionError:
+            raise
         except Exception as ex:
             logged = f'logged - ' if isinstance(ex, LException) else ''
-            err_msg = f'failed to send stats to BE api - {logged}error: "{str(ex)}"'
-            Log.error(err_msg)
-            self.set_failed_api_call()
-            return self.report_task_failure(err_msg)
+            Log.error(f'failed to send stats to BE api - {logged}error: "{str(ex)}"')
+            return False
 
-        self.set_success_api_call()
+    def _get_spool(self) -> Optional[Spool]:
+        if self.args.get('spool') is False:
+            return None
+        try:
+            return get_spool(name=f'{self.module_name()}-{self._identifier or "-"}',
+                             path=self.args.get('spool_path'),
+                             max_bytes=self.args.get('spool_max_bytes'),
+                             max_age=self.args.get('spool_max_age'),
+                             segment_bytes=self.args.get('spool_segment_bytes'))
+        except Exception as ex:
+            Log.exception(f'failed to open the stats spool - error: "{str(ex)}"')
+            return None
 
-        return self.report_task_success()
+    def _spool_stats(self, payload: Dict[str, Any]):
+        spool = self._get_spool()
+        if not spool:
+            return
+        try:
+            spool.append(encode_json(payload))
+            Log.warning(f'stats were spooled for a later upload - {spool.depth} payloads are waiting')
+        except Exception as ex:
+            Log.exception(f'failed to spool stats - error: "{str(ex)}"')
+
+    def _replay_spool(self):
+        """
+        uploads a batch of the oldest spooled stats, stops on the first failure (the API is still unavailable)
+        """
+        spool = self._get_spool()
+        if not spool or not spool.depth:
+            return
+        replayed = 0
+        with span('spool.replay', depth=spool.depth):
+            for record, payload in self._iter_spooled(spool):
+                if not self._send_stats(payload):
+                    self.set_failed_api_call()
+                    break
+                spool.ack(record)
+                replayed += 1
+        if replayed:
+            Log.info(f'replayed {replayed} spooled stats payloads - {spool.depth} are waiting')
+
+    async def _replay_spool_async(self):
+        spool = self._get_spool()
+        if not spool or not spool.depth:
+            return
+        replayed = 0
+        with span('spool.replay', depth=spool.depth):
+            for record, payload in self._iter_spooled(spool):
+                if not await self._send_stats_async(payload):
+                    self.set_failed_api_call()
+                    break
+                spool.ack(record)
+                replayed += 1
+        if replayed:
+            Log.info(f'replayed {replayed} spooled stats payloads - {spool.depth} are waiting')
+
+    def _iter_spooled(self, spool: Spool):
+        batch = self.args.get('spool_replay_batch') or SPOOL_DEFAULTS[SPOOL_DEFAULTS_KEYS.REPLAY_BATCH]
+        for record in spool.peek(limit=batch):
+            try:
+                payload = json.loads(record.body)
+                if isinstance(payload.get('local_time'), str):
+                    payload['local_time'] = datetime.datetime.fromisoformat(payload['local_time'])
+            except Exception as ex:
+                Log.error(f'dropping an invalid spooled payload - error: "{str(ex)}"')
+                spool.ack(record)
+                continue
+            yield record, payload
 
     @staticmethod
     def wrap_result(success: bool,
@@ -159,47 +406,24 @@ class StatsFetcher(BaseWorker):
 
     def _get_credentials_from_db(self, mongodb_params: Any):
         try:
-            from pymongo import MongoClient
-            from bson import ObjectId
-
-            usr = mongodb_params.get('username') or mongodb_params.get('user')
-            passwd = mongodb_params.get('password')
-            host = mongodb_params.get('host')
-            port = mongodb_params.get('port', 27017)
-            auth = mongodb_params.get('authSource') or 'admin'
-
-            Log.debug(f'get credentials from db - "{usr}@{host}:{port}/{auth}"')
-
-            uri = f"mongodb://{usr}:{passwd}@{host}:{port}/{auth}"
-            client = MongoClient(uri)
-
-            db = client[mongodb_params.get('db_name', 'secunity')]
-            acc_device = db.AccountNetworkDevices.find_one({
-                "client.flowspec.stats_settings.use_agent": True,
-                'client.flowspec.stats_settings.agent_id': ObjectId(self.identifier)
-            })
-            if not acc_device:
-                Log.error(f'failed to get account network device from db')
+            credentials = get_device_credentials(mongodb_params, self.identifier, ttl=self.args.get('credentials_ttl'))
+            if not credentials:
                 return None
-            ssh_usr = acc_device.get('client', {}).get('flowspec', {}).get('ssh_settings', {}).get('username')
-            password = acc_device.get('client', {}).get('flowspec', {}).get('ssh_settings', {}).get('password')
-            ssh_pass = decrypt(db, password)
-            ssh_host = acc_device.get('client', {}).get('flowspec', {}).get('ssh_settings', {}).get('ip')
-            ssh_port = acc_device.get('client', {}).get('flowspec', {}).get('ssh_settings', {}).get('port', 22)
-
-            vrf = acc_device.get('default_stats_interface_name')
 
-            self._vendor = acc_device.get('vendor')
-            self._model = acc_device.get('model')
+            self._vendor = credentials.get('vendor')
+            self._model = credentials.get('model')
 
-            Log.debug(f'Credentials from DB - "{ssh_usr}@{ssh_host}:{ssh_port}", vrf: "{vrf}", vendor: "{self._vendor}", model: "{self._model}"')
-
-            return dict(host=ssh_host, port=ssh_port, username=ssh_usr, password=ssh_pass, vrf=vrf, model=self._model, vendor=self._vendor) \
-                if ssh_usr and ssh_pass and ssh_host else None
+            return credentials
         except Exception as ex:
             Log.exception(f'failed to get credentials from db - "{str(ex)}"')
             return None
 
+    def _on_router_auth_failure(self):
+        if self.args.get('cloud'):
+            # the cached credentials (or the cipher key) may be stale
+            invalidate_credentials(self.identifier)
+
+
 def main():
     # Set the default values
     MDB_HOST = '172.17.1.153'